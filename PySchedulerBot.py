@@ -5,6 +5,7 @@
 
 #####  Imports  #####
 
+import argparse as ap
 import asyncio as asy
 import base64 as b64
 import discord as dis
@@ -16,7 +17,17 @@ import json
 import multiprocessing as mp
 import os
 import pathlib as pl
+import src.database.models as md
+import src.database.mongodbIfc as mdb
+import src.managers.EditMgr as em
+import src.managers.LeaseMgr as lm
 import src.managers.QueueMgr as qm
+import src.managers.RsvpMgr as rm
+import src.managers.SchedulerMgr as sm
+import src.managers.SyncMgr as syn
+import src.utilities.http_client as hc
+import src.utilities.msg_format as mf
+import src.utilities.shards as sh
 import threading as th
 import time
 from typing import Literal, Optional
@@ -33,6 +44,13 @@ default_params = {'cfg'       : 'config/config.json',
                   'bot_token' : ''}
 params = {}
 PSB_version = '0.0.1'    
+#Timer kind to the schedule's format field, the schedule's channel field, and
+#the format used when the schedule doesn't set one.  Empty channels fall back
+#to the event's own channel.
+timer_posts = {'start'      : ('annc_fmt', 'annc_ch', '%t is starting now!'),
+               'remind'     : ('rem_fmt',  'rem_ch',  '%t %a.'),
+               'end_remind' : ('',         'rem_ch',  '%t is ending soon.'),
+               'announce'   : ('annc_fmt', 'annc_ch', '%t %a.')}
 #This will be modified in the future to accept user-supplied paths.
 #This file must be loaded prior to the logger to allow for user-provided
 #options to be passed to the Logger.  Thus it must have special error
@@ -48,23 +66,50 @@ try:
 except OSError as err:
     print(f"Can't load the config file from path: {cred_path.absolute()}!")
     exit(-1)
+
+#Shard options on the command line override the config, so one config can be
+#shared by every process in a sharded deployment.
+arg_parser = ap.ArgumentParser(description="Runs the PyScheduler Discord bot.")
+arg_parser.add_argument('--shard-ids', default=params.get('shard_ids', ''),
+                        help="Shards this process runs, e.g. '0-3,7'.  Empty runs all of them.")
+arg_parser.add_argument('--shard-count', default=params.get('shard_count', ''),
+                        help="Total shards across every process.  Empty lets Discord decide.")
+cli_args, _ = arg_parser.parse_known_args()
+shard_ids   = sh.ParseIds(cli_args.shard_ids)
+shard_count = int(cli_args.shard_count) if str(cli_args.shard_count).strip() else None
+
+if shard_ids is not None and shard_count is None:
+    print(f"--shard-ids requires --shard-count so shard ranges don't overlap!")
+    exit(-1)
         
-job_queue = None
-worker    = None
+db           = None
+editor       = None
+http_client  = None
+job_queue    = None
+lease_keeper = None
+lease_task   = None
+rsvp         = None
+scheduler    = None
+shards       = None
+sync_mgr     = None
 
-class PSBClient(dis.Client):
-    def __init__(self, *, intents: dis.Intents):
+class PSBClient(dis.AutoShardedClient):
+    def __init__(self, *, intents: dis.Intents, shard_ids: list = None,
+                 shard_count: int = None):
         """This command copies the global command set to a given Guild instance.
 
             Input  : self - a reference to the current object.
                      intents - what Discord intents are required to run the bot.
+                     shard_ids - the shards this process runs, or None for all.
+                     shard_count - total shards, or None to let Discord pick.
 
             Output : None
         """
         self.disLog = log.getLogger('discord')
-        self.disLog.debug(f"Intents are: {intents}")
+        self.disLog.debug(f"Intents are: {intents}, shards are: {shard_ids} of {shard_count}")
         
-        super().__init__(intents=intents)
+        super().__init__(intents=intents, shard_ids=shard_ids,
+                         shard_count=shard_count)
         self.tree = dac.CommandTree(self)
 
     async def setup_hook(self):
@@ -84,6 +129,51 @@ class PSBClient(dis.Client):
         
         await self.tree.sync()
         
+    async def close(self):
+        """Stops the job queues and scheduler before closing the connection,
+           so a restart finishes (or cleanly drops) outstanding work.
+
+            Input  : self - a reference to the current object.
+
+            Output : None
+        """
+        if job_queue is not None:
+            self.disLog.info(f"Draining job queues before closing.")
+            await job_queue.Shutdown(float(params['queue_opts'].get('shutdown_timeout', 10)))
+            
+        #The keeper releases its leases on the way out, so other processes
+        #can pick the events up without waiting for them to lapse.
+        if lease_keeper is not None:
+            lease_keeper.Stop()
+            await lease_task
+            
+        if scheduler is not None:
+            scheduler.Stop()
+            
+        if rsvp is not None:
+            rsvp.Flush()
+            
+        #Edits queued by the flush above (and any still pending) go out now,
+        #without channel pacing; discord.py waits out any rate limits.
+        if editor is not None:
+            try:
+                await asy.wait_for(editor.Drain(float('inf')),
+                                   timeout=float(params['edit_opts'].get('shutdown_timeout', 10)))
+                
+            except asy.TimeoutError:
+                self.disLog.warning(f"Gave up on {len(editor)} pending edits while closing.")
+                
+            editor.Stop()
+            
+        if http_client is not None:
+            http_client.Close()
+            
+        if db is not None:
+            await db.Flush()
+            await self.loop.run_in_executor(None, db.Close)
+            
+        await super().close()
+        
     def GetLoop(self):
         """Returns a reference to this client's asyncio event loop.
 
@@ -94,17 +184,115 @@ class PSBClient(dis.Client):
         return self.loop;
 
 intents = dis.Intents.default()
-PSB_client = PSBClient(intents=intents)
+PSB_client = PSBClient(intents=intents, shard_ids=shard_ids,
+                       shard_count=shard_count)
 
 #####  Package Functions  #####
 
+async def EditMessage(ch_id: int, msg_id: int, content: str):
+    """Edits one of the bot's posted messages.  Called by the edit coalescer
+       so edits are paced and merged.
+
+       Input  : ch_id - The channel the message is in.
+                msg_id - The message to edit.
+                content - The message's new text.
+
+       Output : None - Throws discord exceptions on error.
+    """
+    channel = PSB_client.get_channel(int(ch_id)) or \
+              await PSB_client.fetch_channel(int(ch_id))
+              
+    await channel.get_partial_message(int(msg_id)).edit(content=content)
+
+def RenderEvent(event) -> str:
+    """Renders an event post's text, including its current signups.
+
+       Input  : event - The event model.
+
+       Output : str - The post's text.
+    """
+    lines = [f"**{event.title}**"]
+    
+    for role, members in event.rsvp_mbrs.items():
+        lines.append(f"{role} ({len(members)}): {' '.join(f'<@{x}>' for x in members)}")
+        
+    return '\n'.join(lines)
+
+def EmoteKey(emoji: dis.PartialEmoji) -> str:
+    """Returns the key rsvp_opts uses for an emote: the ID for custom
+       emotes and the character itself for unicode emoji.
+
+       Input  : emoji - The reaction's emoji.
+
+       Output : str - The rsvp_opts key.
+    """
+    return str(emoji.id) if emoji.id else emoji.name
+
+async def SendMessage(ch_id: int, content: str):
+    """Posts a message, split to fit Discord's length limit.
+
+       Input  : ch_id - The channel to post in.
+                content - The message's text.
+
+       Output : None - Throws discord exceptions on error.
+    """
+    channel = PSB_client.get_channel(int(ch_id)) or \
+              await PSB_client.fetch_channel(int(ch_id))
+              
+    for chunk in mf.Split(content):
+        await channel.send(chunk)
+
+async def OnTimer(key: tuple, payload: dict):
+    """Called (through the lease keeper) whenever an event timer comes due.
+       Posts the start, reminder, or announcement message in the schedule's
+       format and channel.
+
+       Input  : key - The (event_id, kind, index) tuple of the timer.
+                payload - The event document the timer was loaded from.
+
+       Output : None.
+    """
+    queLog = log.getLogger('queue')
+    queLog.debug(f"Timer {key} is due.")
+    
+    event_id, kind, _            = key
+    event                        = md.Event.Coerce(payload)
+    fmt_field, ch_field, default = timer_posts[kind]
+    
+    try:
+        sched = md.Schedule.Coerce(await db.GetSchedule(event.ch_id) or {})
+        fmt   = getattr(sched, fmt_field) if fmt_field else ''
+        ch_id = getattr(sched, ch_field) or event.ch_id
+        await SendMessage(ch_id, mf.Render(mf.GetTemplate(event.ch_id, fmt or default), event))
+        
+    except Exception as err:
+        queLog.error(f"Unable to post {kind} for event {event_id}: {err}")
+        return
+        
+    if kind == 'start':
+        db.QueueEventUpdate(event_id, {'started': True})
+
 @PSB_client.event
 async def on_ready():
+    global db
+    global editor
+    global http_client
     global job_queue
-    global worker
+    global lease_keeper
+    global lease_task
+    global rsvp
+    global scheduler
+    global shards
+    global sync_mgr
     
-        
     queLog = log.getLogger('queue')
+    
+    #discord.py calls on_ready again after every reconnect that can't be
+    #resumed; everything below must only be built once.
+    if job_queue is not None:
+        queLog.info(f"Reconnected as {PSB_client.user}, keeping the running managers.")
+        return
+        
     queLog.setLevel(params['log_lvl'])
     log_path = pl.Path(params['log_name_queue'])
 
@@ -124,17 +312,85 @@ async def on_ready():
     queLog.addHandler(logHandler)
     queLog.info(f'Logged in as {PSB_client.user} (ID: {PSB_client.user.id})')
     
-    queLog.debug(f"Creating Queue Manager.")
-    job_queue = qm.Manager(loop=PSB_client.GetLoop(),
-                           manager_id=1,
-                           opts=params['queue_opts'])
-    worker    = th.Thread(target=job_queue.PutRequest,
-                          name="Queue mgr",
-                          daemon=True)
-    worker.start()
+    #Discord picks the count if it wasn't configured, so this can only be
+    #known once connected.
+    shards = sh.ShardSet(PSB_client.shard_ids, PSB_client.shard_count)
+    queLog.info(f"Serving {shards}.")
+    
+    queLog.debug(f"Creating Queue Managers.")
+    job_queue = qm.Router(loop=PSB_client.GetLoop(),
+                          manager_count=int(params['managers']),
+                          opts=params['queue_opts'],
+                          shards=shards)
+    job_queue.Run()
+    
+    queLog.debug(f"Connecting to the database.")
+    db = mdb.MongodbIfc(shards)
+    
+    #Due-event and per-channel queries scan whole collections without these.
+    #Existing indexes are a no-op, so this is cheap on every start.
+    try:
+        await PSB_client.GetLoop().run_in_executor(db.executor, db.CreateIndexes)
+        
+    except Exception as err:
+        queLog.error(f"Unable to create database indexes, queries will be slow until they exist: {err}")
+        
+    db.WatchConfig(PSB_client.GetLoop())
+    
+    #Timers only reach OnTimer through the lease keeper, which checks this
+    #process still holds the event and that no one has fired it already.
+    queLog.debug(f"Creating Scheduler and Lease Keeper.")
+    lease_keeper = lm.LeaseKeeper(loop=PSB_client.GetLoop(),
+                                  db=db,
+                                  scheduler=None,
+                                  fire=OnTimer,
+                                  opts=params['lease_opts'],
+                                  shards=shards)
+    scheduler = sm.Scheduler(loop=PSB_client.GetLoop(),
+                             fire=lease_keeper.Fire,
+                             opts=params['scheduler_opts'],
+                             shards=shards)
+    lease_keeper.scheduler = scheduler
+    PSB_client.GetLoop().create_task(scheduler.Run(), name="scheduler")
+    lease_task = PSB_client.GetLoop().create_task(lease_keeper.Run(),
+                                                  name="lease keeper")
+    
+    queLog.debug(f"Creating Edit Coalescer.")
+    editor = em.EditCoalescer(loop=PSB_client.GetLoop(),
+                              send=EditMessage,
+                              opts=params['edit_opts'])
+    PSB_client.GetLoop().create_task(editor.Run(), name="editor")
+    
+    queLog.debug(f"Creating RSVP Pipeline.")
+    rsvp = rm.RsvpPipeline(loop=PSB_client.GetLoop(),
+                           render=RenderEvent,
+                           persist=db.QueueEventUpdate,
+                           editor=editor,
+                           opts=params['reaction_opts'])
+    
+    #Every outbound call goes through this one client so connections are
+    #pooled and the retries, breakers and per-host caps are shared.  Calendar
+    #sync is its only consumer so far; new callers should take it too.
+    queLog.debug(f"Creating Calendar Sync.")
+    http_client = hc.HttpClient(params['http_opts'])
+    sync_mgr    = syn.CalendarSync(db=db,
+                                   opts=params['sync_opts'],
+                                   http=http_client)
     
     print('------')
     
+@PSB_client.event
+async def on_raw_reaction_add(payload: dis.RawReactionActionEvent):
+    if rsvp is not None and payload.user_id != PSB_client.user.id:
+        rsvp.OnReaction(payload.message_id, payload.user_id,
+                        EmoteKey(payload.emoji), True)
+
+@PSB_client.event
+async def on_raw_reaction_remove(payload: dis.RawReactionActionEvent):
+    if rsvp is not None and payload.user_id != PSB_client.user.id:
+        rsvp.OnReaction(payload.message_id, payload.user_id,
+                        EmoteKey(payload.emoji), False)
+    
 @PSB_client.tree.command()
 async def hello(interaction: dis.Interaction):
     """A test echo command to verify basic discord functionality.
@@ -145,6 +401,35 @@ async def hello(interaction: dis.Interaction):
     """
     await interaction.response.send_message(f'Hi, {interaction.user.mention}', ephemeral=True, delete_after=9.0)
 
+@PSB_client.tree.command()
+async def sync(interaction: dis.Interaction, channel: dis.TextChannel,
+               full: bool = False):
+    """Syncs a schedule with the Google Calendar it's linked to.
+
+       Input  : interaction - The command's interaction.
+                channel - The schedule's channel.
+                full - Re-import the whole sync window instead of only what
+                       changed.
+
+       Output : None.
+    """
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    
+    try:
+        result = await sync_mgr.Sync(channel.id, full=full)
+        
+    except Exception as err:
+        log.getLogger('queue').error(f"Unable to sync schedule {channel.id}: {err}")
+        await interaction.followup.send(f"Unable to sync {channel.mention}: {err}", ephemeral=True)
+        return
+        
+    #Posts for changed events are refreshed through the edit coalescer.
+    for event in result['changed']:
+        if event.msg_id:
+            editor.Queue(event.msg_id, event.ch_id, RenderEvent(event))
+            
+    await interaction.followup.send(f"Synced {channel.mention}: {len(result['added'])} added, {len(result['changed'])} changed, {len(result['removed'])} removed.", ephemeral=True)
+
 
 
 #####  main  #####
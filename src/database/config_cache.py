@@ -0,0 +1,157 @@
+#This file implements the read-through cache for guild and schedule config
+#documents.  They're read on nearly every interaction and almost never change,
+#so they're kept in a size-bounded LRU with TTLs and invalidated by the
+#database interfaces (change streams for MongoDB, TTLs alone for MariaDB).
+
+import asyncio as asy
+import collections as co
+import copy
+import logging as log
+import time
+
+##### Config Cache Class #####
+class ConfigCache:
+
+    def __init__(self, loaders: dict, opts: dict, shards=None):
+        """Creates an empty cache.  Must be used from the thread running the
+           event loop; invalidations from other threads have to be handed over
+           with call_soon_threadsafe.
+
+           Input: self - Pointer to the current object instance.
+                  loaders - Kind (e.g. 'guild') to a coroutine function that
+                            fetches a document by key on a miss.
+                  opts - A dictionary of configurable options.
+                  shards - Optional ShardSet; documents for guilds on other
+                           shards are returned but never cached.
+
+           Output: None.
+        """
+        self.ccLog    = log.getLogger('config_cache')
+        self.entries  = co.OrderedDict()
+        #Bumped by Invalidate for keys being loaded, so a load that started
+        #before a write can't cache what it read.  Counters are never reset
+        #(one int per key ever invalidated mid-load) so they can't repeat.
+        self.gens     = {}
+        self.inflight = {}
+        self.loaders  = loaders
+        self.max_size = int(opts.get('cache_size', 10000))
+        self.shards   = shards
+        self.stats    = {'hits': 0, 'misses': 0, 'evictions': 0,
+                         'expirations': 0, 'invalidations': 0}
+        self.ttl      = float(opts.get('cache_ttl', 3600))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def Get(self, kind: str, key):
+        """Returns a copy of a cached document, loading it on a miss.
+           Concurrent misses for the same key share a single load.
+
+           Input: self - Pointer to the current object instance.
+                  kind - Which loader the document belongs to.
+                  key - The document's ID.
+
+           Output: The document, or None if it doesn't exist.  Throws whatever
+                   the loader throws.
+        """
+        ckey  = (kind, str(key))
+        entry = self.entries.get(ckey)
+
+        if entry is not None:
+
+            if entry[1] > time.monotonic():
+                self.stats['hits'] += 1
+                self.entries.move_to_end(ckey)
+                return copy.deepcopy(entry[0])
+
+            self.stats['expirations'] += 1
+            del self.entries[ckey]
+
+        self.stats['misses'] += 1
+
+        if ckey in self.inflight:
+            return copy.deepcopy(await asy.shield(self.inflight[ckey]))
+
+        task = asy.get_running_loop().create_task(self.loaders[kind](key))
+        gen  = self.gens.get(ckey, 0)
+        self.inflight[ckey] = task
+
+        try:
+            doc = await asy.shield(task)
+
+        finally:
+            if self.inflight.get(ckey) is task:
+                del self.inflight[ckey]
+
+        if self.gens.get(ckey, 0) == gen:
+            self.Set(kind, key, doc)
+
+        return copy.deepcopy(doc)
+
+    def Set(self, kind: str, key, doc):
+        """Stores a document, evicting the least recently used if full.
+
+           Input: self - Pointer to the current object instance.
+                  kind - Which loader the document belongs to.
+                  key - The document's ID.
+                  doc - The document to cache (None caches a miss).
+
+           Output: None.
+        """
+        if self.shards is not None and not self.shards.Owns(self._Guild(kind, key, doc)):
+            return
+
+        ckey = (kind, str(key))
+        self.entries[ckey] = [doc, time.monotonic() + self.ttl]
+        self.entries.move_to_end(ckey)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _Guild(self, kind: str, key, doc):
+        #Guild docs are keyed by guild; everything else names its guild.
+        if kind == 'guild':
+            return key
+
+        return doc.get('guild_id') if isinstance(doc, dict) else None
+
+    def Invalidate(self, kind: str, key=None) -> int:
+        """Drops one document, or every document of a kind.
+
+           Input: self - Pointer to the current object instance.
+                  kind - Which loader the document belongs to.
+                  key - The document's ID, or None for all of them.
+
+           Output: int - The number of entries dropped.
+        """
+        if key is not None:
+            keys = [(kind, str(key))] if (kind, str(key)) in self.entries else []
+            busy = [(kind, str(key))] if (kind, str(key)) in self.inflight else []
+        else:
+            keys = [x for x in self.entries if x[0] == kind]
+            busy = [x for x in self.inflight if x[0] == kind]
+
+        #Loads already running read the old document; later Gets start over.
+        for ckey in busy:
+            self.gens[ckey] = self.gens.get(ckey, 0) + 1
+            del self.inflight[ckey]
+
+        for ckey in keys:
+            del self.entries[ckey]
+
+        self.stats['invalidations'] += len(keys)
+
+        return len(keys)
+
+    def Stats(self) -> dict:
+        """Reports hit/miss metrics.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: dict - The counters plus current size and hit rate.
+        """
+        total = self.stats['hits'] + self.stats['misses']
+
+        return self.stats | {'size'     : len(self.entries),
+                             'hit_rate' : self.stats['hits'] / total if total else 0.0}
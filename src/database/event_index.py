@@ -0,0 +1,446 @@
+#This file implements the in-memory index of event times per channel.  Each
+#channel keeps its events sorted by start; with the longest event duration as
+#a bound, "what intersects this window" becomes two bisects plus a short scan
+#instead of a database query.  The database interfaces keep it in step with
+#their writes, so display refreshes, list, and sort can read from it freely.
+#
+#Repeating events can't be placed by a single start, so they're kept aside and
+#expanded into the queried window (in the schedule's timezone) on each query.
+#
+#Only writes made through this process are seen.  Processes sharing a
+#database each index the channels of the guilds they own.
+
+
+#####  Imports  #####
+
+import bisect
+import dataclasses as dc
+import datetime as dt
+import src.database.models as md
+import src.utilities.recurrence as rc
+
+#####  Package Variables  #####
+
+#How far ahead (in days) Next looks for a repeating event's next occurrence,
+#widening only when the nearer window is empty.
+next_days = (7, 31, 366)
+
+
+#####  Package Functions  #####
+
+def _Epoch(stamp) -> float:
+    if stamp is None:
+        return None
+
+    if isinstance(stamp, dt.datetime):
+        #Mongo hands back naive datetimes that are implicitly UTC.
+        if stamp.tzinfo is None:
+            stamp = stamp.replace(tzinfo=dt.timezone.utc)
+        return stamp.timestamp()
+
+    return float(stamp)
+
+def _Stamp(epoch: float) -> dt.datetime:
+    return dt.datetime.fromtimestamp(epoch, dt.timezone.utc)
+
+def _Key(event: md.Event) -> tuple:
+    return (_Epoch(event.start), str(event._id))
+
+
+##### Channel Index Class #####
+class ChannelIndex:
+
+    def __init__(self, guild_id=None, zone: str = 'UTC'):
+        """Creates an empty index for one channel.
+
+           Input: self - Pointer to the current object instance.
+                  guild_id - The guild the channel belongs to.
+                  zone - The schedule's timezone, which repeats follow.
+
+           Output: None.
+        """
+        self.docs      = {}
+        self.guild_id  = guild_id
+        #(start, str(id)) pairs, sorted.  The ID breaks ties between events
+        #that start together.
+        self.keys      = []
+        self.max_dur   = 0.0
+        #Repeating event IDs to their durations in seconds.
+        self.recurring = {}
+        self.spans     = {}
+        self.zone      = zone
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def Put(self, event: md.Event):
+        """Adds or replaces an event.  O(log n) search plus a list insert.
+
+           Input: self - Pointer to the current object instance.
+                  event - The event model.
+
+           Output: None.
+        """
+        self.Remove(event._id)
+
+        start = _Epoch(event.start)
+
+        if start is None:
+            return
+
+        end = _Epoch(event.end)
+        end = start if end is None or end < start else end
+        self.docs[str(event._id)] = event
+
+        if event.recur:
+            self.recurring[str(event._id)] = end - start
+            return
+
+        bisect.insort(self.keys, (start, str(event._id)))
+        self.spans[str(event._id)] = (start, end)
+        self.max_dur               = max(self.max_dur, end - start)
+
+    def Remove(self, event_id) -> bool:
+        """Removes an event.
+
+           Input: self - Pointer to the current object instance.
+                  event_id - The event's ID.
+
+           Output: bool - True if the event was indexed.
+        """
+        if self.docs.pop(str(event_id), None) is None:
+            return False
+
+        if self.recurring.pop(str(event_id), None) is not None:
+            return True
+
+        span = self.spans.pop(str(event_id))
+        pos  = bisect.bisect_left(self.keys, (span[0], str(event_id)))
+        del self.keys[pos]
+
+        return True
+
+    def _Repeats(self, start: float, end: float) -> list:
+        """Expands every repeating event into its occurrences intersecting
+           [start, end).
+
+           Input: self - Pointer to the current object instance.
+                  start - Window start, epoch seconds.
+                  end - Window end, epoch seconds.
+
+           Output: list - Event models, one per occurrence, with start and
+                          end moved to the occurrence.
+        """
+        found = []
+
+        for event_id, dur in self.recurring.items():
+            event = self.docs[event_id]
+
+            #Occurrences that started up to 'dur' before the window still
+            #reach into it.
+            try:
+                whens = rc.Expand(event.recur, event.start, self.zone,
+                                  _Stamp(start - dur), _Stamp(end))
+
+            except ValueError:
+                whens = (event.start,)
+
+            for when in whens:
+                stop = _Epoch(when) + dur
+
+                if _Epoch(when) < end and (stop > start or _Epoch(when) >= start):
+                    found.append(dc.replace(event, start=when,
+                                            end=_Stamp(stop) if event.end else None,
+                                            orig_st=event.orig_st or event.start))
+
+        return found
+
+    def Window(self, start, end, limit: int = 0) -> list:
+        """Finds events intersecting [start, end).  Only events starting
+           after start - max_dur can reach into the window, so the scan is
+           bounded by two bisects.  Repeating events appear once per
+           occurrence.
+
+           Input: self - Pointer to the current object instance.
+                  start - Window start (datetime or epoch).
+                  end - Window end (datetime or epoch).
+                  limit - Most events to return; 0 for all.
+
+           Output: list - Event models ordered by start.
+        """
+        start, end = _Epoch(start), _Epoch(end)
+        low        = bisect.bisect_right(self.keys, (start - self.max_dur, ''))
+        high       = bisect.bisect_left(self.keys, (end, ''))
+        found      = []
+
+        for pos in range(low, high):
+            key = self.keys[pos][1]
+
+            #Zero length events count if they start inside the window.
+            if self.spans[key][1] > start or self.spans[key][0] >= start:
+                found.append(self.docs[key])
+
+                if limit and len(found) >= limit and not self.recurring:
+                    break
+
+        if self.recurring:
+            found = sorted(found + self._Repeats(start, end), key=_Key)
+
+        return found[:limit] if limit else found
+
+    def Overlapping(self, event_id) -> list:
+        """Finds the other events overlapping an indexed event (its first
+           occurrence, if it repeats).
+
+           Input: self - Pointer to the current object instance.
+                  event_id - The event's ID.
+
+           Output: list - Event models ordered by start.
+        """
+        event = self.docs.get(str(event_id))
+
+        if event is None:
+            return []
+
+        start = _Epoch(event.start)
+
+        if str(event_id) in self.recurring:
+            end = start + self.recurring[str(event_id)]
+        else:
+            end = self.spans[str(event_id)][1]
+
+        return [x for x in self.Window(start, max(end, start + 1e-6)) \
+                if str(x._id) != str(event_id)]
+
+    def Next(self, now, count: int = 1) -> list:
+        """Finds the next events to start at or after 'now'.
+
+           Input: self - Pointer to the current object instance.
+                  now - The reference time (datetime or epoch).
+                  count - How many to return.
+
+           Output: list - Event models ordered by start.
+        """
+        now   = _Epoch(now)
+        pos   = bisect.bisect_left(self.keys, (now, ''))
+        found = [self.docs[x[1]] for x in self.keys[pos:pos + count]]
+
+        if not self.recurring:
+            return found
+
+        for days in next_days:
+            repeats = [x for x in self._Repeats(now, now + days * 86400) \
+                       if _Epoch(x.start) >= now]
+
+            if len(repeats) >= count or days == next_days[-1]:
+                break
+
+        return sorted(found + repeats, key=_Key)[:count]
+
+
+##### Event Index Class #####
+class EventIndex:
+
+    def __init__(self):
+        """Creates an empty index covering every channel.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.channels = {}
+        #Channels being read from the database.  Writes to events that aren't
+        #indexed yet are remembered so the read can't undo them.
+        self.loading  = {}
+        self.where    = {}
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    def Loaded(self, ch_id) -> bool:
+        """Whether a channel's events have been fully loaded, so queries on
+           it can be answered without the database.
+
+           Input: self - Pointer to the current object instance.
+                  ch_id - The channel (schedule) ID.
+
+           Output: bool - True if the channel is indexed.
+        """
+        return str(ch_id) in self.channels and str(ch_id) not in self.loading
+
+    def Begin(self, guild_id, ch_id, zone: str = 'UTC') -> dict:
+        """Starts (re)building a channel.  Call before reading its events
+           from the database and pass them to Load afterwards; writes made in
+           between are kept.
+
+           Input: self - Pointer to the current object instance.
+                  guild_id - The guild the channel belongs to.
+                  ch_id - The channel (schedule) ID.
+                  zone - The schedule's timezone.
+
+           Output: dict - The load's state, to hand back to Load.
+        """
+        self.DropChannel(ch_id)
+        self.channels[str(ch_id)] = ChannelIndex(str(guild_id), zone)
+        self.loading[str(ch_id)]  = {'gone': set(), 'updates': []}
+
+        return self.loading[str(ch_id)]
+
+    def Load(self, guild_id, ch_id, events: list, state: dict = None,
+             zone: str = 'UTC') -> bool:
+        """Finishes (re)building a channel from a full list of its events.
+
+           Input: self - Pointer to the current object instance.
+                  guild_id - The guild the channel belongs to.
+                  ch_id - The channel (schedule) ID.
+                  events - Every event in the channel (models or documents).
+                  state - What Begin returned, or None to finish the
+                          channel's current load (or build it in one step).
+                  zone - The schedule's timezone, if Begin wasn't called.
+
+           Output: bool - False if the channel was dropped (or restarted)
+                          since Begin, in which case 'events' is ignored.
+        """
+        if state is None:
+            state = self.loading.get(str(ch_id)) or self.Begin(guild_id, ch_id, zone)
+
+        if self.loading.get(str(ch_id)) is not state:
+            return False
+
+        del self.loading[str(ch_id)]
+
+        for event in events:
+            event = md.Event.Coerce(event)
+
+            #Anything written since the read started is newer than the read.
+            if str(event._id) in state['gone'] or str(event._id) in self.where:
+                continue
+
+            self.Put(event)
+
+        for event_id, fields in state['updates']:
+            self.Update(event_id, fields)
+
+        return True
+
+    def Put(self, event):
+        """Adds or replaces an event.  Events in channels that aren't loaded
+           are ignored; the channel will be read whole when it's first used.
+
+           Input: self - Pointer to the current object instance.
+                  event - The event (model or document).
+
+           Output: None.
+        """
+        event = md.Event.Coerce(event)
+        old   = self.where.get(str(event._id))
+
+        if old is not None and old != str(event.ch_id):
+            self.Remove(event._id)
+
+        channel = self.channels.get(str(event.ch_id))
+
+        if channel is None:
+            return
+
+        channel.Put(event)
+        self.where[str(event._id)] = str(event.ch_id)
+
+    def Update(self, event_id, fields: dict):
+        """Applies a partial update to an indexed event.
+
+           Input: self - Pointer to the current object instance.
+                  event_id - The event's ID.
+                  fields - The field names and values set.
+
+           Output: None.
+        """
+        ch_id = self.where.get(str(event_id))
+
+        if ch_id is None:
+            for state in self.loading.values():
+                state['updates'].append((str(event_id), fields))
+            return
+
+        current = self.channels[ch_id].docs[str(event_id)]
+
+        #Fields the model doesn't know (e.g. dotted paths) or can't decode
+        #leave the index unsure, so the channel is read again on its next use.
+        if any(x not in md.Event.__dataclass_fields__ for x in fields):
+            self.DropChannel(ch_id)
+            return
+
+        try:
+            self.Put(md.Event.FromBson(current.ToBson() | fields))
+
+        except ValueError:
+            self.DropChannel(ch_id)
+
+    def Remove(self, event_id) -> bool:
+        """Removes an event.
+
+           Input: self - Pointer to the current object instance.
+                  event_id - The event's ID.
+
+           Output: bool - True if the event was indexed.
+        """
+        ch_id = self.where.pop(str(event_id), None)
+
+        if ch_id is None:
+            for state in self.loading.values():
+                state['gone'].add(str(event_id))
+            return False
+
+        return self.channels[ch_id].Remove(event_id)
+
+    def DropChannel(self, ch_id) -> int:
+        """Forgets a channel, e.g. when its schedule is deleted or edited.
+
+           Input: self - Pointer to the current object instance.
+                  ch_id - The channel (schedule) ID.
+
+           Output: int - The number of events dropped.
+        """
+        channel = self.channels.pop(str(ch_id), None)
+        self.loading.pop(str(ch_id), None)
+
+        if channel is None:
+            return 0
+
+        for event_id in channel.docs:
+            self.where.pop(event_id, None)
+
+        return len(channel)
+
+    def DropGuild(self, guild_id) -> int:
+        """Forgets every channel in a guild.
+
+           Input: self - Pointer to the current object instance.
+                  guild_id - The guild's ID.
+
+           Output: int - The number of events dropped.
+        """
+        return sum(self.DropChannel(x) for x, y in list(self.channels.items()) \
+                   if y.guild_id == str(guild_id))
+
+    def Window(self, ch_id, start, end, limit: int = 0) -> list:
+        """Events in a channel intersecting [start, end).  See
+           ChannelIndex.Window.
+        """
+        channel = self.channels.get(str(ch_id))
+
+        return channel.Window(start, end, limit) if channel is not None else []
+
+    def Overlapping(self, event_id) -> list:
+        """Other events in the same channel overlapping an event.  See
+           ChannelIndex.Overlapping.
+        """
+        ch_id = self.where.get(str(event_id))
+
+        return self.channels[ch_id].Overlapping(event_id) if ch_id is not None else []
+
+    def Next(self, ch_id, now, count: int = 1) -> list:
+        """The next events to start in a channel.  See ChannelIndex.Next."""
+        channel = self.channels.get(str(ch_id))
+
+        return channel.Next(now, count) if channel is not None else []
@@ -1,10 +1,14 @@
 #This file manages interfacing to a maraidb server of at least version 10.
 #It may work with older mariadb versions, though they are untested.
 
+import asyncio as asy
+import concurrent.futures as cf
 import json
 import logging as log
 import mariadb
 import os
+import src.database.config_cache as cc
+import src.database.write_buffer as wb
 import sys
 
 #####  Package Variables  #####
@@ -19,12 +23,14 @@ class mariadbIfc:
 		tables, users, and fields as needed.
 	"""
 
-	def __init__(self):
+	def __init__(self, shards=None):
 		"""Reads the included json config for db parameters, like username and
 			login information.  Verification is handled in a different function.
 			Also instantiates a logger specifically for this class.
 			
 			Input: self - Pointer to the current object instance.
+			       shards - Optional ShardSet limiting what gets cached to
+			                this process's guilds.
 			
 			Output: None - Throws exceptions on error.
 		"""
@@ -62,6 +68,23 @@ class mariadbIfc:
 		except Exception as e:
 			self.db_log.error(f"Unable to get MariaDB commands: {e=}")
 			sys.exit(1)
+		
+		#Connector/Python connections aren't thread safe, so every query after
+		#validateInstall runs on this one thread.
+		self.executor     = cf.ThreadPoolExecutor(max_workers=1, \
+												  thread_name_prefix='mariadb')
+		#Countdown and RSVP changes are coalesced and written in bulk.
+		self.event_writes = wb.WriteBuffer(self._FlushEvents, \
+									window=float(self.args.get('write_window', 0.5)), \
+									max_batch=int(self.args.get('write_batch', 500)), \
+									name='event updates')
+		#Guild and schedule configs are read on nearly every interaction.
+		#MariaDB has no change notifications and the rows carry no version, so
+		#entries are only refreshed once their 'cache_ttl' runs out.
+		self.cache = cc.ConfigCache({'guild'    : self._FetchGuild, \
+									 'schedule' : self._FetchSchedule}, \
+									self.args, \
+									shards)
 
 
 
@@ -120,6 +143,137 @@ class mariadbIfc:
 		all_ok = True;
 		
 		return all_ok
+	
+	
+	def BulkUpsert(self, table : str, key_col : str, batch : dict) -> int:
+		"""Writes many rows with one multi-row INSERT ... ON DUPLICATE KEY
+			UPDATE per distinct set of columns, instead of a round trip per row.
+			
+			Input: self - Pointer to the current object instance.
+			       table - The key of the table in mariadb_cfg.json.
+			       key_col - The table's primary key column.
+			       batch - Primary key to a dict of column values.
+			
+			Output: int - The number of rows written.  Throws mariadb.Error.
+		"""
+		groups = {}
+		
+		#Rows can only share a statement if they set the same columns, or the
+		#update clause would null out the columns a row didn't supply.
+		for key, fields in batch.items():
+			cols = tuple(sorted(fields))
+			groups.setdefault(cols, []).append([key] + [fields[x] for x in cols])
+		
+		cursor = self.con.cursor()
+		
+		for cols, rows in groups.items():
+			names   = ', '.join((key_col,) + cols)
+			values  = ', '.join(['(' + ', '.join(['?'] * (len(cols) + 1)) + ')'] * len(rows))
+			updates = ', '.join(f"{x}=VALUES({x})" for x in cols)
+			cursor.execute(self.cmds['bulk_upsert'] % \
+								(self.args['tables'][table], names, values, updates), \
+								[x for row in rows for x in row])
+		
+		self.con.commit()
+		
+		return len(batch)
+	
+	
+	def FetchRow(self, table : str, key) -> dict:
+		"""Reads a single row by primary key.
+			
+			Input: self - Pointer to the current object instance.
+			       table - The key of the table in mariadb_cfg.json.
+			       key - The row's ID.
+			
+			Output: dict - The row as column to value, or None if missing.
+		"""
+		cursor = self.con.cursor(dictionary=True)
+		cursor.execute(self.cmds['select_row'] % self.args['tables'][table], (key,))
+		
+		return cursor.fetchone()
+	
+	
+	async def _Run(self, func, *args):
+		"""Runs a blocking connector call on the query thread.
+			
+			Input: self - Pointer to the current object instance.
+			       func - The callable to run.
+			       args - Arguments for func.
+			
+			Output: The result of func.  Throws whatever func throws.
+		"""
+		return await asy.get_running_loop().run_in_executor(self.executor, func, *args)
+	
+	
+	def Close(self):
+		"""Waits for queued queries to finish and closes the connection.  Await
+			the event buffer's Close first so buffered writes aren't lost.
+			
+			Input: self - Pointer to the current object instance.
+			
+			Output: None.
+		"""
+		self.executor.shutdown(wait=True)
+		
+		if getattr(self, 'con', None) is not None:
+			self.con.close()
+			self.con = None
+	
+	
+	async def _FetchGuild(self, guild_id) -> dict:
+		return await self._Run(self.FetchRow, 'guilds', guild_id)
+	
+	
+	async def _FetchSchedule(self, sched_id) -> dict:
+		return await self._Run(self.FetchRow, 'calendar', sched_id)
+	
+	
+	async def GetGuild(self, guild_id) -> dict:
+		"""Fetches a guild's config row through the config cache.
+			
+			Input: self - Pointer to the current object instance.
+			       guild_id - The guild's Discord ID.
+			
+			Output: dict - The guild row, or None if it doesn't exist.
+		"""
+		return await self.cache.Get('guild', guild_id)
+	
+	
+	async def GetSchedule(self, sched_id) -> dict:
+		"""Fetches a schedule's config row through the config cache.
+			
+			Input: self - Pointer to the current object instance.
+			       sched_id - The schedule's channel ID.
+			
+			Output: dict - The schedule row, or None if it doesn't exist.
+		"""
+		return await self.cache.Get('schedule', sched_id)
+	
+	
+	def QueueEventUpdate(self, event_id, fields : dict):
+		"""Buffers a partial event update to be written with others in one
+			multi-row statement.  Later updates to the same column win.  Must be
+			called from the event loop's thread.
+			
+			Input: self - Pointer to the current object instance.
+			       event_id - The event's ID.
+			       fields - The column names and values to set.
+			
+			Output: None.
+		"""
+		self.event_writes.Put(event_id, fields)
+	
+	
+	async def _FlushEvents(self, batch : dict):
+		"""Writes a batch of buffered event updates on the query thread.
+			
+			Input: self - Pointer to the current object instance.
+			       batch - Event ID to the merged columns to set.
+			
+			Output: None - Throws mariadb.Error on failure.
+		"""
+		await self._Run(self.BulkUpsert, 'events', 'id', batch)
 
 
 
@@ -0,0 +1,389 @@
+#This file defines the in-memory models for guild, schedule, and event
+#documents.  They replace the all-string JSON templates: fields hold native
+#ints, bools, and UTC datetimes, instances are slotted to keep per-object
+#overhead low when every upcoming event is held for scheduling, and the BSON
+#codecs are built once per class so converting a document is a single pass.
+#
+#Discord IDs are ints in memory but strings in the database, since every
+#query in the interfaces matches on str(id).
+
+from __future__ import annotations
+
+import ast
+import dataclasses as dc
+import datetime as dt
+import src.utilities.recurrence as rc
+import zoneinfo
+
+#####  Package Variables  #####
+
+#Annotation aliases.  Annotations are kept as strings (see the __future__
+#import), so the alias name tells the codec how to convert each field.
+Snowflake = int
+Stamp     = dt.datetime
+Stamps    = list
+Any       = object
+#Values the old templates used for "no value yet".
+blank_stamps = ('', 'ISODate(%s)', "ISODate('')")
+blank_groups = ('', '[]', '{}', '{[]}', '[ISODate(%s)]', '{[ISODate(%s)]}')
+
+
+#####  Package Functions  #####
+
+def _ToBool(value) -> bool:
+    if isinstance(value, str):
+        if value.strip().lower() in ('true', '1', 'yes'):
+            return True
+        if value.strip().lower() in ('false', '0', 'no', ''):
+            return False
+        raise ValueError(f"'{value}' is not a bool")
+
+    return bool(value)
+
+def _ToInt(value) -> int:
+    if isinstance(value, bool):
+        return int(value)
+
+    return int(value) if value not in (None, '') else 0
+
+def _ToSnowflake(value) -> int:
+    return _ToInt(value)
+
+def _ToStamp(value):
+    """Converts a datetime, epoch, or ISO-8601 string (optionally wrapped in
+       the template's ISODate(...)) into an aware UTC datetime."""
+    if value is None or value in blank_stamps:
+        return None
+
+    if isinstance(value, dt.datetime):
+        #Mongo hands back naive datetimes that are implicitly UTC.
+        if value.tzinfo is None:
+            return value.replace(tzinfo=dt.timezone.utc)
+        return value.astimezone(dt.timezone.utc)
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return dt.datetime.fromtimestamp(value, dt.timezone.utc)
+
+    if isinstance(value, str):
+        text = value.strip()
+
+        if text.startswith('ISODate(') and text.endswith(')'):
+            text = text[8:-1].strip('\'"')
+
+        return _ToStamp(dt.datetime.fromisoformat(text.replace('Z', '+00:00')))
+
+    raise ValueError(f"'{value}' is not a timestamp")
+
+def _ToStamps(value) -> list:
+    if value is None or value in blank_stamps or value in blank_groups:
+        return []
+
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+
+    return [x for x in (_ToStamp(y) for y in value) if x is not None]
+
+def _ToStr(value) -> str:
+    return '' if value is None else str(value)
+
+def _Literal(value):
+    """Unpacks a list or dict the old templates stored as a Python literal
+       string, e.g. "['help', 'list']"."""
+    if value is None or value in blank_groups:
+        return None
+
+    if isinstance(value, str):
+        try:
+            return ast.literal_eval(value)
+
+        except SyntaxError:
+            raise ValueError(f"'{value}' is not a literal") from None
+
+    return value
+
+def _ToList(value) -> list:
+    value = _Literal(value)
+
+    if value is None:
+        return []
+
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+def _ToDict(value) -> dict:
+    value = _Literal(value)
+
+    if value is None:
+        return {}
+
+    if not isinstance(value, dict):
+        raise ValueError(f"'{value}' is not a mapping")
+
+    return dict(value)
+
+def _Same(value):
+    return value
+
+#Annotation alias to (decoder, encoder).  Decoders accept anything the DB or
+#the old string templates could hold; encoders produce BSON-ready values.
+codecs = {'Snowflake' : (_ToSnowflake, str),
+          'int'       : (_ToInt, _Same),
+          'bool'      : (_ToBool, _Same),
+          'str'       : (_ToStr, _Same),
+          'Stamp'     : (_ToStamp, _Same),
+          'Stamps'    : (_ToStamps, list),
+          'list'      : (_ToList, list),
+          'dict'      : (_ToDict, dict),
+          'Any'       : (_Same, _Same)}
+
+def _BuildCodec(cls) -> tuple:
+    """Resolves each dataclass field of a model to its decoder and encoder so
+       FromBson and ToBson don't have to inspect annotations per call.
+
+       Input: cls - The model class.
+
+       Output: tuple - (name, decoder, encoder) for every field, in order.
+    """
+    return tuple((x.name, *codecs[x.type]) for x in dc.fields(cls))
+
+
+#####  Model Base Class  #####
+
+@dc.dataclass(slots=True)
+class Model:
+
+    @classmethod
+    def FromBson(cls, doc: dict):
+        """Builds a model from a database document (or an old-style string
+           template).  Missing fields take their defaults and unknown fields
+           are dropped.
+
+           Input: cls - The model class.
+                  doc - The document to decode.
+
+           Output: Model - The new instance.  Throws ValueError naming the
+                           field if a value can't be converted.
+        """
+        values = {}
+
+        for name, decode, _ in cls._codec:
+
+            if name in doc:
+                try:
+                    values[name] = decode(doc[name])
+
+                except (TypeError, ValueError) as err:
+                    raise ValueError(f"{cls.__name__}.{name}: {err}") from None
+
+        return cls(**values)
+
+    @classmethod
+    def Coerce(cls, doc):
+        """Returns 'doc' as this model, decoding it if it's a plain document.
+
+           Input: cls - The model class.
+                  doc - A model instance or a document.
+
+           Output: Model - The model instance.
+        """
+        return doc if isinstance(doc, cls) else cls.FromBson(doc)
+
+    def ToBson(self) -> dict:
+        """Encodes the model as a database document.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: dict - The document.
+        """
+        return {name: encode(getattr(self, name)) for name, _, encode in self._codec}
+
+    def get(self, name: str, default=None):
+        """Dict-style access so code written against raw documents (the
+           scheduler, message formatting) accepts models unchanged.
+
+           Input: self - Pointer to the current object instance.
+                  name - The field name.
+                  default - Returned if the model has no such field.
+
+           Output: The field's value or 'default'.
+        """
+        return getattr(self, name, default)
+
+    def Problems(self) -> list:
+        """Lists every reason the model can't be stored.  Subclasses extend
+           the base checks.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: list - Human-readable problems; empty if valid.
+        """
+        return [f"{x} must not be negative" for x, y in self._Snowflakes() if y < 0]
+
+    def _Snowflakes(self):
+        return ((name, getattr(self, name)) for name, decode, _ in self._codec \
+                if decode is _ToSnowflake)
+
+    def Validate(self):
+        """Checks the model before it crosses the DB boundary.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: Model - self, so calls can be chained.  Throws ValueError
+                           listing every problem found.
+        """
+        problems = self.Problems()
+
+        if problems:
+            raise ValueError(f"Invalid {type(self).__name__}: {'; '.join(problems)}")
+
+        return self
+
+
+#####  Guild Model  #####
+
+@dc.dataclass(slots=True)
+class Guild(Model):
+    _id        : Snowflake = 0
+    command_ch : Snowflake = 0
+    free_cmds  : list      = dc.field(default_factory=lambda: ['diagnose',
+                                                               'events',
+                                                               'help',
+                                                               'list',
+                                                               'schedules'])
+    prefix     : str       = '!'
+    timeout    : int       = 15
+
+    def Problems(self) -> list:
+        problems = Model.Problems(self)
+
+        if not self.prefix:
+            problems.append("prefix must not be empty")
+
+        if self.timeout < 0:
+            problems.append("timeout must not be negative")
+
+        return problems
+
+
+#####  Schedule Model  #####
+
+@dc.dataclass(slots=True)
+class Schedule(Model):
+    _id       : Snowflake = 0
+    alt_zones : list      = dc.field(default_factory=list)
+    annc_ch   : Snowflake = 0
+    annc_end  : str       = ''
+    annc_fmt  : str       = ''
+    clk_fmt   : int       = 24
+    def_rems  : list      = dc.field(default_factory=lambda: [10])
+    guild_id  : Snowflake = 0
+    rem_ch    : Snowflake = 0
+    rem_fmt   : str       = ''
+    rsvp_clr  : str       = '❌'
+    rsvp_conf : bool      = True
+    rsvp_log  : Snowflake = 0
+    rsvp_on   : bool      = False
+    rsvp_opts : dict      = dc.field(default_factory=dict)
+    sync_addr : str       = ''
+    sync_etag : str       = ''
+    sync_len  : int       = 7
+    sync_time : Stamp     = None
+    sync_tok  : str       = ''
+    sync_usr  : str       = ''
+    timezone  : str       = 'America/Anchorage'
+
+    def Problems(self) -> list:
+        problems = Model.Problems(self)
+
+        if self.clk_fmt not in (12, 24):
+            problems.append("clk_fmt must be 12 or 24")
+
+        if self.sync_len < 1:
+            problems.append("sync_len must be at least 1")
+
+        for zone in [self.timezone] + self.alt_zones:
+            try:
+                zoneinfo.ZoneInfo(zone)
+
+            except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+                problems.append(f"unknown timezone '{zone}'")
+
+        return problems
+
+
+#####  Event Model  #####
+
+@dc.dataclass(slots=True)
+class Event(Model):
+    _id        : Any       = None
+    annc_dt    : dict      = dc.field(default_factory=dict)
+    annc_msg   : dict      = dc.field(default_factory=dict)
+    annc_tgts  : dict      = dc.field(default_factory=dict)
+    annc_tim   : dict      = dc.field(default_factory=dict)
+    anncs      : list      = dc.field(default_factory=list)
+    ch_id      : Snowflake = 0
+    cmnts      : list      = dc.field(default_factory=list)
+    cnt        : int       = 0
+    color      : str       = ''
+    deadln     : Stamp     = None
+    descrption : str       = ''
+    done       : bool      = False
+    dsbl_ed    : bool      = False
+    dsbl_rem   : bool      = False
+    dsbl_st    : bool      = False
+    edited     : Stamp     = None
+    end        : Stamp     = None
+    end_rems   : Stamps    = dc.field(default_factory=list)
+    expire     : Stamp     = None
+    fired      : list      = dc.field(default_factory=list)
+    google_id  : str       = ''
+    guild_id   : Snowflake = 0
+    image      : str       = ''
+    lease_exp  : Stamp     = None
+    lease_own  : str       = ''
+    lease_tok  : str       = ''
+    location   : str       = ''
+    msg_id     : Snowflake = 0
+    orig_st    : Stamp     = None
+    recur      : str       = ''
+    recur_cnt  : int       = 0
+    remimds    : Stamps    = dc.field(default_factory=list)
+    rsvp_lmts  : dict      = dc.field(default_factory=dict)
+    rsvp_mbrs  : dict      = dc.field(default_factory=dict)
+    start      : Stamp     = None
+    started    : bool      = False
+    thmb       : str       = ''
+    title      : str       = ''
+    url        : str       = ''
+
+    def Problems(self) -> list:
+        problems = Model.Problems(self)
+
+        if not self.title:
+            problems.append("title must not be empty")
+
+        if self.start is None:
+            problems.append("start is required")
+
+        elif self.end is not None and self.end < self.start:
+            problems.append("end must not be before start")
+
+        if self.cnt < 0 or self.recur_cnt < 0:
+            problems.append("counts must not be negative")
+
+        if any(not isinstance(x, list) for x in self.rsvp_mbrs.values()):
+            problems.append("rsvp_mbrs must map roles to member lists")
+
+        if self.recur:
+            try:
+                rc.ParseRule(self.recur)
+
+            except ValueError as err:
+                problems.append(f"invalid recur rule: {err}")
+
+        return problems
+
+
+#Codecs are attached after the classes exist so dc.fields can be used.
+#Assigning to the class works despite slots since it's a class attribute.
+for _cls in (Guild, Schedule, Event):
+    _cls._codec = _BuildCodec(_cls)
@@ -1,15 +1,60 @@
 #This file manages interfacing to a mongoDB server of at least version 6.
 #It may work with older mongoDB versions, though they are untested.
 
+import asyncio as asy
+import concurrent.futures as cf
+import datetime as dt
+import functools
 import json
 import logging as log
 import os
 import pymongo
+import random
+import src.database.config_cache as cc
+import src.database.event_index as ei
+import src.database.models as md
+import src.database.write_buffer as wb
+import src.utilities.recurrence as rc
 import sys
+import threading as th
+import uuid
 
 #####  Package Variables  #####
 #Temporary until this is purely instantiated by a parent.
 db = ''
+#Config files live next to this module so it can be used from any directory.
+cfg_dir = os.path.dirname(os.path.abspath(__file__))
+#Indexes every table needs, keyed by the table's name in mongodb_cfg.json.
+#They cover the hot queries: a channel's upcoming events, everything due in
+#the next minute, reminder scans, and Google Calendar sync lookups.  The
+#'expire' TTL only applies to events whose expire field is a real date.
+indexes = {'calendar': [pymongo.IndexModel([('guild_id', pymongo.ASCENDING)],
+                                           name='guild')],
+           'events'  : [pymongo.IndexModel([('guild_id', pymongo.ASCENDING),
+                                            ('ch_id', pymongo.ASCENDING),
+                                            ('start', pymongo.ASCENDING)],
+                                           name='guild_ch_start'),
+                        pymongo.IndexModel([('start', pymongo.ASCENDING)],
+                                           name='start'),
+                        pymongo.IndexModel([('remimds', pymongo.ASCENDING)],
+                                           name='reminders'),
+                        pymongo.IndexModel([('end_rems', pymongo.ASCENDING)],
+                                           name='end_reminders'),
+                        pymongo.IndexModel([('google_id', pymongo.ASCENDING)],
+                                           name='google_id',
+                                           sparse=True),
+                        pymongo.IndexModel([('expire', pymongo.ASCENDING)],
+                                           name='expire_ttl',
+                                           expireAfterSeconds=0),
+                        pymongo.IndexModel([('lease_own', pymongo.ASCENDING),
+                                            ('lease_exp', pymongo.ASCENDING)],
+                                           name='lease'),
+                        pymongo.IndexModel([('lease_tok', pymongo.ASCENDING)],
+                                           name='lease_token')],
+           'guilds'  : []}
+#Event fields owned by the lease holder.  Edits never write them, so an edit
+#can't re-arm a timer that already fired or drop a lease from under its owner.
+lease_fields = ('fired', 'lease_exp', 'lease_own', 'lease_tok')
 
 
 
@@ -19,12 +64,14 @@ class MongodbIfc:
         tables, users, and fields as needed.
     """
 
-    def __init__(self):
+    def __init__(self, shards=None):
         """Reads the included json config for db parameters, like username and
             login information.  Verification is handled in a different function.
             Also instantiates a logger specifically for this class.
 
             Input: self - Pointer to the current object instance.
+                   shards - Optional ShardSet limiting what gets cached to
+                            this process's guilds.
 
             Output: None - Throws exceptions on error.
         """
@@ -34,7 +81,7 @@ class MongodbIfc:
 
         #The config file location is nonconfigurable, for now.
         try:
-            json_file = open('mongodb_cfg.json')
+            json_file = open(os.path.join(cfg_dir, 'mongodb_cfg.json'))
             self.args = json.load(json_file)
         #Sure, it's more pythonic to use with and only catch limited exceptions,
         #but making a case here for every possible exception type is dumb.
@@ -55,7 +102,7 @@ class MongodbIfc:
 
         #We can now at least use the logger for errors.
         try:
-            json_file = open('mongodb_commands.json')
+            json_file = open(os.path.join(cfg_dir, 'mongodb_commands.json'))
             self.cmds = json.load(json_file)
         #Sure, it's more pythonic to use with and only catch limited exceptions,
         #but making a case here for every possible exception type is dumb.
@@ -63,6 +110,144 @@ class MongodbIfc:
             self.db_log.error(f"Unable to get MongoDB commands: {e=}")
             sys.exit(1)
 
+        self.con      = None
+        self.db       = None
+        #pymongo is synchronous, so every query runs on this pool instead of
+        #the Discord event loop.  It's sized to match the connection pool so
+        #threads never queue for a socket.
+        self.executor = cf.ThreadPoolExecutor(
+                            max_workers=int(self.args.get('max_pool_size', 50)),
+                            thread_name_prefix='mongo')
+        self.retries  = int(self.args.get('retries', 3))
+        self.backoff  = float(self.args.get('backoff', 0.1))
+        self.timeout  = float(self.args.get('timeout_ms', 5000)) / 1000
+        #Countdown and RSVP changes are coalesced and written in bulk.
+        self.event_writes = wb.WriteBuffer(self._FlushEvents,
+                                           window=float(self.args.get('write_window', 0.5)),
+                                           max_batch=int(self.args.get('write_batch', 500)),
+                                           name='event updates')
+        #Guild and schedule configs are read on nearly every interaction.
+        self.cache    = cc.ConfigCache({'guild'   : self._FetchGuild,
+                                        'schedule': self._FetchSchedule},
+                                       self.args,
+                                       shards)
+        #Event times per channel, for window and next-event queries.
+        self.index    = ei.EventIndex()
+        #Channel ID to the task reading it into the index, so concurrent
+        #queries share one read.
+        self.indexing = {}
+        #The config change stream and the thread reading it.
+        self.stream   = None
+        self.watcher  = None
+
+
+    def Connect(self):
+        """Creates the pooled client and database handle, if they don't
+            already exist.  pymongo connects lazily, so this doesn't block on
+            the server.
+
+            Input: self - Pointer to the current object instance.
+
+            Output: None - Throws pymongo exceptions on error.
+        """
+        if self.con is not None:
+            return
+
+        timeout_ms = int(self.args.get('timeout_ms', 5000))
+        self.con   = pymongo.MongoClient(self.args['host'],
+                                         int(self.args['port']),
+                                         maxPoolSize=int(self.args.get('max_pool_size', 50)),
+                                         minPoolSize=int(self.args.get('min_pool_size', 5)),
+                                         maxIdleTimeMS=int(self.args.get('max_idle_ms', 60000)),
+                                         connectTimeoutMS=timeout_ms,
+                                         serverSelectionTimeoutMS=timeout_ms,
+                                         socketTimeoutMS=timeout_ms,
+                                         retryReads=True,
+                                         retryWrites=True)
+        self.db    = self.con[self.args['database']]
+        self.db_log.info(f"Connected to MongoDB at {self.args['host']}:{self.args['port']}")
+
+
+    def WatchConfig(self, loop) -> bool:
+        """Starts a change stream on the guild and schedule tables that
+            invalidates cached configs as soon as they change, including
+            changes made by other processes.  Change streams need a replica
+            set; on a standalone server the cache relies on its TTL instead.
+
+            Input: self - Pointer to the current object instance.
+                   loop - The event loop the cache lives on.
+
+            Output: bool - True if the watcher thread was started.
+        """
+        if self.watcher is not None:
+            return True
+
+        self.Connect()
+        kinds = {self.args['tables']['guilds']   : 'guild',
+                 self.args['tables']['calendar'] : 'schedule'}
+
+        def _Watch():
+            watcher = th.current_thread()
+
+            try:
+                with self.db.watch([{'$match': {'ns.coll': {'$in': list(kinds)}}}]) as stream:
+                    self.stream = stream
+
+                    #Close() ran while the stream was opening.
+                    if self.watcher is not watcher:
+                        return
+
+                    for change in stream:
+                        #Drops and invalidations carry no documentKey (and
+                        #invalidations no namespace), so they drop every
+                        #document of the kinds they might touch.
+                        key  = change.get('documentKey', {}).get('_id')
+                        coll = change.get('ns', {}).get('coll')
+
+                        for kind in [kinds[coll]] if coll in kinds else kinds.values():
+                            loop.call_soon_threadsafe(self.cache.Invalidate,
+                                                      kind, key)
+
+            except pymongo.errors.OperationFailure as err:
+                self.db_log.warning(f"Change streams unavailable, config cache will rely on TTLs: {err}")
+
+            except pymongo.errors.PyMongoError as err:
+                #Closing the stream from Close() also lands here.
+                self.db_log.info(f"Config change stream stopped: {err}")
+
+            finally:
+                self.stream = None
+
+                if self.watcher is watcher:
+                    self.watcher = None
+
+        #Set before starting so a second call can't start another watcher.
+        self.watcher = th.Thread(target=_Watch, name='mongo config watcher',
+                                 daemon=True)
+        self.watcher.start()
+
+        return True
+
+    def Close(self):
+        """Closes the connection pool and the query executor.  Await Flush
+            first so buffered writes aren't lost.
+
+            Input: self - Pointer to the current object instance.
+
+            Output: None.
+        """
+        self.executor.shutdown(wait=True)
+
+        self.watcher = None
+
+        if self.stream is not None:
+            self.stream.close()
+
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+            self.db  = None
+
 
     def validateInstall(self):
         """Validates all the database components are accessable and usable by the
@@ -76,22 +261,19 @@ class MongodbIfc:
 
         #These are separarte try statements for better error debugging.
         try:
-            self.con = pymongo.MongoClient(self.args['host'], \
-                                            int(self.args['port']))
+            self.Connect()
 
-        except pymongo.errors as err:
+        except pymongo.errors.PyMongoError as err:
             self.db_log.error(f"Error connecting to mongodb: {err}")
             return all_ok
 
         try:
             #The python interface will make the db upon writing to a table, and
             #automatically includes an 'IF EXIST' condition.
-            self.db = self.con[self.args['database']]
-
             for table in self.args['tables'].values():
                 #Like mentione above, we have to actually write to a collection 
                 #(table) to verify the transaction works.
-                coll   = self.db.table
+                coll   = self.db[table]
                 result = coll.insert_one({'test_val': '65536'})
 
                 if not result.acknowledged:
@@ -102,10 +284,13 @@ class MongodbIfc:
                     if not result.acknowledged:
                         raise pymongo.errors.InvalidOperation("Read test failed!")
 
-        except pymongo.error.InvalidOperation as err:
+            self.CreateIndexes()
+
+        except pymongo.errors.InvalidOperation as err:
             self.db_log.error(f"Error accessing collections! {err}")
+            return all_ok
 
-        except pymongo.errors as err:
+        except pymongo.errors.PyMongoError as err:
             self.db_log.error(f"Unable to access database: {err=}")
             return all_ok
 
@@ -114,6 +299,685 @@ class MongodbIfc:
         return all_ok
 
 
+    def CreateIndexes(self) -> dict:
+        """Creates every index declared in the package 'indexes' table.
+            Creating an index that already exists is a no-op, so this is safe
+            to run on every startup.
+
+            Input: self - Pointer to the current object instance.
+
+            Output: dict - Table name to the list of index names created.
+                           Throws pymongo exceptions on error.
+        """
+        created = {}
+
+        for table, models in indexes.items():
+
+            if not models:
+                continue
+
+            created[table] = self._Table(table).create_indexes(models)
+            self.db_log.info(f"Ensured indexes {created[table]} on {table}.")
+
+        return created
+
+    async def Diagnose(self) -> dict:
+        """Reports the state of every declared index, for the diagnose
+            command.  An index is 'ready' once it exists, 'building' while a
+            createIndexes operation for its table is still running, and
+            'missing' otherwise.
+
+            Input: self - Pointer to the current object instance.
+
+            Output: dict - Table name to a dict of index name to status.
+        """
+        #Diagnose may be the first call made, before anything connected.
+        self.Connect()
+
+        def _Status():
+            building = set()
+
+            try:
+                for op in self.con.admin.aggregate([{'$currentOp': {}},
+                        {'$match': {'command.createIndexes': {'$exists': True}}}]):
+                    building.add(op['command']['createIndexes'])
+
+            #Users without the inprog privilege can still see what exists.
+            except pymongo.errors.OperationFailure as err:
+                self.db_log.warning(f"Unable to read index builds: {err}")
+
+            report = {}
+
+            for table, models in indexes.items():
+                coll     = self._Table(table)
+                existing = {x['name'] for x in coll.list_indexes()}
+                report[table] = {}
+
+                for model in models:
+                    name = model.document['name']
+
+                    if name in existing:
+                        report[table][name] = 'ready'
+                    elif coll.name in building:
+                        report[table][name] = 'building'
+                    else:
+                        report[table][name] = 'missing'
+
+            return report
+
+        return await self._Run(_Status)
+
+
+    #####  Data Access  #####
+
+    async def _Run(self, func, *args, **kwargs):
+        """Runs a blocking pymongo call on the query executor with a timeout,
+            retrying transient network errors with jittered exponential
+            backoff.  A timed out call keeps running on its thread and may
+            still land, so only idempotent calls (reads, $set, whole-document
+            replaces) may go through here; see _RunOnce.
+
+            Input: self - Pointer to the current object instance.
+                   func - The pymongo callable to run.
+                   args/kwargs - Arguments for func.
+
+            Output: The result of func.  Throws the last error once retries
+                    are exhausted.
+        """
+        loop  = asy.get_running_loop()
+        call  = functools.partial(func, *args, **kwargs)
+        delay = self.backoff
+
+        for attempt in range(self.retries + 1):
+            try:
+                return await asy.wait_for(loop.run_in_executor(self.executor,
+                                                               call),
+                                          timeout=self.timeout)
+
+            except (pymongo.errors.AutoReconnect,
+                    pymongo.errors.NetworkTimeout,
+                    asy.TimeoutError) as err:
+
+                if attempt >= self.retries:
+                    self.db_log.error(f"Giving up on {getattr(func, '__name__', func)} after {attempt + 1} tries: {err}")
+                    raise
+
+                self.db_log.warning(f"Retrying {getattr(func, '__name__', func)} in {delay:.2f}s: {err}")
+                await asy.sleep(delay * random.uniform(0.5, 1.5))
+                delay *= 2
+
+    async def _RunOnce(self, func, *args, **kwargs):
+        """Runs a blocking, non-idempotent pymongo call (claims, fire-once
+            checks) on the query executor exactly once.  There's no timeout
+            here: abandoning the call could lose a write that still lands, so
+            it waits for pymongo's own socket timeouts instead.
+
+            Input: self - Pointer to the current object instance.
+                   func - The pymongo callable to run.
+                   args/kwargs - Arguments for func.
+
+            Output: The result of func.  Throws pymongo exceptions on error.
+        """
+        loop = asy.get_running_loop()
+
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(func, *args, **kwargs))
+
+    def _Table(self, name: str):
+        """Returns the collection for one of the 'tables' in the config.
+
+            Input: self - Pointer to the current object instance.
+                   name - The table's key in mongodb_cfg.json.
+
+            Output: Collection - The pymongo collection.
+        """
+        self.Connect()
+
+        return self.db[self.args['tables'][name]]
+
+    async def _FetchGuild(self, guild_id: str) -> dict:
+        return await self._Run(self._Table('guilds').find_one,
+                               {'_id': str(guild_id)})
+
+    async def GetGuild(self, guild_id: str) -> dict:
+        """Fetches a guild's config document through the config cache.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+
+            Output: dict - The guild document, or None if it doesn't exist.
+        """
+        return await self.cache.Get('guild', guild_id)
+
+    async def PutGuild(self, guild_id: str, doc: dict) -> bool:
+        """Creates or replaces a guild's config document.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   doc - A Guild model or a document it can decode.
+
+            Output: bool - True if the write was acknowledged.  Throws
+                           ValueError if the guild fails validation.
+        """
+        doc     = md.Guild.Coerce(doc)
+        doc._id = int(guild_id)
+        result  = await self._Run(self._Table('guilds').replace_one,
+                                  {'_id': str(guild_id)},
+                                  doc.Validate().ToBson(),
+                                  upsert=True)
+        self.cache.Invalidate('guild', guild_id)
+
+        return result.acknowledged
+
+    async def DeleteGuild(self, guild_id: str) -> bool:
+        """Deletes a guild's config document along with its schedules and
+            events.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+
+            Output: bool - True if the writes were acknowledged.
+        """
+        results = [await self._Run(self._Table('events').delete_many,
+                                   {'guild_id': str(guild_id)}),
+                   await self._Run(self._Table('calendar').delete_many,
+                                   {'guild_id': str(guild_id)}),
+                   await self._Run(self._Table('guilds').delete_one,
+                                   {'_id': str(guild_id)})]
+        self.cache.Invalidate('guild', guild_id)
+        self.cache.Invalidate('schedule')
+        self.index.DropGuild(guild_id)
+
+        return all(x.acknowledged for x in results)
+
+    async def _FetchSchedule(self, sched_id: str) -> dict:
+        return await self._Run(self._Table('calendar').find_one,
+                               {'_id': str(sched_id)})
+
+    async def GetSchedule(self, sched_id: str) -> dict:
+        """Fetches a schedule document through the config cache.  Schedules
+            are keyed by the ID of the channel they post to.
+
+            Input: self - Pointer to the current object instance.
+                   sched_id - The schedule's channel ID.
+
+            Output: dict - The schedule document, or None if it doesn't exist.
+        """
+        return await self.cache.Get('schedule', sched_id)
+
+    async def GetSchedules(self, guild_id: str) -> list:
+        """Fetches every schedule in a guild.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+
+            Output: list - The guild's schedule documents.
+        """
+        def _Find():
+            return list(self._Table('calendar').find({'guild_id': str(guild_id)}))
+
+        return await self._Run(_Find)
+
+    async def PutSchedule(self, sched_id: str, doc: dict) -> bool:
+        """Creates or replaces a schedule document.
+
+            Input: self - Pointer to the current object instance.
+                   sched_id - The schedule's channel ID.
+                   doc - A Schedule model or a document it can decode.
+
+            Output: bool - True if the write was acknowledged.  Throws
+                           ValueError if the schedule fails validation.
+        """
+        doc     = md.Schedule.Coerce(doc)
+        doc._id = int(sched_id)
+        result  = await self._Run(self._Table('calendar').replace_one,
+                                  {'_id': str(sched_id)},
+                                  doc.Validate().ToBson(),
+                                  upsert=True)
+        self.cache.Invalidate('schedule', sched_id)
+        #Repeats are expanded in the schedule's timezone, which may have
+        #changed.
+        self.index.DropChannel(sched_id)
+
+        return result.acknowledged
+
+    async def DeleteSchedule(self, sched_id: str) -> bool:
+        """Deletes a schedule document and every event posted to it.
+
+            Input: self - Pointer to the current object instance.
+                   sched_id - The schedule's channel ID.
+
+            Output: bool - True if the writes were acknowledged.
+        """
+        results = [await self._Run(self._Table('events').delete_many,
+                                   {'ch_id': str(sched_id)}),
+                   await self._Run(self._Table('calendar').delete_one,
+                                   {'_id': str(sched_id)})]
+        self.cache.Invalidate('schedule', sched_id)
+        self.index.DropChannel(sched_id)
+
+        return all(x.acknowledged for x in results)
+
+    async def GetEvent(self, event_id) -> dict:
+        """Fetches a single event document.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+
+            Output: dict - The event document, or None if it doesn't exist.
+        """
+        return await self._Run(self._Table('events').find_one,
+                               {'_id': event_id})
+
+    async def GetEvents(self, guild_id: str, ch_id: str = None, start=None,
+                        end=None, limit: int = 0) -> list:
+        """Fetches a guild's events, optionally filtered to a channel and to
+            events starting within [start, end), sorted by start time.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   ch_id - Optional channel (schedule) ID to filter by.
+                   start - Optional earliest start datetime.
+                   end - Optional latest start datetime (exclusive).
+                   limit - Maximum events to return; 0 for no limit.
+
+            Output: list - The matching event documents.
+        """
+        query = {'guild_id': str(guild_id)}
+
+        if ch_id is not None:
+            query['ch_id'] = str(ch_id)
+
+        if start is not None or end is not None:
+            query['start'] = {}
+
+            if start is not None:
+                query['start']['$gte'] = start
+
+            if end is not None:
+                query['start']['$lt'] = end
+
+        def _Find():
+            return list(self._Table('events').find(query)
+                                             .sort('start', pymongo.ASCENDING)
+                                             .limit(int(limit)))
+
+        return await self._Run(_Find)
+
+    async def _Indexed(self, guild_id: str, ch_id: str):
+        """Makes sure a channel's events are in the event index, reading them
+            all once if they aren't.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   ch_id - The channel (schedule) ID.
+
+            Output: None.
+        """
+        while not self.index.Loaded(ch_id):
+            task = self.indexing.get(str(ch_id))
+
+            if task is None:
+                task = asy.get_running_loop().create_task(self._IndexChannel(guild_id,
+                                                                             ch_id))
+                self.indexing[str(ch_id)] = task
+                task.add_done_callback(lambda x, y=str(ch_id): \
+                                       self.indexing.get(y) is x and self.indexing.pop(y))
+
+            #A read that was overtaken by a schedule edit is simply retried.
+            await asy.shield(task)
+
+    async def _IndexChannel(self, guild_id: str, ch_id: str):
+        """Reads a channel's schedule and events into the event index.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   ch_id - The channel (schedule) ID.
+
+            Output: None - Throws pymongo exceptions on error.
+        """
+        sched = md.Schedule.Coerce(await self.GetSchedule(ch_id) or {})
+        state = self.index.Begin(guild_id, ch_id, sched.timezone)
+
+        try:
+            events = await self.GetEvents(guild_id, ch_id)
+
+        except Exception:
+            if self.index.loading.get(str(ch_id)) is state:
+                self.index.DropChannel(ch_id)
+            raise
+
+        self.index.Load(guild_id, ch_id, events, state)
+
+    async def WindowEvents(self, guild_id: str, ch_id: str, start, end,
+                           limit: int = 0) -> list:
+        """Fetches a channel's events that overlap [start, end), e.g. what
+            to display for the coming week, from the event index.  Unlike
+            GetEvents this includes events that started before 'start' and
+            are still running.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   ch_id - The channel (schedule) ID.
+                   start - The window start datetime.
+                   end - The window end datetime (exclusive).
+                   limit - Maximum events to return; 0 for no limit.
+
+            Output: list - Event models sorted by start time.
+        """
+        await self._Indexed(guild_id, ch_id)
+
+        return self.index.Window(ch_id, start, end, limit)
+
+    async def NextEvents(self, guild_id: str, ch_id: str, now=None,
+                         count: int = 1) -> list:
+        """Fetches the next events to start in a channel from the event
+            index.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   ch_id - The channel (schedule) ID.
+                   now - The reference datetime; defaults to now.
+                   count - How many events to return.
+
+            Output: list - Event models sorted by start time.
+        """
+        await self._Indexed(guild_id, ch_id)
+        now = dt.datetime.now(dt.timezone.utc) if now is None else now
+
+        return self.index.Next(ch_id, now, count)
+
+    async def OverlappingEvents(self, guild_id: str, ch_id: str,
+                                event_id) -> list:
+        """Fetches the other events in a channel that overlap an event, e.g.
+            to warn about a clash, from the event index.
+
+            Input: self - Pointer to the current object instance.
+                   guild_id - The guild's Discord ID.
+                   ch_id - The channel (schedule) ID.
+                   event_id - The event's ID.
+
+            Output: list - Event models sorted by start time.
+        """
+        await self._Indexed(guild_id, ch_id)
+
+        return self.index.Overlapping(event_id)
+
+    async def PutEvent(self, event_id, doc: dict) -> bool:
+        """Creates an event document or overwrites its editable fields.  The
+            lease_fields are only written when the event is created.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+                   doc - An Event model or a document it can decode.
+
+            Output: bool - True if the write was acknowledged.  Throws
+                           ValueError if the event fails validation.
+        """
+        doc        = md.Event.Coerce(doc)
+        doc._id    = event_id
+        #A new 'edited' stamp tells the lease holder to reload the timers,
+        #and clearing 'done' lets an edited event be claimed again.
+        doc.done   = False
+        doc.edited = dt.datetime.now(dt.timezone.utc)
+        fields     = doc.Validate().ToBson()
+        owned      = {x: fields.pop(x) for x in lease_fields}
+        del fields['_id']
+        result     = await self._Run(self._Table('events').update_one,
+                                  {'_id': event_id},
+                                  {'$set': fields, '$setOnInsert': owned},
+                                  upsert=True)
+        rc.Invalidate(event_id)
+        self.index.Put(doc)
+
+        return result.acknowledged
+
+    async def UpdateEvent(self, event_id, fields: dict) -> bool:
+        """Sets a subset of an event's fields.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+                   fields - The field names and values to set.
+
+            Output: bool - True if an event was matched and the write was
+                           acknowledged.
+        """
+        fields = fields | {'done'  : False,
+                           'edited': dt.datetime.now(dt.timezone.utc)}
+        result = await self._Run(self._Table('events').update_one,
+                                 {'_id': event_id},
+                                 {'$set': fields})
+        rc.Invalidate(event_id)
+        self.index.Update(event_id, fields)
+
+        return result.acknowledged and result.matched_count > 0
+
+    def QueueEventUpdate(self, event_id, fields: dict):
+        """Buffers a partial event update (countdowns, RSVPs, message IDs) to
+            be written with others in one bulk write.  Later updates to the
+            same field win.  Must be called from the event loop's thread.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+                   fields - The field names and values to set.
+
+            Output: None.
+        """
+        self.event_writes.Put(event_id, fields)
+        self.index.Update(event_id, fields)
+
+    async def _FlushEvents(self, batch: dict):
+        """Writes a batch of buffered event updates as one unordered
+            bulk_write.
+
+            Input: self - Pointer to the current object instance.
+                   batch - Event ID to the merged fields to set.
+
+            Output: None - Throws pymongo exceptions on error.
+        """
+        ops = [pymongo.UpdateOne({'_id': x}, {'$set': y}) for x, y in batch.items()]
+
+        await self._Run(self._Table('events').bulk_write, ops, ordered=False)
+
+    async def Flush(self) -> int:
+        """Writes any buffered updates immediately, e.g. before Close.
+
+            Input: self - Pointer to the current object instance.
+
+            Output: int - The number of documents written.
+        """
+        return await self.event_writes.Close()
+
+    async def DeleteEvent(self, event_id) -> bool:
+        """Deletes an event document.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+
+            Output: bool - True if the write was acknowledged.
+        """
+        result = await self._Run(self._Table('events').delete_one,
+                                 {'_id': event_id})
+        rc.Invalidate(event_id)
+        self.index.Remove(event_id)
+
+        return result.acknowledged
+
+
+    #####  Event Leases  #####
+
+    async def ClaimEvents(self, owner: str, before: dt.datetime,
+                          lease: float, limit: int,
+                          after: dt.datetime = None) -> list:
+        """Claims up to 'limit' unfinished events starting before 'before'
+            that no other process holds a live lease on.  Candidates are
+            claimed with one update_many that re-checks the lease filter per
+            document and stamps a fresh lease token, so two processes can
+            never claim the same event; the claimed events are then read back
+            by that token.  Leases this owner already holds are left alone.
+
+            Input: self - Pointer to the current object instance.
+                   owner - This process's lease owner ID.
+                   before - Only claim events starting before this.
+                   lease - Seconds the new leases last unless renewed.
+                   limit - The most events to claim in one call.
+                   after - Skip one-off events that started and ended
+                           before this, e.g. now minus the scheduler's
+                           max_late.
+
+            Output: list - The newly claimed event documents.  If the claim
+                           fails partway, the ones that landed are still
+                           returned so they're scheduled rather than held
+                           unseen.
+        """
+        now    = dt.datetime.now(dt.timezone.utc)
+        token  = f"{owner}:{uuid.uuid4().hex}"
+        table  = self._Table('events')
+        query  = {'start'    : {'$lt': before},
+                  'done'     : {'$ne': True},
+                  'lease_own': {'$ne': owner},
+                  '$or'      : [{'lease_exp': None},
+                                {'lease_exp': {'$lt': now}}]}
+
+        #Repeating events keep their first start, so they're claimed
+        #regardless and loaded as their next occurrence.
+        if after is not None:
+            query['$and'] = [{'$or': [{'start': {'$gte': after}},
+                                      {'end'  : {'$gte': after}},
+                                      {'recur': {'$nin': ['', None]}}]}]
+
+        def _Candidates():
+            cursor = table.find(query, {'_id': 1}).sort('start', pymongo.ASCENDING)
+
+            return [x['_id'] for x in cursor.limit(limit)]
+
+        def _Claimed():
+            cursor = table.find({'lease_tok': token}).sort('start', pymongo.ASCENDING)
+
+            return list(cursor)
+
+        ids = await self._Run(_Candidates)
+
+        if not ids:
+            return []
+
+        update = {'$set': {'lease_own': owner,
+                           'lease_exp': now + dt.timedelta(seconds=lease),
+                           'lease_tok': token}}
+
+        try:
+            await self._RunOnce(table.update_many,
+                                query | {'_id': {'$in': ids}},
+                                update)
+
+        except pymongo.errors.PyMongoError as err:
+            claimed = await self._Run(_Claimed)
+
+            if not claimed:
+                raise
+
+            self.db_log.warning(f"Claim pass stopped after {len(claimed)} events: {err}")
+
+            return claimed
+
+        #Rivals may have taken some candidates first; the token only matches
+        #the ones this pass won.
+        return await self._Run(_Claimed)
+
+    async def RenewLeases(self, owner: str, lease: float) -> dict:
+        """Extends every lease this owner still holds.  A lease that expired
+            and was claimed elsewhere no longer matches, so it's lost.
+
+            Input: self - Pointer to the current object instance.
+                   owner - This process's lease owner ID.
+                   lease - Seconds the renewed leases last.
+
+            Output: dict - Each event still held to its 'edited' stamp, so
+                           the caller can reload events edited since it
+                           loaded them.
+        """
+        def _Renew():
+            now   = dt.datetime.now(dt.timezone.utc)
+            table = self._Table('events')
+            table.update_many({'lease_own': owner},
+                              {'$set': {'lease_exp': now + dt.timedelta(seconds=lease)}})
+
+            return {x['_id']: x.get('edited') \
+                    for x in table.find({'lease_own': owner}, {'_id': 1, 'edited': 1})}
+
+        return await self._Run(_Renew)
+
+    async def ReleaseLeases(self, owner: str, event_ids: list = None) -> int:
+        """Gives up leases so another process can claim the events right
+            away instead of waiting for them to expire, e.g. on shutdown.
+
+            Input: self - Pointer to the current object instance.
+                   owner - This process's lease owner ID.
+                   event_ids - The events to release, or None for all.
+
+            Output: int - The number of leases released.
+        """
+        query = {'lease_own': owner}
+
+        if event_ids is not None:
+            query['_id'] = {'$in': list(event_ids)}
+
+        result = await self._Run(self._Table('events').update_many, query,
+                                 {'$set': {'lease_own': '', 'lease_exp': None}})
+
+        return result.modified_count
+
+    async def FinishEvent(self, event_id, owner: str, edited=None) -> bool:
+        """Marks an event whose timers have all fired as done, so it's never
+            claimed again, and releases its lease.  If the event was edited
+            after 'edited' it's only released, so it gets claimed and loaded
+            afresh.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+                   owner - This process's lease owner ID.
+                   edited - The event's 'edited' stamp when it was loaded.
+
+            Output: bool - True if the event was marked done.
+        """
+        release = {'lease_own': '', 'lease_exp': None}
+        result  = await self._Run(self._Table('events').update_one,
+                                  {'_id'      : event_id,
+                                   'lease_own': owner,
+                                   'edited'   : edited},
+                                  {'$set': release | {'done': True}})
+
+        if result.matched_count:
+            return True
+
+        await self.ReleaseLeases(owner, [event_id])
+
+        return False
+
+    async def FireOnce(self, event_id, owner: str, timer: str) -> bool:
+        """Atomically records that a timer fired, if this owner still holds
+            the event's lease and the timer hasn't fired before.  Callers post
+            only when this returns True, which makes firing exactly-once even
+            if a lease changes hands mid-flight.
+
+            Input: self - Pointer to the current object instance.
+                   event_id - The event's ID.
+                   owner - This process's lease owner ID.
+                   timer - A stable name for the timer, e.g. 'remind:0'.
+
+            Output: bool - True if the caller should fire the timer.
+        """
+        doc = await self._RunOnce(self._Table('events').find_one_and_update,
+                              {'_id'      : event_id,
+                               'lease_own': owner,
+                               'lease_exp': {'$gt': dt.datetime.now(dt.timezone.utc)},
+                               'fired'    : {'$ne': timer}},
+                              {'$addToSet': {'fired': timer}},
+                              projection={'_id': 1})
+
+        return doc is not None
+
+
 if __name__ == '__main__':
     #Temporary until the log is actually made in the main python class.
     log.basicConfig(filename=('log.log'), \
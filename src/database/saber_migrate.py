@@ -0,0 +1,318 @@
+#This file migrates an existing Saber MongoDB database (see saber_dump_ex.txt)
+#into the PSB tables.  Documents are streamed with cursor batching, converted
+#to the PSB schema and validated against the models in a generator pipeline,
+#and written a batch at a time with one unordered bulk_write, so memory stays
+#bounded no matter how big the source is.  A checkpoint file records the last
+#migrated ID per collection, letting an interrupted run pick up where it left
+#off; the writes are upserts, so re-migrating a partial batch is harmless.
+
+import argparse as ap
+import asyncio as asy
+import itertools
+import json
+import logging as log
+import os
+import pymongo
+import src.database.models as md
+import src.database.mongodbIfc as mdb
+import sys
+
+#####  Package Variables  #####
+
+#Saber field name to PSB field name, per collection.  Saber fields missing
+#here are dropped; PSB fields missing from a Saber doc are left unset.
+guild_fields    = {'_id'                   : '_id',
+                   'command_channel'       : 'command_ch',
+                   'late_threshold'        : 'timeout',
+                   'prefix'                : 'prefix',
+                   'unrestricted_commands' : 'free_cmds'}
+schedule_fields = {'_id'                      : '_id',
+                   'alt_zones'                : 'alt_zones',
+                   'announcement_channel'     : 'annc_ch',
+                   'announcement_channel_end' : 'annc_end',
+                   'announcement_format'      : 'annc_fmt',
+                   'clock_format'             : 'clk_fmt',
+                   'default_reminders'        : 'def_rems',
+                   'guildId'                  : 'guild_id',
+                   'reminder_channel'         : 'rem_ch',
+                   'reminder_format'          : 'rem_fmt',
+                   'rsvp_clear'               : 'rsvp_clr',
+                   'rsvp_confirmations'       : 'rsvp_conf',
+                   'rsvp_enabled'             : 'rsvp_on',
+                   'rsvp_logging'             : 'rsvp_log',
+                   'rsvp_options'             : 'rsvp_opts',
+                   'sync_address'             : 'sync_addr',
+                   'sync_length'              : 'sync_len',
+                   'sync_time'                : 'sync_time',
+                   'sync_user'                : 'sync_usr',
+                   'timezone'                 : 'timezone'}
+event_fields    = {'_id'                   : '_id',
+                   'announcement_dates'    : 'annc_dt',
+                   'announcement_messages' : 'annc_msg',
+                   'announcement_targets'  : 'annc_tgts',
+                   'announcement_times'    : 'annc_tim',
+                   'announcements'         : 'anncs',
+                   'channelId'             : 'ch_id',
+                   'color'                 : 'color',
+                   'comments'              : 'cmnts',
+                   'count'                 : 'cnt',
+                   'deadline'              : 'deadln',
+                   'description'           : 'descrption',
+                   'end'                   : 'end',
+                   'end_disabled'          : 'dsbl_ed',
+                   'end_reminders'         : 'end_rems',
+                   'expire'                : 'expire',
+                   'googleId'              : 'google_id',
+                   'guildId'               : 'guild_id',
+                   'hasStarted'            : 'started',
+                   'image'                 : 'image',
+                   'location'              : 'location',
+                   'messageId'             : 'msg_id',
+                   'orig_start'            : 'orig_st',
+                   'recurrence'            : 'recur',
+                   'reminders'             : 'remimds',
+                   'reminders_disabled'    : 'dsbl_rem',
+                   'rsvp_limits'           : 'rsvp_lmts',
+                   'rsvp_members'          : 'rsvp_mbrs',
+                   'start'                 : 'start',
+                   'start_disabled'        : 'dsbl_st',
+                   'thumbnail'             : 'thmb',
+                   'title'                 : 'title',
+                   'url'                   : 'url'}
+#Saber collection, the PSB table and model it's written as, and its field
+#map, in migration order so schedules never reference a guild that hasn't
+#been migrated yet.
+collections     = [('guilds', 'guilds', md.Guild, guild_fields),
+                   ('schedules', 'calendar', md.Schedule, schedule_fields),
+                   ('events', 'events', md.Event, event_fields)]
+#Saber accepted channel names here, which PSB can't resolve to an ID.
+channel_fields  = ('annc_ch', 'rem_ch', 'rsvp_log')
+mig_log         = log.getLogger('saber_migrate')
+#Saber packs an event's repeat into one int: bits 0-6 are the weekdays
+#(Monday first), bits 7-8 the mode, and the rest the interval in weeks.
+#Modes 0 (weekly on those days) and 1 (every 'interval' weeks on those days)
+#map onto RRULEs; anything else is logged and dropped.
+saber_days      = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+#####  Package Functions  #####
+
+def Stream(coll, after=None, batch_size: int = 500):
+    """Streams a collection in _id order, starting after a checkpoint.  The
+       cursor fetches 'batch_size' documents per round trip, so only one
+       batch is ever held in memory.
+
+       Input: coll - The source pymongo collection.
+              after - The last _id already migrated, or None to start over.
+              batch_size - Documents per cursor batch.
+
+       Output: generator - The source documents.
+    """
+    query = {'_id': {'$gt': after}} if after is not None else {}
+
+    with coll.find(query, batch_size=batch_size,
+                   no_cursor_timeout=True).sort('_id', pymongo.ASCENDING) as cursor:
+        yield from cursor
+
+def Recurrence(value) -> str:
+    """Converts a Saber recurrence bitmask into an RRULE.
+
+       Input: value - The Saber 'recurrence' field.
+
+       Output: str - The rule, or '' for events that don't repeat.  Throws
+                     ValueError for repeat modes PSB can't express.
+    """
+    value    = int(value or 0)
+    days     = [x for i, x in enumerate(saber_days) if value & (1 << i)]
+    mode     = (value >> 7) & 0b11
+    interval = max(value >> 9, 1)
+
+    if not days:
+        return ''
+
+    if mode not in (0, 1):
+        raise ValueError(f"unsupported Saber recurrence {value}")
+
+    if len(days) == len(saber_days) and (mode == 0 or interval == 1):
+        return 'FREQ=DAILY'
+
+    rule = 'FREQ=WEEKLY'
+
+    if mode == 1 and interval > 1:
+        rule += f";INTERVAL={interval}"
+
+    return rule + f";BYDAY={','.join(days)}"
+
+def Convert(doc: dict) -> dict:
+    """Converts the values Saber stores differently from PSB, in a document
+       whose fields have already been renamed.
+
+       Input: doc - The renamed document.
+
+       Output: dict - The same document, converted in place.
+    """
+    if doc.get('sync_addr') == 'off':
+        doc['sync_addr'] = ''
+
+    for name in channel_fields:
+        if name in doc and not str(doc[name] or 0).isdigit():
+            mig_log.warning(f"Dropping {name} '{doc[name]}' from {doc.get('_id')}, it isn't a channel ID.")
+            del doc[name]
+
+    if 'recur' in doc:
+        try:
+            doc['recur'] = Recurrence(doc['recur'])
+
+        except ValueError as err:
+            mig_log.warning(f"Event {doc.get('_id')} won't repeat: {err}")
+            doc['recur'] = ''
+
+    return doc
+
+def Transform(docs, fields: dict):
+    """Renames each document's fields to the PSB schema and converts their
+       values.
+
+       Input: docs - Source documents.
+              fields - The Saber to PSB field map.
+
+       Output: generator - PSB documents.
+    """
+    for doc in docs:
+        yield Convert({fields[x]: y for x, y in doc.items() if x in fields})
+
+def Validated(docs, model, name: str):
+    """Decodes and validates each document as a PSB model, logging and
+       dropping the ones that fail.
+
+       Input: docs - PSB documents.
+              model - The md model class to validate against.
+              name - The source collection, for the log.
+
+       Output: generator - The validated documents, BSON encoded.
+    """
+    for doc in docs:
+        try:
+            yield model.Coerce(doc).Validate().ToBson()
+
+        except ValueError as err:
+            mig_log.warning(f"Skipping {name} {doc.get('_id')}: {err}")
+
+def Batched(docs, size: int):
+    """Groups a stream of documents into lists.
+
+       Input: docs - Documents to group.
+              size - Documents per list.
+
+       Output: generator - Lists of up to 'size' documents.
+    """
+    docs = iter(docs)
+
+    while batch := list(itertools.islice(docs, size)):
+        yield batch
+
+def LoadCheckpoint(path: str) -> dict:
+    """Reads the checkpoint file, if there is one.
+
+       Input: path - The checkpoint file's path.
+
+       Output: dict - Collection name to the last migrated _id.
+    """
+    try:
+        with open(path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+
+    except FileNotFoundError:
+        return {}
+
+def SaveCheckpoint(path: str, checkpoint: dict):
+    """Writes the checkpoint file atomically, so a crash mid-write can't
+       leave a corrupt checkpoint behind.
+
+       Input: path - The checkpoint file's path.
+              checkpoint - Collection name to the last migrated _id.
+
+       Output: None.
+    """
+    tmp = path + '.tmp'
+
+    with open(tmp, 'w', encoding='utf-8') as json_file:
+        json.dump(checkpoint, json_file)
+
+    os.replace(tmp, path)
+
+async def Migrate(src_db, psb: mdb.MongodbIfc, checkpoint_path: str,
+                  batch_size: int = 500) -> dict:
+    """Migrates every Saber collection into the PSB tables, resuming from the
+       checkpoint file if one exists.  Documents that fail validation are
+       logged and skipped.  Each batch is written with one unordered
+       bulk_write of upserts and the checkpoint only moves once it lands, so
+       a batch that fails partway (e.g. a dropped connection) is rerun in
+       full on the next run.  Writes bypass the interface's caches, so run
+       this while the bot is stopped.
+
+       Input: src_db - The source Saber pymongo database.
+              psb - The destination PSB database interface.
+              checkpoint_path - Where to record progress.
+              batch_size - Documents per cursor batch and write batch.
+
+       Output: dict - Collection name to the number of documents migrated.
+                      Throws pymongo exceptions if a batch can't be written.
+    """
+    checkpoint = LoadCheckpoint(checkpoint_path)
+    counts     = {}
+    loop       = asy.get_running_loop()
+
+    for src_name, table, model, fields in collections:
+        counts[src_name] = 0
+        dest             = psb._Table(table)
+        batches          = Batched(Validated(Transform(Stream(src_db[src_name],
+                                                              checkpoint.get(src_name),
+                                                              batch_size),
+                                                       fields),
+                                             model,
+                                             src_name),
+                                   batch_size)
+
+        #The source cursor blocks, so batches are pulled on the executor.
+        while batch := await loop.run_in_executor(None, next, batches, None):
+            await psb._Run(dest.bulk_write,
+                           [pymongo.ReplaceOne({'_id': x['_id']}, x, upsert=True) \
+                            for x in batch],
+                           ordered=False)
+            counts[src_name]     += len(batch)
+            checkpoint[src_name]  = batch[-1]['_id']
+            SaveCheckpoint(checkpoint_path, checkpoint)
+            mig_log.info(f"Migrated {counts[src_name]} {src_name} (through {batch[-1]['_id']}).")
+
+    return counts
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser(description="Migrates a Saber database into PSB.")
+    parser.add_argument('--uri', default='mongodb://localhost:27017/',
+                        help="The Saber MongoDB connection string.")
+    parser.add_argument('--db', default='saberDB',
+                        help="The Saber database name.")
+    parser.add_argument('--batch', type=int, default=500,
+                        help="Documents per cursor batch and bulk write.")
+    parser.add_argument('--checkpoint', default='saber_migrate.json',
+                        help="Progress file used to resume an interrupted run.")
+    opts   = parser.parse_args()
+
+    #Temporary until the log is actually made in the main python class.
+    log.basicConfig(filename=('migrate.log'), \
+                        encoding='utf-8', \
+                        filemode='a', \
+                        level=log.INFO)
+
+    psb = mdb.MongodbIfc()
+
+    if not psb.validateInstall():
+        #This is intentionally written to the terminal (instead of a logger) so
+        #a new user gets an overt and obvious prompt to check the logs.
+        print(f"Error validating install, see log for details.")
+        sys.exit(1)
+
+    counts = asy.run(Migrate(pymongo.MongoClient(opts.uri)[opts.db], psb,
+                             opts.checkpoint, opts.batch))
+    print(f"Done! Migrated {counts}")
@@ -0,0 +1,139 @@
+#This file implements the write-coalescing buffer shared by the database
+#interfaces.  Updates for the same document that land within a short window
+#are merged (last write wins per field) and flushed together as one batch, so
+#bursts of countdown and RSVP changes cost a handful of round trips instead of
+#one per change.
+
+import asyncio as asy
+import logging as log
+
+##### Write Buffer Class #####
+class WriteBuffer:
+
+    def __init__(self, flush, window: float = 0.5, max_batch: int = 500,
+                 name: str = 'writes'):
+        """Creates an empty buffer.  Must be used from the thread running the
+           event loop it flushes on.
+
+           Input: self - Pointer to the current object instance.
+                  flush - Callable taking a {key: fields} dict and writing it
+                          as one batch.  Coroutine functions are awaited and
+                          plain functions are run on the default executor.
+                  window - Seconds to collect writes before flushing.
+                  max_batch - Documents that trigger an early flush.
+                  name - Used to identify the buffer in logs.
+
+           Output: None.
+        """
+        self.flush_cb  = flush
+        self.flushing  = None
+        #Only one batch is written at a time, so two batches touching the
+        #same document can't land out of order.
+        self.lock      = asy.Lock()
+        self.max_batch = int(max_batch)
+        self.name      = name
+        self.pending   = {}
+        self.timer     = None
+        self.window    = float(window)
+        self.wbLog     = log.getLogger('write_buffer')
+        self.stats     = {'writes': 0, 'batches': 0, 'docs': 0, 'errors': 0}
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def Put(self, key, fields: dict):
+        """Queues an update, merging it into any pending update for the same
+           document.
+
+           Input: self - Pointer to the current object instance.
+                  key - The document's ID.
+                  fields - Field names and values to set.
+
+           Output: None.
+        """
+        self.stats['writes'] += 1
+        self.pending.setdefault(key, {}).update(fields)
+
+        if len(self.pending) >= self.max_batch:
+            self._Schedule(0)
+        elif self.timer is None:
+            self._Schedule(self.window)
+
+    def _Schedule(self, delay: float):
+        """(Re)arms the flush timer.
+
+           Input: self - Pointer to the current object instance.
+                  delay - Seconds until the flush.
+
+           Output: None.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+
+        loop       = asy.get_running_loop()
+        self.timer = loop.call_later(delay, self._StartFlush)
+
+    def _StartFlush(self):
+        self.timer    = None
+        self.flushing = asy.get_running_loop().create_task(self.Flush(),
+                                                           name=f"{self.name} flush")
+
+    async def Flush(self) -> int:
+        """Writes every pending update as a single batch, after any batch
+           already being written.  A failed batch is merged back under any
+           newer writes so nothing is lost or reordered.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: int - The number of documents written.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        async with self.lock:
+            return await self._Write()
+
+    async def _Write(self) -> int:
+        if not self.pending:
+            return 0
+
+        batch, self.pending = self.pending, {}
+
+        try:
+            if asy.iscoroutinefunction(self.flush_cb):
+                await self.flush_cb(batch)
+            else:
+                await asy.get_running_loop().run_in_executor(None,
+                                                             self.flush_cb,
+                                                             batch)
+
+        except Exception as err:
+            self.stats['errors'] += 1
+            self.wbLog.error(f"Unable to flush {len(batch)} {self.name}: {err}")
+
+            for key, fields in batch.items():
+                self.pending[key] = fields | self.pending.get(key, {})
+
+            if self.timer is None:
+                self._Schedule(self.window)
+
+            return 0
+
+        self.stats['batches'] += 1
+        self.stats['docs']    += len(batch)
+        self.wbLog.debug(f"Flushed {len(batch)} {self.name}.")
+
+        return len(batch)
+
+    async def Close(self) -> int:
+        """Flushes anything still pending, e.g. during shutdown.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: int - The number of documents written.
+        """
+        if self.flushing is not None and not self.flushing.done():
+            await self.flushing
+
+        return await self.Flush()
@@ -0,0 +1,264 @@
+#Coalesces Discord message edits.  Countdown messages are refreshed hourly,
+#but instead of editing every message at :00 each one is given a stable slot
+#(bucket) within the hour, so edits trickle out evenly.  Pending edits for the
+#same message are merged so only the newest text is sent, edits whose text
+#hasn't changed are skipped, and each channel is paced to stay under Discord's
+#per-route edit limit.
+#
+#All public functions must be called from the thread running the supplied
+#event loop.
+
+
+#####  Imports  #####
+
+import asyncio as asy
+import collections as co
+import hashlib
+import logging as log
+import time
+
+#####  Package Variables  #####
+
+#HTTP statuses (e.g. discord.Forbidden and NotFound) that retrying can't fix.
+fatal_status = {403, 404}
+
+
+#####  Package Functions  #####
+
+def Bucket(msg_id, buckets: int) -> int:
+    """Picks a message's slot within the hour.  A stable digest (instead of
+       the salted builtin hash) keeps each message in the same slot across
+       restarts so its refreshes stay an hour apart.
+
+       Input: msg_id - The Discord message ID.
+              buckets - How many slots the hour is split into.
+
+       Output: int - The message's slot.
+    """
+    digest = hashlib.md5(str(msg_id).encode('utf-8')).digest()
+
+    return int.from_bytes(digest[:4], 'big') % buckets
+
+
+#####  Edit Coalescer Class  #####
+
+class EditCoalescer:
+
+    def __init__(self, loop, send, opts: dict = None):
+        """Creates an idle coalescer.
+
+           Input: self - Pointer to the current object instance.
+                  loop - The asyncio event loop edits are sent on.
+                  send - Coroutine function (ch_id, msg_id, content) that
+                         performs the edit.
+                  opts - An optional dictionary of configurable options.
+
+           Output: None.
+        """
+        opts            = opts or {}
+        self.buckets    = max(1, int(opts.get('buckets', 60)))
+        self.ch_gap     = float(opts.get('channel_gap', 1.0))
+        self.ch_next    = {}
+        self.editLog    = log.getLogger('queue')
+        self.keep_going = True
+        self.last       = {}
+        self.loop       = loop
+        self.pending    = co.OrderedDict()
+        self.period     = float(opts.get('period', 3600))
+        self.send       = send
+        self.slots      = [set() for _ in range(self.buckets)]
+        self.stats      = {'queued': 0, 'merged': 0, 'skipped': 0, 'sent': 0,
+                           'errors': 0}
+        self.tick       = float(opts.get('tick', 1.0))
+        self.tracked    = {}
+        self.wake       = asy.Event()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def Track(self, msg_id, ch_id, render):
+        """Registers a message for hourly refreshes in its bucket.
+
+           Input: self - Pointer to the current object instance.
+                  msg_id - The Discord message ID.
+                  ch_id - The channel the message is in.
+                  render - Callable (or coroutine function) returning the
+                           message's current text.
+
+           Output: None.
+        """
+        self.tracked[msg_id] = (ch_id, render)
+        self.slots[Bucket(msg_id, self.buckets)].add(msg_id)
+
+    def Untrack(self, msg_id):
+        """Stops refreshing a message and drops any pending edit, e.g. when
+           its event is deleted.
+
+           Input: self - Pointer to the current object instance.
+                  msg_id - The Discord message ID.
+
+           Output: None.
+        """
+        self.tracked.pop(msg_id, None)
+        self.slots[Bucket(msg_id, self.buckets)].discard(msg_id)
+        self.pending.pop(msg_id, None)
+        self.last.pop(msg_id, None)
+
+    def Queue(self, msg_id, ch_id, content: str) -> bool:
+        """Queues an edit, replacing any pending edit for the same message.
+
+           Input: self - Pointer to the current object instance.
+                  msg_id - The Discord message ID.
+                  ch_id - The channel the message is in.
+                  content - The message's new text.
+
+           Output: bool - False if the text matches what was last sent, in
+                          which case nothing is queued.
+        """
+        if self.last.get(msg_id) == content:
+            self.pending.pop(msg_id, None)
+            self.stats['skipped'] += 1
+            return False
+
+        if msg_id in self.pending:
+            self.stats['merged'] += 1
+        else:
+            self.stats['queued'] += 1
+
+        self.pending[msg_id] = (ch_id, content)
+        self.wake.set()
+
+        return True
+
+    def Slot(self, now: float = None) -> int:
+        """Returns the bucket the hour is currently in.
+
+           Input: self - Pointer to the current object instance.
+                  now - Epoch seconds; defaults to now.
+
+           Output: int - The current bucket.
+        """
+        now = time.time() if now is None else now
+
+        return int((now % self.period) / (self.period / self.buckets))
+
+    async def Refresh(self, slot: int) -> int:
+        """Re-renders every tracked message in a bucket and queues the ones
+           that changed.
+
+           Input: self - Pointer to the current object instance.
+                  slot - The bucket to refresh.
+
+           Output: int - The number of edits queued.
+        """
+        queued = 0
+
+        for msg_id in list(self.slots[slot]):
+            ch_id, render = self.tracked[msg_id]
+
+            try:
+                content = render()
+
+                if asy.iscoroutine(content):
+                    content = await content
+
+            except Exception as err:
+                self.editLog.error(f"Unable to render message {msg_id}: {err}")
+                continue
+
+            if self.Queue(msg_id, ch_id, content):
+                queued += 1
+
+        return queued
+
+    async def Drain(self, now: float = None) -> int:
+        """Sends pending edits in queue order, skipping (for now) any whose
+           channel edited too recently.
+
+           Input: self - Pointer to the current object instance.
+                  now - Monotonic seconds; defaults to now.
+
+           Output: int - The number of edits sent.
+        """
+        now  = time.monotonic() if now is None else now
+        sent = 0
+
+        for msg_id in list(self.pending):
+
+            #Sent by an overlapping drain, e.g. the final one at shutdown.
+            if msg_id not in self.pending:
+                continue
+
+            ch_id, content = self.pending[msg_id]
+
+            if self.ch_next.get(ch_id, 0.0) > now:
+                continue
+
+            del self.pending[msg_id]
+            self.ch_next[ch_id] = now + self.ch_gap
+
+            try:
+                await self.send(ch_id, msg_id, content)
+
+            except Exception as err:
+                self.stats['errors'] += 1
+
+                if getattr(err, 'status', None) in fatal_status:
+                    self.editLog.error(f"Dropping edit to message {msg_id}: {err}")
+                    continue
+
+                #Retried after the channel's gap, unless a newer edit for
+                #the message was queued while this one was being sent.
+                self.pending.setdefault(msg_id, (ch_id, content))
+                self.editLog.warning(f"Unable to edit message {msg_id}, will retry: {err}")
+                continue
+
+            self.last[msg_id]    = content
+            self.stats['sent']  += 1
+            sent                += 1
+
+        #Channels that are quiet again don't need their pacing remembered.
+        if not self.pending:
+            self.ch_next = {x: y for x, y in self.ch_next.items() if y > now}
+
+        return sent
+
+    def Stop(self):
+        """Stops the run loop after its current pass.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.keep_going = False
+        self.wake.set()
+
+    async def Run(self):
+        """Refreshes each bucket as the hour reaches it and drains pending
+           edits, waking early whenever a new edit is queued.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        slot = self.Slot()
+        self.editLog.info(f"Edit coalescer starting in bucket {slot} of {self.buckets}.")
+
+        while self.keep_going:
+            self.wake.clear()
+            current = self.Slot()
+
+            #Catch up on every bucket passed since the last pass, e.g. after
+            #a long drain.
+            while slot != current:
+                slot = (slot + 1) % self.buckets
+                await self.Refresh(slot)
+
+            await self.Drain()
+
+            try:
+                await asy.wait_for(self.wake.wait(), timeout=self.tick)
+            except asy.TimeoutError:
+                pass
+
+        self.editLog.info(f"Edit coalescer stopped.")
@@ -0,0 +1,290 @@
+#Shares upcoming events between several bot processes using leases stored on
+#the event documents themselves.  Each process claims batches of unleased (or
+#expired) events, keeps renewing what it holds, and loads only those into its
+#scheduler.  A process that crashes stops renewing, its leases lapse, and the
+#next claim pass elsewhere picks its events up.  Firing is checked against the
+#database as well, so a timer fires exactly once even if a lease changes hands
+#while it's due.  Once an event's last timer fires it's marked done and its
+#lease released; edits made anywhere are picked up through the event's
+#'edited' stamp on the next renewal.
+#
+#All public functions must be called from the thread running the supplied
+#event loop.
+
+
+#####  Imports  #####
+
+import asyncio as asy
+import datetime as dt
+import logging as log
+import os
+import socket
+import src.database.models as md
+import src.managers.SchedulerMgr as sm
+import uuid
+
+#####  Package Variables  #####
+
+#Timer kind back to the event field its timestamps come from.
+kind_fields = {y: x for x, y in sm.timer_fields.items()}
+
+
+#####  Package Functions  #####
+
+def OwnerId() -> str:
+    """Builds a lease owner ID unique to this process, readable enough to
+       tell which host holds an event when debugging.
+
+       Input: None.
+
+       Output: str - The owner ID.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def TimerName(key: tuple, payload) -> str:
+    """Names a timer by its kind and due time rather than its index, so an
+       edited reminder counts as a new timer while a re-delivered one
+       doesn't.
+
+       Input: key - The scheduler's (event_id, kind, index) key.
+              payload - The event the timer was loaded from.
+
+       Output: str - The timer's name in the event's 'fired' list.
+    """
+    _, kind, index = key
+    stamps         = sm.FlattenStamps(payload.get(kind_fields.get(kind)))
+    when           = sm.ToEpoch(stamps[index]) if index < len(stamps) else None
+
+    return f"{kind}:{int(when) if when is not None else index}"
+
+
+#####  Lease Keeper Class  #####
+
+class LeaseKeeper:
+
+    def __init__(self, loop, db, scheduler, fire, opts: dict = None,
+                 shards=None):
+        """Creates a keeper that holds no leases yet.  Pass its Fire method
+           to the scheduler as the 'fire' callback.
+
+           Input: self - Pointer to the current object instance.
+                  loop - The asyncio event loop.
+                  db - The database interface (ClaimEvents, RenewLeases,
+                       ReleaseLeases, FinishEvent, FireOnce, GetEvent).
+                  scheduler - The Scheduler claimed events are loaded into.
+                              May be None and set before Run, since the
+                              scheduler is usually built with this Fire.
+                  fire - The real timer callback, called only for timers
+                         this process won.
+                  opts - An optional dictionary of configurable options.
+                  shards - Optional ShardSet; claimed events from other
+                           shards are released straight away.
+
+           Output: None.
+        """
+        opts            = opts or {}
+        self.batch      = int(opts.get('batch', 500))
+        self.db         = db
+        self.fire       = fire
+        #Held event IDs to their 'edited' stamps when loaded.
+        self.held       = {}
+        self.horizon    = float(opts.get('horizon', 86400))
+        self.keep_going = True
+        self.lease      = float(opts.get('lease', 60))
+        self.leaseLog   = log.getLogger('queue')
+        self.loop       = loop
+        self.owner      = opts.get('owner') or OwnerId()
+        self.renew      = float(opts.get('renew', 20))
+        self.scheduler  = scheduler
+        self.shards     = shards
+        self.wake       = asy.Event()
+
+    def __len__(self) -> int:
+        return len(self.held)
+
+    async def _Load(self, event, after: float = None) -> bool:
+        """Loads a held event's timers, finishing it straight away if none
+           are left to fire.  Repeating events are loaded as their next
+           occurrence, in their schedule's timezone.
+
+           Input: self - Pointer to the current object instance.
+                  event - The event document.
+                  after - For repeating events, load the first occurrence
+                          starting after this (epoch seconds).
+
+           Output: bool - True if the event is still held.
+        """
+        self.held[event['_id']] = event.get('edited')
+        zone                    = 'UTC'
+
+        if event.get('recur'):
+            sched = await self.db.GetSchedule(event.get('ch_id'))
+            zone  = md.Schedule.Coerce(sched or {}).timezone
+
+        if self.scheduler.LoadEvent(event, zone=zone, after=after):
+            return True
+
+        await self._Finish(event['_id'], event.get('edited'))
+
+        return False
+
+    async def _Finish(self, event_id, edited):
+        """Marks an event done and drops its lease.
+
+           Input: self - Pointer to the current object instance.
+                  event_id - The event's ID.
+                  edited - The event's 'edited' stamp when it was loaded.
+
+           Output: None.
+        """
+        self.held.pop(event_id, None)
+        self.scheduler.CancelEvent(event_id)
+        await self.db.FinishEvent(event_id, self.owner, edited)
+
+    async def Pass(self) -> dict:
+        """Renews held leases, drops lost ones from the scheduler, reloads
+           edited ones, and claims more events.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: dict - Counts of events 'held', 'lost', 'reloaded',
+                          'claimed', and 'released'.
+        """
+        renewed  = await self.db.RenewLeases(self.owner, self.lease)
+        lost     = [x for x in self.held if x not in renewed]
+        reloaded = 0
+
+        for event_id in lost:
+            self.held.pop(event_id, None)
+            self.scheduler.CancelEvent(event_id)
+
+        for event_id, edited in renewed.items():
+
+            if event_id in self.held and self.held[event_id] == edited:
+                continue
+
+            event = await self.db.GetEvent(event_id)
+
+            if event is None:
+                self.held.pop(event_id, None)
+                self.scheduler.CancelEvent(event_id)
+                continue
+
+            await self._Load(event)
+            reloaded += 1
+
+        now      = dt.datetime.now(dt.timezone.utc)
+        before   = now + dt.timedelta(seconds=self.horizon)
+        after    = now - dt.timedelta(seconds=self.scheduler.max_late)
+        claimed  = await self.db.ClaimEvents(self.owner, before, self.lease,
+                                             self.batch, after)
+        foreign  = []
+
+        for event in claimed:
+
+            if self.shards is not None and not self.shards.Owns(event.get('guild_id')):
+                foreign.append(event['_id'])
+                continue
+
+            await self._Load(event)
+
+        if foreign:
+            await self.db.ReleaseLeases(self.owner, foreign)
+
+        if lost or reloaded or claimed:
+            self.leaseLog.info(f"Lease owner {self.owner} holds {len(self.held)} events ({len(claimed) - len(foreign)} claimed, {reloaded} reloaded, {len(lost)} lost).")
+
+        return {'held': len(self.held), 'lost': len(lost),
+                'reloaded': reloaded,
+                'claimed': len(claimed) - len(foreign),
+                'released': len(foreign)}
+
+    async def Fire(self, key: tuple, payload):
+        """Scheduler callback that fires a timer only if this process wins it
+           in the database.
+
+           Input: self - Pointer to the current object instance.
+                  key - The scheduler's (event_id, kind, index) key.
+                  payload - The event the timer was loaded from.
+
+           Output: None.
+        """
+        try:
+            won = await self.db.FireOnce(key[0], self.owner, TimerName(key, payload))
+
+        except Exception as err:
+            #Letting the event go means the next claim reloads the timer, and
+            #FireOnce still stops it firing twice.
+            self.leaseLog.error(f"Unable to check timer {key}, releasing its event: {err}")
+            self.held.pop(key[0], None)
+            self.scheduler.CancelEvent(key[0])
+            await self.db.ReleaseLeases(self.owner, [key[0]])
+            return
+
+        try:
+            if won:
+                result = self.fire(key, payload)
+
+                if asy.iscoroutine(result):
+                    await result
+            else:
+                self.leaseLog.debug(f"Timer {key} was already fired or its lease was lost.")
+
+        finally:
+            #The scheduler pops a timer before firing it, so an event with
+            #no timers left has fired its last one.  A repeating event moves
+            #on to its next occurrence instead, if it has one.
+            if key[0] in self.held and key[0] not in self.scheduler.by_event:
+                event = await self.db.GetEvent(key[0]) if payload.get('recur') else None
+
+                if event is not None and event.get('edited') == payload.get('edited'):
+                    await self._Load(event, sm.ToEpoch(payload.get('start')))
+                else:
+                    await self._Finish(key[0], payload.get('edited'))
+
+    def Stop(self):
+        """Stops the run loop; it releases every lease on the way out.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.keep_going = False
+        self.wake.set()
+
+    async def Run(self):
+        """Runs a lease pass every 'renew' seconds.  The renew interval must
+           be well under the lease length or leases will lapse between
+           passes.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.leaseLog.info(f"Lease keeper {self.owner} starting.")
+
+        while self.keep_going:
+            self.wake.clear()
+
+            try:
+                await self.Pass()
+
+            except Exception as err:
+                self.leaseLog.error(f"Lease pass failed: {err}")
+
+            try:
+                await asy.wait_for(self.wake.wait(), timeout=self.renew)
+            except asy.TimeoutError:
+                pass
+
+        try:
+            released = await self.db.ReleaseLeases(self.owner)
+            self.leaseLog.info(f"Lease keeper {self.owner} stopped, released {released} events.")
+
+        except Exception as err:
+            self.leaseLog.warning(f"Unable to release leases, they'll lapse instead: {err}")
+
+        for event_id in self.held:
+            self.scheduler.CancelEvent(event_id)
+
+        self.held = {}
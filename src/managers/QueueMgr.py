@@ -7,22 +7,243 @@
 
 #####  Imports  #####
 
+import asyncio as asy
+import bisect
+import collections as co
+import concurrent.futures as cf
+import datetime as dt
+import hashlib
 import logging as log
+import math
 import multiprocessing as mp
 import queue
-import requests as req
+import src.utilities.rate_limiter as rl
+import threading as th
 import time
 
 jobs = {}
+#How many points each manager gets on the hash ring.  More points spread the
+#guilds more evenly at the cost of a slightly larger ring to search.
+ring_replicas   = 64
+#Lanes in priority order.  Interactive commands race Discord's 3 second limit,
+#reminders need to go out on time, and everything else is background work.
+lanes           = ('interactive', 'reminder', 'background')
+#Commands that default to the background lane when a request doesn't name one.
+background_cmds = {'init', 'sort', 'sync'}
 
 
 #####  Package Functions  #####
 
+def DoJob(request : dict) -> dict:
+    """Performs the actual work for a single job.  Lives at the package level
+       (instead of on the Manager) so it can be pickled into a process pool
+       for CPU-heavy jobs.
+
+       Input: request - The job's data, as put on the queue.
+
+       Output: dict - The job result to post back to the requestor.
+    """
+    jres = {}
+
+    #TODO: Add actual job code, mongodb and reading from Gooogle Calendar.
+
+    jres['id'] = request['id'] #TODO this shouldn't be necessary
+
+    return jres
+
+async def PostReply(msg : dict):
+    """The default reply callback for jobs that don't supply a 'poster'.
+       Posts a finished job's result back to the interaction that requested
+       it; jobs the queue had to defer are answered through a follow-up.
+
+       Input: msg - The job result, merged with the job's metadata.
+
+       Output: None.
+    """
+    interaction = msg.get('interaction')
+    
+    if interaction is None:
+        return
+        
+    content = msg.get('content', 'Done!')
+    
+    if msg.get('defer') is not None:
+        try:
+            await msg['defer']
+            
+        #An expired interaction (or one from before a reconnect) can't take
+        #a follow-up either, so the result goes to its channel instead.
+        except Exception as err:
+            log.getLogger('queue').warning(f"Unable to defer interaction {interaction.id}, replying in its channel: {err}")
+            await interaction.channel.send(content)
+            return
+            
+    if interaction.response.is_done():
+        await interaction.followup.send(content, ephemeral=True)
+    else:
+        await interaction.response.send_message(content, ephemeral=True)
+
+def RingHash(key) -> int:
+    """Hashes a key onto the manager ring.  The builtin hash() is salted per
+       process, so a stable digest is used instead to keep routing identical
+       across restarts.
+
+       Input: key - Anything with a stable string form (e.g. a guild ID).
+
+       Output: int - The key's position on the ring.
+    """
+    return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+#####  Lane Queue Class  #####
+
+class LaneQueue:
+
+    def __init__(self, opts: dict, depth: int):
+        """An asyncio queue with one FIFO lane per priority class.  Workers
+           always take from the highest priority lane with work, except that a
+           lower lane passed over 'starve_limit' times in a row gets the next
+           turn so background work is never pushed out entirely.
+
+           Input: self - Pointer to the current object instance.
+                  opts - A dictionary of configurable options.
+                  depth - Default depth for any lane without its own limit.
+
+           Output: None - Throws exceptions on error.
+        """
+        self.depths       = {x: int(opts.get(f"depth_{x}", depth)) for x in lanes}
+        self.done         = asy.Event()
+        self.lanes        = {x: co.deque() for x in lanes}
+        self.ready        = asy.Event()
+        self.skipped      = {x: 0 for x in lanes}
+        self.starve_limit = int(opts.get('starve_limit', 10))
+        self.stats        = {x: {'served': 0, 'total_wait': 0.0, 'max_wait': 0.0} \
+                             for x in lanes}
+        self.unfinished   = 0
+        self.done.set()
+
+    def qsize(self) -> int:
+        return sum(len(x) for x in self.lanes.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def put_nowait(self, item, lane: str = 'interactive'):
+        """Adds an item to the end of a lane.
+
+           Input: self - Pointer to the current object instance.
+                  item - The job data to queue.
+                  lane - Which priority lane to add the item to.
+
+           Output: None - Throws asyncio.QueueFull if the lane is full.
+        """
+        if lane not in self.lanes:
+            lane = 'interactive'
+
+        if len(self.lanes[lane]) >= self.depths[lane]:
+            raise asy.QueueFull(f"Lane {lane} is full.")
+
+        self.lanes[lane].append((time.monotonic(), item))
+        self.unfinished += 1
+        self.done.clear()
+        self.ready.set()
+
+    def get_nowait(self):
+        """Removes the next item by priority, honoring starvation limits.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: item - The job data.  Throws asyncio.QueueEmpty if empty.
+        """
+        waiting = [x for x in lanes if self.lanes[x]]
+
+        if not waiting:
+            raise asy.QueueEmpty()
+
+        lane = waiting[0]
+
+        #Lanes are checked lowest priority first so the most starved lane wins.
+        for other in reversed(waiting[1:]):
+            if self.skipped[other] >= self.starve_limit:
+                lane = other
+                break
+
+        for other in waiting:
+            self.skipped[other] = 0 if other == lane else self.skipped[other] + 1
+
+        queued, item = self.lanes[lane].popleft()
+        wait         = time.monotonic() - queued
+        stats        = self.stats[lane]
+        stats['served']     += 1
+        stats['total_wait'] += wait
+        stats['max_wait']    = max(stats['max_wait'], wait)
+
+        return item
+
+    async def get(self):
+        """Waits for and removes the next item by priority.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: item - The job data.
+        """
+        while True:
+            try:
+                return self.get_nowait()
+
+            except asy.QueueEmpty:
+                self.ready.clear()
+                await self.ready.wait()
+
+    def task_done(self):
+        """Marks a previously removed item as finished.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.unfinished = max(0, self.unfinished - 1)
+
+        if self.unfinished == 0:
+            self.done.set()
+
+    async def join(self):
+        """Waits until every queued item has been marked done.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        await self.done.wait()
+
+    def Stats(self) -> dict:
+        """Reports per-lane depth and wait times.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: dict - Lane name to a dict of depth, limit, served jobs,
+                          and average, max, and oldest waiting time in seconds.
+        """
+        now = time.monotonic()
+        ret = {}
+
+        for lane in lanes:
+            stats     = self.stats[lane]
+            ret[lane] = {'depth'    : len(self.lanes[lane]),
+                         'limit'    : self.depths[lane],
+                         'served'   : stats['served'],
+                         'avg_wait' : stats['total_wait'] / stats['served'] \
+                                      if stats['served'] else 0.0,
+                         'max_wait' : stats['max_wait'],
+                         'oldest'   : now - self.lanes[lane][0][0] \
+                                      if self.lanes[lane] else 0.0}
+
+        return ret
+
 #####  Manager Class  #####
 
 class Manager:
 
-    def __init__(self, loop, manager_id: int, opts: dict):
+    def __init__(self, loop, manager_id: int, opts: dict, limiter=None):
         """Manages job request queueing and tracks relevant discord context,
            such as poster, Guild, channel, etc.  The Manager gets this from the
            caller so different Managers could have different settings.
@@ -31,13 +252,16 @@ class Manager:
                   loop - The asyncio event loop this manager posts to.
                   manager_id - The current Manager's ID, assigned by the caller.
                   opts - A dictionary of configurable options.
+                  limiter - An optional TokenBucketLimiter to share with other
+                            Managers; one is created if not supplied.
               
            Output: None - Throws exceptions on error.
         """
-        self.flush      = False
+        self.accepting  = True
         self.id         = manager_id
+        self.in_flight  = 0
         self.keep_going = True
-        self.flush      = False
+        self.pending    = set()
         self.post_loop  = loop
         self.queLog     = log.getLogger('queue')
         #It's possible all opts are provided directly from config.json,
@@ -45,23 +269,124 @@ class Manager:
         #allows the caller to never have to worry about casting the types
         #correctly for a config file and definition it doesn't own.
         self.depth          = int(opts['depth'])
+        self.job_count      = max(1, int(opts.get('job_count', 1)))
         self.max_guilds     = int(opts['max_guilds'])
         self.max_guild_reqs = int(opts['max_guild_reqs'])
+        self.mode           = str(opts.get('mode', 'async')).lower()
+        self.offload        = str(opts.get('offload', 'none')).lower()
+        self.offload_cmds   = {x.strip() for x in \
+                               str(opts.get('offload_cmds', '')).split(',') \
+                               if x.strip()}
+        #Discord allows 3 seconds for an initial response and 15 minutes for
+        #follow-ups once deferred.  Jobs still pending at 'reply_budget' are
+        #deferred so the response window can't lapse while they're queued.
+        self.followup_window = float(opts.get('followup_window', 900))
+        self.reply_budget    = float(opts.get('reply_budget', 2.0))
+        self.reply_window    = float(opts.get('reply_window', 3.0))
+        self.shutdown_timeout = float(opts.get('shutdown_timeout', 10))
+        self.executor       = None
+        self.limiter        = limiter if limiter is not None else \
+                              rl.TokenBucketLimiter(opts)
+        self.workers        = []
         
-        #This may eventually be implemented as a concurrent futures ProcessPool
-        #to allow future versions to invoke workers across computers (e.g.
-        #subprocess_exec with TCP/UDP data to/from a set of remote terminals).
-        self.queue = mp.Queue(self.depth)
+        if self.mode == 'async':
+            #Workers are coroutines on the client's loop, so the queue never
+            #crosses a thread or process boundary and nothing is pickled.
+            self.queue = LaneQueue(opts, self.depth)
+            
+            if self.offload == 'process':
+                self.executor = cf.ProcessPoolExecutor(max_workers=self.job_count)
+            elif self.offload == 'thread':
+                self.executor = cf.ThreadPoolExecutor(max_workers=self.job_count,
+                                                      thread_name_prefix=f"Queue {self.id}")
+        else:
+            #This may eventually be implemented as a concurrent futures
+            #ProcessPool to allow future versions to invoke workers across
+            #computers (e.g. subprocess_exec with TCP/UDP data to/from a set of
+            #remote terminals).
+            self.queue = mp.Queue(self.depth)
 
-    def Flush(self):
-        """Sets the 'flush' flag true to enable the job queue to flush jobs
-           when able.  
+    def Flush(self, notify : bool = True) -> int:
+        """Drains every job still waiting in the queue and releases its
+           bookkeeping.  Jobs already being worked on are left to finish.
 
            Input: self - Pointer to the current object instance.
+                  notify - Whether to tell requestors their job was dropped.
               
-           Output: none.
+           Output: int - The number of jobs flushed.
+        """
+        flushed = 0
+        
+        while True:
+            try:
+                request = self.queue.get_nowait()
+                
+            except (queue.Empty, asy.QueueEmpty):
+                break
+                
+            #The thread mode's wake-up sentinel isn't a job.
+            if request is None:
+                continue
+                
+            flushed += 1
+            jres     = {'id'      : request['id'],
+                        'content' : "Your job was cancelled because the bot is restarting, please try again shortly."}
+            job      = self._Finish(request, jres)
+            
+            if self.mode == 'async':
+                self.queue.task_done()
+                
+            if notify:
+                self.post_loop.create_task(job.get('poster', PostReply)(msg=jres),
+                                           name="reply")
+                
+        self.queLog.info(f"Queue Manager {self.id} flushed {flushed} jobs.")
+        
+        return flushed
+        
+    async def Shutdown(self, timeout : float = None) -> int:
+        """Gracefully stops the Manager.  Intake stops immediately, queued and
+           in-flight jobs get up to 'timeout' seconds to finish, and anything
+           left after that is flushed or cancelled.  All of this Manager's
+           per-guild bookkeeping is cleared on return.
+
+           Input: self - Pointer to the current object instance.
+                  timeout - Seconds to wait for outstanding jobs to finish.
+
+           Output: int - The number of jobs that were dropped.
         """
-        self.flush = True
+        timeout        = self.shutdown_timeout if timeout is None else timeout
+        deadline       = time.monotonic() + timeout
+        self.accepting = False
+        
+        self.queLog.info(f"Queue Manager {self.id} shutting down with {len(self.pending)} outstanding jobs.")
+        
+        while (len(self.pending) > 0) and (time.monotonic() < deadline):
+            await asy.sleep(0.05)
+            
+        dropped         = self.Flush()
+        self.keep_going = False
+        
+        if self.mode == 'async':
+            for worker in self.workers:
+                worker.cancel()
+                
+            await asy.gather(*self.workers, return_exceptions=True)
+        else:
+            #Wake the blocking get() so the thread can see keep_going.
+            self.queue.put(None)
+            
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            
+        #Anything still tracked here was in flight when time ran out.
+        for guild, job_id in list(self.pending):
+            dropped += 1
+            self._Finish({'guild': guild, 'id': job_id}, {'id': job_id})
+            
+        self.queLog.info(f"Queue Manager {self.id} stopped, {dropped} jobs were dropped.")
+        
+        return dropped
         
     def Add(self, request : dict) -> str:
         """Passes queued jobs to the worker tasks.  Is effectively the 'main'
@@ -76,6 +401,22 @@ class Manager:
         """
         global jobs
         
+        if not self.accepting:
+        
+            return "The bot is restarting and isn't accepting new jobs, please try again shortly."
+            
+        #Token buckets shape bursts before the hard per-guild cap below ever
+        #comes into play.  Tokens are only taken once the job is queued, so
+        #a rejected request doesn't count against the caller.
+        wait = self.limiter.Check(request['data']['guild'],
+                                  request['data']['id'],
+                                  request['data'].get('cmd', ''))
+        
+        if wait > 0:
+        
+            self.queLog.warning(f"User {request['data']['id']} in Guild {request['data']['guild']} was rate limited for {wait:.2f}s.")
+            return f"You're sending requests too quickly, please try again in {math.ceil(wait)} seconds."
+        
         if request['data']['guild'] not in jobs:
         
             if len(jobs) >= self.max_guilds :
@@ -104,7 +445,9 @@ class Manager:
         #deleted after the job is done, so this function always loses the race.
         if request['data']['id'] not in jobs[request['data']['guild']]:
         
+            request['metadata']['recv_time'] = self._ReceiveTime(request['metadata'])
             (jobs[request['data']['guild']])[request['data']['id']] = request['metadata']
+            self.pending.add((request['data']['guild'], request['data']['id']))
             self.queLog.debug(f"Added new request from Guild {request['data']['guild']} to ID {request['data']['id']}.")
             
         else :
@@ -118,24 +461,148 @@ class Manager:
         try:
             #The Metadata can't be pickeled, meaning we can only send data
             #through the queue.
-            self.queue.put(request['data'])
+            if self.mode == 'async':
+                self.queue.put_nowait(request['data'], self.GetLane(request['data']))
+            else:
+                self.queue.put(request['data'], block=False)
             
-        except queue.Full as err:
+        except (queue.Full, asy.QueueFull) as err:
         
-            (jobs[request['data']['guild']]).pop(request['data']['id'])
+            self._Finish(request['data'], {'id': request['data']['id']})
             self.queLog.warning(f" Encountered a full queue for request with metadata: {request['data']}, {err}!")
             
             return "The work queue is currently full, please wait a bit before making another request."
             
         except Exception as err:
         
-            (jobs[request['data']['guild']]).pop(request['data']['id'])
+            self._Finish(request['data'], {'id': request['data']['id']})
             self.queLog.error(f" Unable to add job to queue for request with metadata: {request['data']}, {err}!")
             
             return "Unable to add your job to the queue.  Are you sending more than text and numbers?"
             
+        self.limiter.Take(request['data']['guild'],
+                          request['data']['id'],
+                          request['data'].get('cmd', ''))
+        self._ArmDeadline(request['metadata'])
+        
         return "Your job was added to the queue.  Please wait for it to finish before posting another."
     
+    def _ReceiveTime(self, meta : dict) -> float:
+        """Works out when Discord received an interaction, as a monotonic
+           timestamp, so time spent before Add is counted against the budget.
+
+           Input: self - Pointer to the current object instance.
+                  meta - The job's metadata, optionally with an 'interaction'.
+
+           Output: float - The monotonic time the request was received.
+        """
+        now         = time.monotonic()
+        interaction = meta.get('interaction')
+        created     = getattr(interaction, 'created_at', None)
+        
+        if isinstance(created, dt.datetime):
+            age = (dt.datetime.now(dt.timezone.utc) - created).total_seconds()
+            return now - min(max(age, 0.0), self.followup_window)
+            
+        return meta.get('recv_time', now)
+        
+    def _ArmDeadline(self, meta : dict):
+        """Schedules an automatic defer for an interaction's job in case it's
+           still unfinished when the reply budget runs out.
+
+           Input: self - Pointer to the current object instance.
+                  meta - The job's metadata.
+
+           Output: None.
+        """
+        if meta.get('interaction') is None:
+            return
+            
+        delay = self.reply_budget - (time.monotonic() - meta['recv_time'])
+        meta['defer_timer'] = self.post_loop.call_later(max(delay, 0.0),
+                                                        self._Defer,
+                                                        meta)
+        
+    def _Defer(self, meta : dict):
+        """Defers an interaction whose job is running late, so its result can
+           still be sent as a follow-up.  Runs on the manager's loop.
+
+           Input: self - Pointer to the current object instance.
+                  meta - The job's metadata.
+
+           Output: None.
+        """
+        interaction = meta['interaction']
+        
+        if meta.get('done') or interaction.response.is_done():
+            return
+            
+        #Discord rejects a defer once the initial window has closed.
+        if time.monotonic() - meta['recv_time'] >= self.reply_window:
+            return
+            
+        self.queLog.debug(f"Deferring interaction {interaction.id} to beat the response deadline.")
+        meta['deferred'] = True
+        meta['defer']    = self.post_loop.create_task(interaction.response.defer(thinking=True),
+                                                      name="defer")
+        
+    def _CheckDeadline(self, request : dict) -> str:
+        """Decides what to do with a job based on how much of its response
+           window is left.
+
+           Input: self - Pointer to the current object instance.
+                  request - The job's data, as taken from the queue.
+
+           Output: str - 'run' to run and reply, 'quiet' to run without a
+                         reply, or 'drop' to skip the job entirely.
+        """
+        meta = jobs.get(request['guild'], {}).get(request['id'], {})
+        
+        if meta.get('interaction') is None:
+            return 'run'
+            
+        age    = time.monotonic() - meta['recv_time']
+        window = self.followup_window if meta.get('deferred') else self.reply_window
+        
+        if age < window:
+            return 'run'
+            
+        #Nobody can see the reply anymore.  Read-only commands are pointless
+        #to finish, but background jobs change state and still need to run.
+        self.queLog.warning(f"Job {request['id']} missed its {window}s response window by {age - window:.2f}s.")
+        
+        return 'quiet' if self.GetLane(request) == 'background' else 'drop'
+        
+    def GetLane(self, data : dict) -> str:
+        """Picks the priority lane for a job.  Requests may name their lane
+           (the scheduler uses 'reminder'); otherwise bulk commands go to the
+           background lane and everything else is interactive.
+
+           Input: self - Pointer to the current object instance.
+                  data - The job's data.
+
+           Output: str - The lane name.
+        """
+        lane = data.get('lane')
+        
+        if lane in lanes:
+            return lane
+            
+        return 'background' if data.get('cmd') in background_cmds else 'interactive'
+        
+    def Stats(self) -> dict:
+        """Reports per-lane queue depth and wait times.  Only available in
+           'async' mode; the multiprocessing queue is a single FIFO.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: dict - Per-lane statistics, or an empty dict.
+        """
+        if self.mode == 'async':
+            return self.queue.Stats()
+            
+        return {}
+        
     def GetDefaultJobData(self) -> dict:
         """Returns the default job settings that can be provided to an empty
            query (or to reinitialize an object).
@@ -146,6 +613,58 @@ class Manager:
         """
         return {}
         
+    def _Finish(self, request : dict, jres : dict) -> dict:
+        """Releases a completed job's bookkeeping and returns the metadata
+           needed to post its result.
+
+           Input: self - Pointer to the current object instance.
+                  request - The job's data, as taken from the queue.
+                  jres - The job's result.
+
+           Output: dict - The job's metadata, merged into jres.
+        """
+        global jobs
+        
+        #Pop last to ensure a new request from the same ID can be added
+        #only after their first request is completed.
+        self.pending.discard((request['guild'], request['id']))
+        job   = jobs.get(request['guild'], {}).pop(request['id'], {})
+        jres |= job
+        job['done'] = True
+        
+        #Always called on the loop (thread mode hands over with _Complete),
+        #so a deadline defer can't slip in between this and the reply.
+        if job.get('defer_timer') is not None:
+            job['defer_timer'].cancel()
+        
+        if request['guild'] in jobs and len(jobs[request['guild']]) == 0:
+        
+            self.queLog.debug(f"Removing empty Guild {request['guild']} from the list.")
+            del jobs[request['guild']]
+            
+        self.queLog.debug(f"Job Id {jres['id']} result was: {jres}")
+        
+        return job
+        
+    def _Complete(self, request : dict, jres : dict, state : str):
+        """Finishes a 'thread' mode job and posts its reply.  Runs on the
+           manager's loop, so it's ordered against _Defer: either the defer
+           already started and the reply follows up on it, or the deadline
+           timer is cancelled before it can fire.
+
+           Input: self - Pointer to the current object instance.
+                  request - The job's data, as taken from the queue.
+                  jres - The job's result.
+                  state - What _CheckDeadline decided for the job.
+
+           Output: None.
+        """
+        job = self._Finish(request, jres)
+        
+        if state == 'run':
+            asy.run_coroutine_threadsafe(job.get('poster', PostReply)(msg=jres),
+                                         job.get('loop', self.post_loop))
+            
     def PutRequest(self) :
         """Should be instantiated as an independent proecss for putting and
            getting data from the SD server.  Results are provided back to the
@@ -156,45 +675,203 @@ class Manager:
                   
             Output: None - Throws exceptions on error.
         """
-        global jobs
-        
         while self.keep_going:
         
-            if self.flush:
-#                self.queue.Flush()
-                self.flush = False
-                continue
-            request            = self.queue.get()
-            result             = {}
-            jres               = {}
-            
-            #TODO: Add actual job code, mongodb and reading from Gooogle Calendar.
-            
-            jres['id']          = request['id'] #TODO this shouldn't be necessary
-            #Pop last to ensure a new request from the same ID can be added
-            #only after their first request is completed.
-            job     = (jobs[request['guild']]).pop(request['id'])
-            jres   |= job
+            request = self.queue.get()
             
-            if len(jobs[request['guild']]) == 0:
-            
-                self.queLog.debug(f"Removing empty Guild {request['guild']} from the list.")
-                del jobs[request['guild']]
+            #Shutdown posts None to wake this thread.
+            if request is None:
+                continue
                 
-            self.queLog.debug(f"Job Id {jres['id']} result was: {jres}")
-            job['loop'].create_task(job['poster'](msg=jres), name="reply")
+            self.in_flight += 1
+            state   = self._CheckDeadline(request)
+            jres    = DoJob(request) if state != 'drop' else {'id': request['id']}
+            
+            #This runs on a foreign thread, so finishing and replying are
+            #handed to the loop together, where the deadline timer runs.
+            self.post_loop.call_soon_threadsafe(self._Complete, request, jres,
+                                                state)
+            self.in_flight -= 1
             
         return
         
+    async def Worker(self, worker_id : int):
+        """One of the asyncio workers that drain the queue on the client's
+           loop.  Jobs listed in 'offload_cmds' are run in the configured
+           thread or process pool so they can't stall the loop.
+
+           Input: self - Pointer to the current object instance.
+                  worker_id - This worker's index, for logging.
+
+           Output: None.
+        """
+        self.queLog.debug(f"Queue Manager {self.id} worker {worker_id} started.")
+        
+        while self.keep_going:
+        
+            request         = await self.queue.get()
+            self.in_flight += 1
+            
+            try:
+                state = self._CheckDeadline(request)
+                
+                if state == 'drop':
+                    self._Finish(request, {'id': request['id']})
+                    continue
+                    
+                if self.executor is not None and \
+                   request.get('cmd') in self.offload_cmds:
+                    jres = await self.post_loop.run_in_executor(self.executor,
+                                                                DoJob,
+                                                                request)
+                else:
+                    jres = DoJob(request)
+                    
+                job = self._Finish(request, jres)
+                
+                if state == 'run':
+                    self.post_loop.create_task(job.get('poster', PostReply)(msg=jres),
+                                               name="reply")
+                
+            except Exception as err:
+                self.queLog.error(f"Worker {worker_id} failed job {request}: {err}")
+                self._Finish(request, {'id': request['id']})
+                
+            except asy.CancelledError:
+                self._Finish(request, {'id': request['id']})
+                raise
+                
+            finally:
+                self.in_flight -= 1
+                self.queue.task_done()
+                
     def Run(self):
-        """Should spawn the process that puts job requests to the SD server.
-           Is the freamework for multiple concurrent jobs, but will need to be
-           modified to actually support them.
+        """Starts the workers that drain the job queue.  In 'async' mode this
+           is 'job_count' coroutines on the manager's loop; otherwise it is a
+           single blocking thread.  Must be called from the loop's thread, and
+           paired with Shutdown to stop gracefully.
 
            Input: self - Pointer to the current object instance.
               
-           Output: None - Results are posted to a pipe.
+           Output: None - Results are posted to the requestor's loop.
         """
         self.queLog.info(f"Queue Manager {self.id} starting workers.")
-        #This may, someday, need to be a proper multiprocessing queue.
-        #jobs = [QueueObject(x) for x in range(self.depth)], in a loop
+        
+        if self.mode == 'async':
+            self.workers = [self.post_loop.create_task(self.Worker(x),
+                                                       name=f"Queue {self.id} worker {x}")
+                            for x in range(self.job_count)]
+        else:
+            thread = th.Thread(target=self.PutRequest,
+                               name=f"Queue mgr {self.id}",
+                               daemon=True)
+            thread.start()
+            self.workers = [thread]
+
+
+#####  Router Class  #####
+
+class Router:
+
+    def __init__(self, loop, manager_count: int, opts: dict, shards=None):
+        """Owns several Managers and routes each request to one of them by a
+           consistent hash of its guild.  A guild's jobs always land on the
+           same Manager, keeping them ordered, while unrelated guilds proceed
+           in parallel on the others.
+
+           Input: self - Pointer to the current object instance.
+                  loop - The asyncio event loop the managers post to.
+                  manager_count - How many Managers to create.
+                  opts - A dictionary of configurable options, passed to each
+                         Manager.
+                  shards - Optional ShardSet; requests from guilds on other
+                           shards are refused.
+
+           Output: None - Throws exceptions on error.
+        """
+        self.queLog   = log.getLogger('queue')
+        self.shards   = shards
+        #Users can post in several guilds owned by different Managers, so the
+        #buckets are shared instead of per-Manager.
+        self.limiter  = rl.TokenBucketLimiter(opts)
+        self.managers = {x: Manager(loop=loop,
+                                    manager_id=x,
+                                    opts=opts,
+                                    limiter=self.limiter)
+                         for x in range(1, max(1, int(manager_count)) + 1)}
+        self.ring     = sorted((RingHash(f"{x}-{y}"), x)
+                               for x in self.managers
+                               for y in range(ring_replicas))
+        self.points   = [x[0] for x in self.ring]
+        
+        self.queLog.debug(f"Router created {len(self.managers)} Queue Managers.")
+
+    def GetManager(self, guild) -> Manager:
+        """Finds the Manager that owns a guild in O(log n).
+
+           Input: self - Pointer to the current object instance.
+                  guild - The guild ID to look up.
+
+           Output: Manager - The Manager responsible for the guild.
+        """
+        pos = bisect.bisect(self.points, RingHash(guild)) % len(self.ring)
+        
+        return self.managers[self.ring[pos][1]]
+
+    def Add(self, request : dict) -> str:
+        """Adds a request to the queue of the Manager owning its guild.
+
+           Input: self - Pointer to the current object instance.
+                  request - Sanitized data to potentially add to the queue.
+
+           Output: str - Result of the job scheduling attempt.
+        """
+        guild = request['data']['guild']
+
+        if self.shards is not None and not self.shards.Owns(guild):
+            self.queLog.warning(f"Refused a request from Guild {guild}, which isn't on {self.shards}.")
+            return "This Guild is served by a different shard, please try again shortly."
+
+        return self.GetManager(guild).Add(request)
+
+    def Flush(self, notify : bool = True) -> int:
+        """Flushes every Manager's queue.
+
+           Input: self - Pointer to the current object instance.
+                  notify - Whether to tell requestors their job was dropped.
+
+           Output: int - The number of jobs flushed.
+        """
+        return sum(x.Flush(notify) for x in self.managers.values())
+
+    async def Shutdown(self, timeout : float = None) -> int:
+        """Gracefully stops every Manager in parallel.
+
+           Input: self - Pointer to the current object instance.
+                  timeout - Seconds to wait for outstanding jobs to finish.
+
+           Output: int - The number of jobs that were dropped.
+        """
+        results = await asy.gather(*(x.Shutdown(timeout) \
+                                     for x in self.managers.values()))
+
+        return sum(results)
+
+    def Stats(self) -> dict:
+        """Collects per-lane statistics from every Manager.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: dict - Manager ID to that Manager's lane statistics.
+        """
+        return {x: y.Stats() for x, y in self.managers.items()}
+
+    def Run(self):
+        """Starts every Manager's workers.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        for manager in self.managers.values():
+            manager.Run()
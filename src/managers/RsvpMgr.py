@@ -0,0 +1,252 @@
+#Turns RSVP reactions into event signups.  Reactions on a posted event are
+#collected per message for a short debounce window and then applied together
+#to the event's in-memory rsvp_mbrs, so a burst of signups when a raid opens
+#costs one batched DB write and one message re-render instead of one of each
+#per reaction.  Re-renders go through the edit coalescer, which merges and
+#paces them.
+#
+#Discord bans bots that spam reactions, so no more than max_reactions emotes
+#(including the clear emote) are ever offered on a post.
+#
+#All public functions must be called from the thread running the supplied
+#event loop.
+
+
+#####  Imports  #####
+
+import logging as log
+import src.database.models as md
+
+#####  Package Variables  #####
+
+#Reactions Discord allows on one message.
+max_reactions = 20
+
+
+#####  Package Functions  #####
+
+def Reactions(sched: md.Schedule) -> list:
+    """Lists the emotes to add to a schedule's event posts.  Options past
+       the reaction cap are dropped (with room kept for the clear emote).
+
+       Input: sched - The schedule the event belongs to.
+
+       Output: list - Emotes in the order they should be added.
+    """
+    emotes = [x for x in sched.rsvp_opts if x != sched.rsvp_clr]
+    limit  = max_reactions - (1 if sched.rsvp_clr else 0)
+
+    if len(emotes) > limit:
+        log.getLogger('queue').warning(f"Schedule {sched._id} has {len(emotes)} RSVP options, only the first {limit} will be offered.")
+        emotes = emotes[:limit]
+
+    return emotes + ([sched.rsvp_clr] if sched.rsvp_clr else [])
+
+
+#####  RSVP Pipeline Class  #####
+
+class RsvpPipeline:
+
+    def __init__(self, loop, render, persist=None, editor=None,
+                 opts: dict = None):
+        """Creates an empty pipeline.
+
+           Input: self - Pointer to the current object instance.
+                  loop - The asyncio event loop reactions arrive on.
+                  render - Callable taking an Event and returning its post's
+                           text.
+                  persist - Callable (event_id, fields) that buffers a
+                            partial event update, e.g. a DB interface's
+                            QueueEventUpdate.  None keeps RSVPs in memory
+                            only.
+                  editor - The EditCoalescer re-renders are queued on.
+                  opts - An optional dictionary of configurable options.
+
+           Output: None.
+        """
+        opts          = opts or {}
+        self.debounce = float(opts.get('debounce', 2.0))
+        self.editor   = editor
+        self.loop     = loop
+        self.msgs     = {}
+        self.persist  = persist
+        self.render   = render
+        self.rsvpLog  = log.getLogger('queue')
+        self.stats    = {'reactions': 0, 'applied': 0, 'rejected': 0,
+                         'flushes': 0}
+
+    def __len__(self) -> int:
+        return len(self.msgs)
+
+    def Track(self, event, sched) -> list:
+        """Starts collecting reactions for a posted event.
+
+           Input: self - Pointer to the current object instance.
+                  event - The event (model or document); its msg_id must be
+                          set.
+                  sched - The schedule (model or document) it belongs to.
+
+           Output: list - The emotes the post should carry, already capped.
+        """
+        event = md.Event.Coerce(event)
+        sched = md.Schedule.Coerce(sched)
+        allow = Reactions(sched)
+        self.msgs[event.msg_id] = {'event'   : event,
+                                   'sched'   : sched,
+                                   'allow'   : set(allow),
+                                   'pending' : [],
+                                   'timer'   : None}
+
+        return allow
+
+    def Untrack(self, msg_id):
+        """Stops collecting reactions for a post, dropping unapplied ones.
+
+           Input: self - Pointer to the current object instance.
+                  msg_id - The post's Discord message ID.
+
+           Output: None.
+        """
+        state = self.msgs.pop(int(msg_id), None)
+
+        if state is not None and state['timer'] is not None:
+            state['timer'].cancel()
+
+    def OnReaction(self, msg_id, user_id, emote: str, added: bool) -> bool:
+        """Queues a reaction add or remove for the next debounced apply.
+
+           Input: self - Pointer to the current object instance.
+                  msg_id - The Discord message reacted to.
+                  user_id - The reacting user.
+                  emote - The custom emote's ID or the unicode emoji.
+                  added - True for an add, False for a remove.
+
+           Output: bool - False if the message isn't a tracked event post.
+        """
+        state = self.msgs.get(int(msg_id))
+
+        if state is None:
+            return False
+
+        self.stats['reactions'] += 1
+        state['pending'].append((str(user_id), str(emote), added))
+
+        if state['timer'] is None:
+            state['timer'] = self.loop.call_later(self.debounce, self.Apply,
+                                                  int(msg_id))
+
+        return True
+
+    def _Signup(self, state: dict, user: str, emote: str, added: bool) -> bool:
+        """Applies one reaction to an event's members.
+
+           Input: self - Pointer to the current object instance.
+                  state - The post's tracking state.
+                  user - The reacting user's ID.
+                  emote - The reaction's emote.
+                  added - True for an add, False for a remove.
+
+           Output: bool - True if the members changed.
+        """
+        event = state['event']
+        sched = state['sched']
+        mbrs  = event.rsvp_mbrs
+
+        if emote not in state['allow']:
+            return False
+
+        if emote == sched.rsvp_clr:
+            if not added:
+                return False
+
+            changed = False
+
+            for members in mbrs.values():
+                if user in members:
+                    members.remove(user)
+                    changed = True
+
+            return changed
+
+        role    = sched.rsvp_opts[emote]
+        members = mbrs.setdefault(role, [])
+
+        if not added:
+            if user in members:
+                members.remove(user)
+                return True
+            return False
+
+        limit = int(event.rsvp_lmts.get(role, 0) or 0)
+
+        if user in members:
+            return False
+
+        if limit and len(members) >= limit:
+            self.stats['rejected'] += 1
+            return False
+
+        members.append(user)
+
+        return True
+
+    def Apply(self, msg_id) -> bool:
+        """Applies every reaction collected for a post, then buffers one DB
+           write and queues one re-render if anything changed.
+
+           Input: self - Pointer to the current object instance.
+                  msg_id - The post's Discord message ID.
+
+           Output: bool - True if the event's members changed.
+        """
+        state = self.msgs.get(int(msg_id))
+
+        if state is None:
+            return False
+
+        pending, state['pending'] = state['pending'], []
+        state['timer']            = None
+        changed                   = False
+
+        for user, emote, added in pending:
+            changed = self._Signup(state, user, emote, added) or changed
+
+        self.stats['applied'] += len(pending)
+
+        if not changed:
+            return False
+
+        event = state['event']
+        self.stats['flushes'] += 1
+
+        if self.persist is not None:
+            self.persist(event._id, {'rsvp_mbrs': {x: list(y) for x, y in event.rsvp_mbrs.items()}})
+
+        if self.editor is not None:
+            try:
+                self.editor.Queue(event.msg_id, event.ch_id, self.render(event))
+
+            except Exception as err:
+                self.rsvpLog.error(f"Unable to render RSVPs for message {msg_id}: {err}")
+
+        self.rsvpLog.debug(f"Applied {len(pending)} reactions to message {msg_id}.")
+
+        return True
+
+    def Flush(self) -> int:
+        """Applies every pending reaction immediately, e.g. during shutdown.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: int - The number of posts whose members changed.
+        """
+        changed = 0
+
+        for msg_id, state in list(self.msgs.items()):
+            if state['timer'] is not None:
+                state['timer'].cancel()
+
+            if state['pending'] and self.Apply(msg_id):
+                changed += 1
+
+        return changed
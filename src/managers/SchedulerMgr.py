@@ -0,0 +1,461 @@
+#Manages every pending event timer (starts, reminders, end reminders, and
+#announcements) in a single indexed min-heap.  The scheduler sleeps until the
+#next due timer instead of polling the database, which keeps it cheap even
+#with tens of thousands of events spread across guilds.
+#
+#All public functions must be called from the thread running the supplied
+#event loop; the heap itself is not locked.
+
+
+#####  Imports  #####
+
+import asyncio as asy
+import datetime as dt
+import itertools
+import logging as log
+import src.utilities.recurrence as rc
+import time
+
+#####  Package Variables  #####
+
+#Maps the event template fields that hold timestamps to the kind of timer they
+#create.  Field names intentionally match models.Event (typos and all).
+timer_fields = {'start'    : 'start',
+                'remimds'  : 'remind',
+                'end_rems' : 'end_remind',
+                'annc_tim' : 'announce'}
+#How many days ahead to look for a repeating event's next occurrence.  Wider
+#windows are only tried when the narrower one is empty, so frequent rules
+#never expand more than a week.
+recur_days   = (7, 366, 1500)
+
+
+#####  Package Functions  #####
+
+def ToEpoch(stamp) -> float:
+    """Converts a timestamp from any of the formats the DB or templates may
+       contain into seconds since the epoch (UTC).
+
+       Input: stamp - A datetime, int/float epoch, or ISO-8601 string.  The
+                      template's 'ISODate(...)' wrapper is also accepted.
+
+       Output: float - The timestamp as epoch seconds, or None if invalid.
+    """
+    if isinstance(stamp, dt.datetime):
+        #Mongo hands back naive datetimes that are implicitly UTC.
+        if stamp.tzinfo is None:
+            stamp = stamp.replace(tzinfo=dt.timezone.utc)
+        return stamp.timestamp()
+
+    if isinstance(stamp, (int, float)) and not isinstance(stamp, bool):
+        return float(stamp)
+
+    if isinstance(stamp, str) and stamp:
+        text = stamp.strip()
+
+        if text.startswith('ISODate(') and text.endswith(')'):
+            text = text[8:-1].strip('\'"')
+
+        try:
+            #fromisoformat doesn't understand the 'Z' suffix until 3.11.
+            return ToEpoch(dt.datetime.fromisoformat(text.replace('Z', '+00:00')))
+
+        except ValueError:
+            return None
+
+    return None
+
+def FlattenStamps(value) -> list:
+    """Flattens a template timestamp field into a plain list.  Fields may be a
+       single value, a list, or a dict of lists (e.g. announcement times keyed
+       by announcement ID).
+
+       Input: value - The raw field value from an event document.
+
+       Output: list - Every timestamp contained in the field.
+    """
+    if value is None:
+        return []
+
+    if isinstance(value, dict):
+        return [x for v in value.values() for x in FlattenStamps(v)]
+
+    if isinstance(value, (list, tuple, set)):
+        return [x for v in value for x in FlattenStamps(v)]
+
+    return [value]
+
+def ShiftStamps(value, offset: dt.timedelta):
+    """Moves every timestamp in a template field by 'offset', keeping the
+       field's shape.
+
+       Input: value - The raw field value from an event document.
+              offset - How far to move each timestamp.
+
+       Output: The shifted value; stamps come back as aware UTC datetimes.
+    """
+    if isinstance(value, dict):
+        return {x: ShiftStamps(y, offset) for x, y in value.items()}
+
+    if isinstance(value, (list, tuple, set)):
+        return [ShiftStamps(x, offset) for x in value]
+
+    when = ToEpoch(value)
+
+    if when is None:
+        return value
+
+    return dt.datetime.fromtimestamp(when, dt.timezone.utc) + offset
+
+def Occurrence(event, zone: str, after: float) -> dict:
+    """Builds the document for a repeating event's first occurrence starting
+       after 'after', with its reminders and announcements moved along with
+       it.
+
+       Input: event - An event document or models.Event with a 'recur' rule.
+              zone - The schedule's timezone.
+              after - Epoch seconds; the occurrence must start after this.
+
+       Output: dict - The shifted event document, or None if the rule has no
+                      more occurrences.
+    """
+    doc   = event.ToBson() if hasattr(event, 'ToBson') else dict(event)
+    first = ToEpoch(doc.get('orig_st')) or ToEpoch(doc.get('start'))
+
+    if first is None:
+        return None
+
+    first = dt.datetime.fromtimestamp(first, dt.timezone.utc)
+    now   = dt.datetime.fromtimestamp(after, dt.timezone.utc) + dt.timedelta(microseconds=1)
+    when  = None
+
+    for days in recur_days:
+        when = rc.Next(doc | {'orig_st': first}, zone, now, days)
+
+        if when is not None:
+            break
+
+    if when is None:
+        return None
+
+    offset = when - first
+
+    for field in list(timer_fields) + ['end']:
+        if field != 'start' and doc.get(field) is not None:
+            doc[field] = ShiftStamps(doc[field], offset)
+
+    doc['start']   = when
+    doc['orig_st'] = first
+
+    return doc
+
+
+#####  Scheduler Class  #####
+
+class Scheduler:
+
+    def __init__(self, loop, fire, opts: dict = None, shards=None):
+        """Tracks pending event timers and calls 'fire' as each comes due.
+           Timers are keyed by (event_id, kind, index) so a single event can
+           have many reminders and still be cancelled as a whole.
+
+           Input: self - Pointer to the current object instance.
+                  loop - The asyncio event loop timers are dispatched on.
+                  fire - Callable (or coroutine function) invoked with
+                         (key, payload) when a timer is due.
+                  opts - An optional dictionary of configurable options.
+                  shards - Optional ShardSet; events in guilds on other
+                           shards are never loaded.
+
+           Output: None - Throws exceptions on error.
+        """
+        opts            = opts or {}
+        self.shards     = shards
+        self.by_event   = {}
+        self.counter    = itertools.count()
+        self.fire       = fire
+        self.heap       = []
+        self.index      = {}
+        self.keep_going = True
+        self.loop       = loop
+        self.schLog     = log.getLogger('queue')
+        self.wake       = asy.Event()
+        #Timers that are already this late when loaded (say, after a restart)
+        #are dropped rather than spamming a channel with stale reminders.
+        self.max_late   = float(opts.get('max_late', 300))
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    #Heap helpers.  Entries are [when, seq, key, payload]; the sequence number
+    #keeps equal timestamps in insertion order and stops payload comparisons.
+
+    def _Swap(self, i: int, j: int):
+        heap             = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.index[heap[i][2]] = i
+        self.index[heap[j][2]] = j
+
+    def _SiftUp(self, pos: int) -> int:
+        heap = self.heap
+
+        while pos > 0:
+            parent = (pos - 1) >> 1
+
+            if heap[pos][:2] < heap[parent][:2]:
+                self._Swap(pos, parent)
+                pos = parent
+            else:
+                break
+
+        return pos
+
+    def _SiftDown(self, pos: int) -> int:
+        heap  = self.heap
+        count = len(heap)
+
+        while True:
+            child = 2 * pos + 1
+
+            if child >= count:
+                break
+
+            if child + 1 < count and heap[child + 1][:2] < heap[child][:2]:
+                child += 1
+
+            if heap[child][:2] < heap[pos][:2]:
+                self._Swap(pos, child)
+                pos = child
+            else:
+                break
+
+        return pos
+
+    def _Remove(self, pos: int) -> list:
+        heap  = self.heap
+        entry = heap[pos]
+        last  = heap.pop()
+        del self.index[entry[2]]
+
+        if pos < len(heap):
+            heap[pos] = last
+            self.index[last[2]] = pos
+
+            if self._SiftUp(pos) == pos:
+                self._SiftDown(pos)
+
+        return entry
+
+    def Add(self, key: tuple, when, payload=None) -> bool:
+        """Adds (or reschedules) a single timer in O(log n).  Only wakes the
+           run loop if the new timer becomes the next one due.
+
+           Input: self - Pointer to the current object instance.
+                  key - A hashable (event_id, kind, index) tuple.
+                  when - When the timer is due, in any ToEpoch format.
+                  payload - Opaque data handed back to 'fire'.
+
+           Output: bool - True if the timer was scheduled.
+        """
+        stamp = ToEpoch(when)
+
+        if stamp is None:
+            self.schLog.warning(f"Ignoring timer {key} with invalid time {when}.")
+            return False
+
+        if key in self.index:
+            pos   = self.index[key]
+            entry = self.heap[pos]
+            entry[0], entry[1], entry[3] = stamp, next(self.counter), payload
+
+            if self._SiftUp(pos) == pos:
+                self._SiftDown(pos)
+        else:
+            self.heap.append([stamp, next(self.counter), key, payload])
+            self.index[key] = len(self.heap) - 1
+            self._SiftUp(len(self.heap) - 1)
+            self.by_event.setdefault(key[0], set()).add(key)
+
+        if self.index[key] == 0:
+            self.wake.set()
+
+        return True
+
+    def Cancel(self, key: tuple) -> bool:
+        """Removes a single timer in O(log n).
+
+           Input: self - Pointer to the current object instance.
+                  key - The key the timer was added with.
+
+           Output: bool - True if a timer was removed.
+        """
+        pos = self.index.get(key)
+
+        if pos is None:
+            return False
+
+        self._Remove(pos)
+        keys = self.by_event.get(key[0])
+
+        if keys is not None:
+            keys.discard(key)
+
+            if not keys:
+                del self.by_event[key[0]]
+
+        #The run loop may be sleeping on the timer that was just removed.
+        if pos == 0:
+            self.wake.set()
+
+        return True
+
+    def CancelEvent(self, event_id) -> int:
+        """Removes every timer belonging to an event, e.g. when it's deleted
+           or edited.
+
+           Input: self - Pointer to the current object instance.
+                  event_id - The ID the event's timers were loaded under.
+
+           Output: int - The number of timers removed.
+        """
+        keys = list(self.by_event.get(event_id, ()))
+
+        for key in keys:
+            self.Cancel(key)
+
+        return len(keys)
+
+    def LoadEvent(self, event: dict, event_id=None, zone: str = 'UTC',
+                  after: float = None) -> int:
+        """Replaces the timers for an event document with the timestamps it
+           currently holds.  Disabled timer types are skipped.  A repeating
+           event is loaded as its next occurrence, and the payload handed to
+           'fire' is that occurrence's document.
+
+           Input: self - Pointer to the current object instance.
+                  event - An event document or models.Event.
+                  event_id - Optional override for the document's '_id'.
+                  zone - The schedule's timezone, for repeating events.
+                  after - Epoch seconds; load the first occurrence starting
+                          after this instead of the first with timers still
+                          due, e.g. once an occurrence's timers have fired.
+
+           Output: int - The number of timers scheduled.
+        """
+        event_id = event.get('_id') if event_id is None else event_id
+        added    = 0
+
+        if self.shards is not None and not self.shards.Owns(event.get('guild_id')):
+            return 0
+
+        cutoff   = time.time() - self.max_late
+
+        if event.get('recur'):
+            #An occurrence that started a little while ago may still have
+            #end reminders to fire.
+            start = ToEpoch(event.get('start')) or 0
+            end   = ToEpoch(event.get('end')) or start
+            event = Occurrence(event, zone, cutoff - (end - start) if after is None else after)
+
+            if event is None:
+                self.CancelEvent(event_id)
+                return 0
+        disabled = {'start'      : str(event.get('dsbl_st', False)) == 'True',
+                    'remind'     : str(event.get('dsbl_rem', False)) == 'True',
+                    'end_remind' : str(event.get('dsbl_ed', False)) == 'True'}
+
+        self.CancelEvent(event_id)
+
+        for field, kind in timer_fields.items():
+
+            if disabled.get(kind, False):
+                continue
+
+            for count, stamp in enumerate(FlattenStamps(event.get(field))):
+                when = ToEpoch(stamp)
+
+                if when is None or when < cutoff:
+                    continue
+
+                if self.Add((event_id, kind, count), when, event):
+                    added += 1
+
+        self.schLog.debug(f"Loaded {added} timers for event {event_id}.")
+        return added
+
+    def NextDue(self) -> float:
+        """Returns when the next timer is due.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: float - Epoch seconds of the next timer, or None if empty.
+        """
+        return self.heap[0][0] if self.heap else None
+
+    def PopDue(self, now: float = None) -> list:
+        """Removes and returns every timer due at or before 'now'.
+
+           Input: self - Pointer to the current object instance.
+                  now - Epoch seconds to compare against; defaults to now.
+
+           Output: list - (key, payload) tuples in due order.
+        """
+        now = time.time() if now is None else now
+        due = []
+
+        while self.heap and self.heap[0][0] <= now:
+            key = self.heap[0][2]
+            due.append((key, self.heap[0][3]))
+            self.Cancel(key)
+
+        return due
+
+    def Stop(self):
+        """Stops the run loop after its current wake.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.keep_going = False
+        self.wake.set()
+
+    async def Run(self):
+        """Sleeps until the next timer is due, fires it, and repeats.  Adding
+           an earlier timer wakes the loop early so nothing fires late.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.schLog.info(f"Scheduler starting with {len(self.heap)} timers.")
+
+        while self.keep_going:
+            self.wake.clear()
+            nxt = self.NextDue()
+
+            if nxt is None:
+                await self.wake.wait()
+                continue
+
+            delay = nxt - time.time()
+
+            if delay > 0:
+                try:
+                    await asy.wait_for(self.wake.wait(), timeout=delay)
+                except asy.TimeoutError:
+                    pass
+                continue
+
+            for key, payload in self.PopDue():
+
+                try:
+                    result = self.fire(key, payload)
+
+                    if asy.iscoroutine(result):
+                        self.loop.create_task(result, name="timer")
+
+                except Exception as err:
+                    self.schLog.error(f"Timer {key} failed to fire: {err}")
+
+        self.schLog.info(f"Scheduler stopped.")
@@ -0,0 +1,286 @@
+#Keeps schedules in sync with the Google Calendars they're linked to.  The
+#first sync imports the schedule's window (sync_len days) in full and saves
+#the calendar's sync token; every later sync asks Google only for what changed
+#since that token, with the last ETag sent as If-None-Match so an unchanged
+#calendar costs a single 304.  Changes are diffed against the events already
+#stored under each google_id so only new or edited events are written and
+#handed back to be re-posted.
+
+
+#####  Imports  #####
+
+import datetime as dt
+import logging as log
+import src.database.models as md
+import src.utilities.http_client as hc
+import urllib.parse
+import zoneinfo
+
+#####  Package Variables  #####
+
+default_url = 'https://www.googleapis.com/calendar/v3'
+#Event fields Google owns.  A change to any of these is a real change; the
+#rest of the event (RSVPs, message IDs, ...) belongs to PSB and is kept.
+google_fields = ('title', 'descrption', 'location', 'start', 'end', 'url')
+
+
+#####  Package Functions  #####
+
+def EventId(ch_id, google_id: str) -> str:
+    """Builds the event ID for a synced event.  It's deterministic so a
+       re-import (say, after a lost sync token) updates events in place
+       instead of duplicating them.
+
+       Input: ch_id - The schedule's channel ID.
+              google_id - Google's ID for the event.
+
+       Output: str - The event's _id.
+    """
+    return f"gcal:{ch_id}:{google_id}"
+
+def ParseTime(value: dict, zone: str):
+    """Converts a Google start/end object to a UTC datetime.  All-day events
+       only have a date, which is taken as midnight in the schedule's zone.
+
+       Input: value - Google's {'dateTime': ...} or {'date': ...} object.
+              zone - The schedule's timezone.
+
+       Output: datetime - The time in UTC, or None if there isn't one.
+    """
+    value = value or {}
+
+    if 'dateTime' in value:
+        return md._ToStamp(value['dateTime'])
+
+    if 'date' in value:
+        day = dt.date.fromisoformat(value['date'])
+        return dt.datetime.combine(day, dt.time(), zoneinfo.ZoneInfo(zone)) \
+                 .astimezone(dt.timezone.utc)
+
+    return None
+
+
+#####  Calendar Sync Class  #####
+
+class CalendarSync:
+
+    def __init__(self, db, opts: dict = None, http: hc.HttpClient = None):
+        """Creates a sync engine on top of a database interface.
+
+           Input: self - Pointer to the current object instance.
+                  db - The database interface (GetSchedule, GetEvents,
+                       PutSchedule, PutEvent, DeleteEvent).
+                  opts - An optional dictionary of configurable options.
+                         'base_url' points the engine at a different
+                         Calendar API server, e.g. a local fake for testing.
+                  http - The shared outbound client; one is made if omitted.
+
+           Output: None.
+        """
+        opts          = opts or {}
+        self.api_key  = opts.get('api_key', '')
+        self.base_url = opts.get('base_url', default_url).rstrip('/')
+        self.db       = db
+        self.http     = http if http is not None else hc.HttpClient(opts)
+        self.page     = int(opts.get('page_size', 250))
+        self.syncLog  = log.getLogger('queue')
+        self.timeout  = float(opts.get('timeout', 10))
+
+    async def _Get(self, url: str, params: dict, headers: dict) -> tuple:
+        """Performs one GET through the shared client.
+
+           Input: self - Pointer to the current object instance.
+                  url - The endpoint.
+                  params - Query parameters.
+                  headers - Request headers.
+
+           Output: tuple - (status, response headers, decoded JSON body or
+                           None).
+        """
+        if self.api_key:
+            params = params | {'key': self.api_key}
+
+        resp = await self.http.ARequest('GET', url, params=params,
+                                        headers=headers, timeout=self.timeout)
+        #304 and 410 are expected answers with no body worth reading.
+        body = resp.json() if resp.status_code == 200 else None
+
+        return resp.status_code, resp.headers, body
+
+    async def _Pull(self, sched: md.Schedule, now: dt.datetime) -> tuple:
+        """Pulls every page of changes for a schedule's calendar.
+
+           Input: self - Pointer to the current object instance.
+                  sched - The schedule being synced.
+                  now - The start of the full import window.
+
+           Output: tuple - (items, next sync token, ETag, full import?) or
+                           None if the calendar is unchanged.
+        """
+        url  = f"{self.base_url}/calendars/{urllib.parse.quote(sched.sync_addr, safe='')}/events"
+        full = not sched.sync_tok
+
+        #Google requires sync token requests to repeat the import's query
+        #parameters, except the time bounds which it rejects alongside one.
+        base = {'singleEvents' : 'true',
+                'maxResults'   : self.page}
+
+        if full:
+            base    = base | {'timeMin' : now.isoformat(),
+                              'timeMax' : (now + dt.timedelta(days=sched.sync_len)).isoformat()}
+            headers = {}
+        else:
+            base    = base | {'syncToken': sched.sync_tok}
+            headers = {'If-None-Match': sched.sync_etag} if sched.sync_etag else {}
+
+        items = []
+        token = None
+        etag  = ''
+
+        while True:
+            params = base | ({'pageToken': token} if token else {})
+            status, resp_headers, body = await self._Get(url, params, headers)
+
+            if status == 304:
+                return None
+
+            #The token expired; Google wants a fresh full import.
+            if status == 410 and not full:
+                self.syncLog.info(f"Sync token for schedule {sched._id} expired, re-importing.")
+                sched.sync_tok  = ''
+                sched.sync_etag = ''
+                return await self._Pull(sched, now)
+
+            if status != 200 or body is None:
+                raise RuntimeError(f"Calendar {sched.sync_addr} returned HTTP {status}")
+
+            items.extend(body.get('items', []))
+            etag  = resp_headers.get('ETag', body.get('etag', etag))
+            token = body.get('nextPageToken')
+
+            if not token:
+                return items, body.get('nextSyncToken', ''), etag, full
+
+            #Only the first page is conditional.
+            headers = {}
+
+    def _Convert(self, item: dict, sched: md.Schedule,
+                 current: md.Event) -> md.Event:
+        """Builds the event a Google item should be stored as, keeping PSB's
+           own fields from the current copy if there is one.
+
+           Input: self - Pointer to the current object instance.
+                  item - The Google Calendar event resource.
+                  sched - The schedule it belongs to.
+                  current - The stored event, or None.
+
+           Output: Event - The event to store.
+        """
+        event = md.Event.FromBson(current.ToBson()) if current is not None \
+                else md.Event(_id=EventId(sched._id, item['id']),
+                              ch_id=sched._id,
+                              google_id=item['id'],
+                              guild_id=sched.guild_id)
+        event.title      = item.get('summary', '') or '(untitled)'
+        event.descrption = item.get('description', '')
+        event.location   = item.get('location', '')
+        event.url        = item.get('htmlLink', '')
+        event.start      = ParseTime(item.get('start'), sched.timezone)
+        event.end        = ParseTime(item.get('end'), sched.timezone)
+
+        if current is None or event.start != current.start:
+            event.orig_st = event.start
+            event.remimds = [event.start - dt.timedelta(minutes=x) \
+                             for x in sched.def_rems] if event.start else []
+
+        return event
+
+    async def Sync(self, sched_id, now: dt.datetime = None,
+                   full: bool = False) -> dict:
+        """Syncs one schedule with its Google Calendar.  Incremental syncs
+           can't be bounded by time, so their changes are filtered against
+           the window here; events that drift into the window without
+           changing arrive with the next full import.
+
+           Input: self - Pointer to the current object instance.
+                  sched_id - The schedule's channel ID.
+                  now - The start of the sync window; defaults to now.
+                  full - Re-import the whole window even if there's a sync
+                         token.
+
+           Output: dict - 'added', 'changed', and 'removed' lists of events
+                          (the first two need (re-)posting), plus 'full' and
+                          'unchanged' counts.  Throws on HTTP or DB errors,
+                          leaving the stored sync token untouched.
+        """
+        now    = dt.datetime.now(dt.timezone.utc) if now is None else now
+        sched  = md.Schedule.FromBson(await self.db.GetSchedule(sched_id) or {})
+        result = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0,
+                  'full': False}
+
+        if not sched.sync_addr:
+            return result
+
+        if full:
+            sched.sync_tok  = ''
+            sched.sync_etag = ''
+
+        pulled = await self._Pull(sched, now)
+
+        if pulled is None:
+            self.syncLog.debug(f"Calendar for schedule {sched_id} is unchanged.")
+            return result
+
+        items, sync_tok, etag, full = pulled
+        end    = now + dt.timedelta(days=sched.sync_len)
+        stored = {x['google_id']: md.Event.FromBson(x) \
+                  for x in await self.db.GetEvents(sched.guild_id, sched._id) \
+                  if x.get('google_id')}
+        seen   = set()
+
+        for item in items:
+            seen.add(item['id'])
+            current = stored.get(item['id'])
+
+            if item.get('status') == 'cancelled':
+                if current is not None:
+                    await self.db.DeleteEvent(current._id)
+                    result['removed'].append(current)
+                continue
+
+            event = self._Convert(item, sched, current)
+
+            #A copy that moved out of the window is removed, matching what a
+            #full import would leave stored.
+            if not full and (event.start is None or not now <= event.start < end):
+                if current is not None:
+                    await self.db.DeleteEvent(current._id)
+                    result['removed'].append(current)
+                continue
+
+            if current is not None and \
+               all(getattr(event, x) == getattr(current, x) for x in google_fields):
+                result['unchanged'] += 1
+                continue
+
+            await self.db.PutEvent(event._id, event)
+            result['changed' if current is not None else 'added'].append(event)
+
+        #A full import lists everything in its window, so anything stored in
+        #that window that Google didn't return was deleted.
+        if full:
+            for google_id, current in stored.items():
+                if google_id not in seen and current.start is not None and \
+                   now <= current.start < end:
+                    await self.db.DeleteEvent(current._id)
+                    result['removed'].append(current)
+
+        sched.sync_tok  = sync_tok
+        sched.sync_etag = etag
+        sched.sync_time = now
+        await self.db.PutSchedule(sched._id, sched)
+        result['full'] = full
+
+        self.syncLog.info(f"Synced schedule {sched_id}: {len(result['added'])} added, {len(result['changed'])} changed, {len(result['removed'])} removed.")
+
+        return result
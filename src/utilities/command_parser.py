@@ -2,12 +2,256 @@
 #interfaces.  It returns the command as an argument list that can be directly
 #fed to the respective database interface.
 
-import argparse as ap
+import collections as co
+import concurrent.futures as cf
+import itertools
 import json
 import logging as log
 import os
 import sys
 
+##### Package Variables #####
+
+#Sentinel default for positional arguments that must be supplied.
+required = object()
+#Paths are anchored to this file so the parser works from any directory.
+log_path     = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                            os.pardir, os.pardir, 'logs', 'command.log')
+strings_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                            'parse_strings.json')
+#Shared by every CommandParser (and so every manager and guild) in the
+#process.  Both are filled in lazily on first use.
+nodes        = {}
+strings      = None
+#Each process in a ParseMany pool keeps its own parser.
+pool_parser  = None
+
+
+##### Converters #####
+#Converters return (ok, value) instead of raising so a bad argument is just a
+#parse result, not an exception.
+
+def _Str(token : str) -> tuple:
+    return (True, token)
+
+def _Int(token : str) -> tuple:
+    digits = token[1:] if token[:1] in ('-', '+') else token
+
+    #isdigit alone accepts things like superscripts that int() rejects.
+    if digits and digits.isascii() and digits.isdigit():
+        return (True, int(token))
+
+    return (False, None)
+
+def _Bool(token : str) -> tuple:
+    lowered = token.lower()
+
+    if lowered in ('on', 'true', 'yes', '1'):
+        return (True, True)
+
+    if lowered in ('off', 'false', 'no', '0'):
+        return (True, False)
+
+    return (False, None)
+
+def _Choice(*choices : str):
+    def _Convert(token : str) -> tuple:
+        lowered = token.lower()
+        return (lowered in choices, lowered if lowered in choices else None)
+
+    _Convert.__name__ = '|'.join(choices)
+
+    return _Convert
+
+#The command grammar.  Each node lists its positional 'args' as
+#(name, converter, default), its '-opts' as the same, bare word 'flags', and
+#nested 'subs'.  'help' names the usage text in parse_strings.json.  Commands
+#without an entry here (create, edit, and guild, which take open-ended field
+#lists) aren't implemented yet.
+grammar = {
+    'announcements': {'help' : 'ann_desc',
+                      'args' : [('ID', _Str, required)],
+                      'subs' : {'add'    : {'help' : 'ann_add_help',
+                                            'args' : [('channel', _Int, required),
+                                                      ('rem_time', _Str, required),
+                                                      ('message', _Str, required)]},
+                                'remove' : {'help' : 'ann_rem_help',
+                                            'args' : [('msg_id', _Int, required)]}}},
+    'config'       : {'help' : 'cfg_desc',
+                      'args' : [('chan', _Int, required)],
+                      'subs' : {'msg'         : {'help' : 'cfg_msg_help',
+                                                 'args' : [('msg_txt', _Str, required)]},
+                                'remind'      : {'help'  : 'cfg_rmd_help',
+                                                 'flags' : ['remove'],
+                                                 'args'  : [('msg', _Str, '')]},
+                                'end-remind'  : {'help' : 'cfg_erm_help',
+                                                 'args' : [('msg', _Str, '')]},
+                                'chan'        : {'help' : 'cfg_chn_help',
+                                                 'args' : [('msg', _Str, '')]},
+                                'remind-msg'  : {'help' : 'cfg_rms_help',
+                                                 'args' : [('msg', _Str, '')]},
+                                'rsvp'        : {'help' : 'cfg_rvp_help',
+                                                 'args' : [('action', _Choice('on', 'off', 'add', 'remove'), required)],
+                                                 'opts' : {'-role' : ('role', _Str, ''),
+                                                           '-id'   : ('id', _Int, 0)}},
+                                'clear'       : {'help' : 'cfg_clr_help',
+                                                 'args' : [('id', _Str, '')]},
+                                'exclusivity' : {'help' : 'cfg_exc_help',
+                                                 'args' : [('action', _Str, '')]}}},
+    'delete'       : {'help' : 'del_desc',
+                      'args' : [('target', _Str, '')]},
+    'diagnose'     : {'help' : 'dgn_desc'},
+    'events'       : {'help' : 'evn_desc',
+                      'args' : [('chan', _Str, 'all')]},
+    'init'         : {'help' : 'ini_desc',
+                      'args' : [('chan', _Int, 0)]},
+    'list'         : {'help' : 'lst_desc',
+                      'args' : [('ID', _Str, required),
+                                ('display', _Str, ''),
+                                ('filter', _Str, '')]},
+    'manage'       : {'help' : 'mng_desc',
+                      'args' : [('ID', _Str, required),
+                                ('action', _Choice('add', 'remove'), required),
+                                ('group', _Str, required),
+                                ('user', _Int, required)]},
+    'oauth'        : {'help' : 'oau_desc',
+                      'args' : [('token', _Str, required)]},
+    'purge'        : {'help' : 'prg_desc',
+                      'args' : [('chan', _Int, required)]},
+    'schedules'    : {'help' : 'sch_desc'},
+    'skip'         : {'help' : 'skp_desc',
+                      'args' : [('ID', _Str, required)]},
+    'sort'         : {'help' : 'srt_desc',
+                      'args' : [('chan', _Int, required),
+                                ('order', _Choice('asc', 'desc'), 'desc')]},
+    'sync'         : {'help'  : 'syn_help',
+                      'args'  : [('chan', _Int, required)],
+                      'flags' : ['full']},
+    'test'         : {'help' : 'tst_desc',
+                      'args' : [('msg', _Str, required),
+                                ('type', _Str, 'start')]},
+    'zones'        : {'help' : 'zon_desc',
+                      'args' : [('zone', _Str, required)]}
+}
+
+
+##### Package Functions #####
+
+def Tokenize(cmd : str) -> tuple:
+    """Splits a command string on whitespace, keeping quoted strings whole.
+       A quote only closes a string when followed by whitespace (or the end)
+       and when the next quote, if any, opens another string, so user
+       formats may contain quotes themselves (the original bot allowed
+       unrestricted, quoted message formats).
+
+       Input: cmd - The user-supplied string.
+
+       Output: tuple - (list of tokens, error string or '' on success).
+    """
+    tokens = []
+    pos    = 0
+    size   = len(cmd)
+
+    while pos < size:
+
+        if cmd[pos].isspace():
+            pos += 1
+            continue
+
+        if cmd[pos] == '"':
+            close = pos
+
+            while True:
+                close = cmd.find('"', close + 1)
+
+                if close < 0:
+                    return (tokens, f"Unbalanced quote at position {pos}.")
+
+                if close + 1 < size and not cmd[close + 1].isspace():
+                    continue
+
+                #If the next quote isn't opening a new string, this one
+                #wasn't really the end of the current string either.
+                after = cmd.find('"', close + 1)
+
+                if after < 0 or cmd[after - 1].isspace():
+                    break
+
+            tokens.append(cmd[pos + 1:close])
+            pos = close + 1
+
+        else:
+            end = pos
+
+            while end < size and not cmd[end].isspace():
+                end += 1
+
+            tokens.append(cmd[pos:end])
+            pos = end
+
+    return (tokens, '')
+
+def GetStrings() -> dict:
+    """Returns the parser's help strings, loading parse_strings.json the
+       first time it's needed.
+
+       Input: None.
+
+       Output: dict - The strings, or an empty dict if they can't be loaded.
+    """
+    global strings
+
+    if strings is None:
+        try:
+            with open(strings_path, encoding='utf-8') as json_file:
+                strings = json.load(json_file)
+
+        except Exception as err:
+            log.getLogger('command_log').error(f"Unable to get parser strings: {err}")
+            strings = {}
+
+    return strings
+
+def GetNode(name : str) -> dict:
+    """Returns the compiled subcommand trie for a command, building it from
+       the grammar on first use.  Each node holds its grammar 'spec' and a
+       'next' dict of subcommand nodes, so dispatch is a dict lookup per word.
+
+       Input: name - The command name.
+
+       Output: dict - The command's root node, or None if it has no grammar.
+    """
+    node = nodes.get(name)
+
+    if node is None and name in grammar:
+
+        def _Node(spec : dict) -> dict:
+            return {'spec' : spec,
+                    'next' : {x : _Node(y) for x, y in spec.get('subs', {}).items()}}
+
+        node        = _Node(grammar[name])
+        nodes[name] = node
+
+    return node
+
+
+def _ParseChunk(chunk : list) -> list:
+    """Parses a chunk of (line number, command) pairs inside a ParseMany
+       worker process.
+
+       Input: chunk - The numbered commands to parse.
+
+       Output: list - A result dict per command, tagged with 'line' and 'raw'.
+    """
+    global pool_parser
+
+    if pool_parser is None:
+        pool_parser = CommandParser()
+
+    return [pool_parser.SortCommand(cmd) | {'line' : line, 'raw' : cmd} \
+            for line, cmd in chunk]
+
+
 ##### Command Parser Class #####
 class CommandParser:
 
@@ -27,6 +271,7 @@ class CommandParser:
                       'list'         : self.ParseList,
                       'manage'       : self.ParseManage,
                       'oauth'        : self.ParseOauth,
+                      'purge'        : self.ParsePurge,
                       'schedules'    : self.ParseSchedules,
                       'skip'         : self.ParseSkip,
                       'sort'         : self.ParseSort,
@@ -36,403 +281,435 @@ class CommandParser:
                       }
 
         self.cmd_log = log.getLogger('command_log')
-        self.cmd_log.setLevel(log.INFO)
-        self.cmd_log.addHandler(log.FileHandler('command.log'))
-        self.cmd_log.propagate = False
-        self.cmd_log.info(f"Command logger initialized.")
 
-        #We can now at least use the logger for errors.
-        try:
-            json_file = open('parse_strings.json')
-            self.txt  = json.load(json_file)
+        #The logger is shared, so only the first parser sets it up.
+        if not self.cmd_log.handlers:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            self.cmd_log.setLevel(log.INFO)
+            self.cmd_log.addHandler(log.FileHandler(log_path))
+            self.cmd_log.propagate = False
+            self.cmd_log.info(f"Command logger initialized.")
 
-        except Exception as err:
-            self.cmd_log.error(f"Unable to get parser strings: {err}")
-
-        #It's presumably faster to make all the parser instances once instead
-        #of every invocation of a parse function.
-        self.annAp = ap.ArgumentParser(prog=self.txt['ann_prog'], \
-                                       description=self.txt['ann_desc'],
-                                       allow_abbrev=False)
-        #todo:  There's probably a clever way to loop this.
-        self.annAp.add_argument("ID", type=str)
-        self.annSub = self.annAp.add_subparsers()
-        self.annSubAdd = self.annSub.add_parser('add', \
-                                                help=self.txt['ann_add_help'])
-        self.annSubAdd.add_argument('channel', type=int)
-        self.annSubAdd.add_argument('rem_time', type=str)
-        self.annSubAdd.add_argument('message', type=str)
-        self.annSubRem = self.annSub.add_parser('remove',\
-                                                help=self.txt['ann_rem_help'])
-        self.annSubRem.add_argument('msg_id', type=int)
-
-        #Config
-        self.cfgAp = ap.ArgumentParser(prog=self.txt['cfg_prog'], \
-                                       description=self.txt['cfg_desc'],
-                                       allow_abbrev=False)
-        self.cfgAp.add_argument("chan", type=int)
-        self.cfgSub = self.cfgAp.add_subparsers()
-        self.cfgSubMsg = self.cfgSub.add_parser('msg', \
-                                                help=self.txt['cfg_msg_help'])
-        self.cfgSubMsg.add_argument('msg_txt', type=str, \
-                                     help=self.txt['cfg_msg_help'])
-        self.cfgSubRmd = self.cfgSub.add_parser('remind',\
-                                                help=self.txt['cfg_rmd_help'])
-        self.cfgSubRmd.add_argument('remove', type=bool, nargs='?', \
-                                    default=False)
-        self.cfgSubRmd.add_argument('msg', type=str, nargs='?', default='')
-        self.cfgSubErm = self.cfgSub.add_parser('end-remind', \
-                                                help=self.txt['cfg_erm_help'])
-        self.cfgSubErm.add_argument('msg', type=str, nargs='?', default='')
-        self.cfgSubChn = self.cfgSub.add_parser('chan', \
-                                                help=self.txt['cfg_chn_help'])
-        self.cfgSubChn.add_argument('msg', type=str, nargs='?', default='')
-        self.cfgSubRms = self.cfgSub.add_parser('remind-msg', \
-                                                help=self.txt['cfg_rms_help'])
-        self.cfgSubRms.add_argument('msg', type=str, nargs='?', default='')
-        self.cfgSubRvp = self.cfgSub.add_parser('rsvp',
-                                                 help=self.txt['cfg_rvp_help'])
-        self.cfgSubRvp.add_argument('on', type=bool, nargs='?',
-                               default=False, help=self.txt['cfg_rvp_on_help'])
-        self.cfgSubRvp.add_argument('add', type=bool, nargs='?', \
-                              default=False, help=self.txt['cfg_rvp_add_help'])
-        self.cfgSubRvp.add_argument('-role', type=str, nargs='?', default='');
-        self.cfgSubRvp.add_argument('-id', type=int, nargs= '?', default=0);
-        self.cfgSubRvp.add_argument('remove', type=bool, nargs='?',
-                                 default='', help=self.txt['cfg_rvp_rmv_help'])
-        self.cfgSubClr = self.cfgSub.add_parser('clear', \
-                                                help=self.txt['cfg_clr_help'])
-        self.cfgSubClr.add_argument('id', type=str, nargs='?', default='')
-        self.cfgSubExc = self.cfgSub.add_parser('exclusivity',
-                                                help=self.txt['cfg_exc_help'])
-        self.cfgSubExc.add_argument('action', type=str, nargs='?', default='')
-
-        #Create
-
-
-
-    def SortCommand(self, cmd : str) -> list:
+        #We can now at least use the logger for errors.  Strings and command
+        #tries are loaded on first use and shared by every parser.
+        self.txt = GetStrings()
+
+
+    def Result(self, cmd : str, sub : str = '', args : dict = None,
+               error : str = '') -> dict:
+        """Builds a parse result.  Results are always dicts so callers (and
+           batch imports) can report errors without catching exceptions.
+
+           Input: self - Pointer to the current object instance.
+                  cmd - The command name.
+                  sub - The space-separated subcommand path, if any.
+                  args - The converted arguments.
+                  error - Why parsing failed, or '' on success.
+
+           Output: dict - The 'ok', 'cmd', 'sub', 'args', and 'error' fields.
+        """
+        return {'ok'    : not error,
+                'cmd'   : cmd,
+                'sub'   : sub,
+                'args'  : args if args is not None else {},
+                'error' : error}
+
+
+    def Match(self, cmd : str, args : list) -> dict:
+        """Matches tokens against a command's grammar, walking the subcommand
+           trie as subcommand words are found and converting each argument.
+
+           Input: self - Pointer to the current object instance.
+                  cmd - The command name.
+                  args - The tokens following the command.
+
+           Output: dict - The parse result (see Result).
+        """
+        node = GetNode(cmd)
+
+        if node is None:
+            return self.Result(cmd, error=f"Command {cmd} isn't supported yet.")
+
+        path = []
+        vals = {}
+        pos  = 0
+        spec = node['spec']
+        argn = 0
+
+        while True:
+            positional = spec.get('args', [])
+            options    = spec.get('opts', {})
+            flags      = spec.get('flags', [])
+
+            for flag in flags:
+                vals.setdefault(flag, False)
+
+            #Subcommands can only follow the required positionals.
+            needed = sum(1 for x in positional[argn:] if x[2] is required)
+
+            if pos < len(args) and needed == 0 and args[pos] in node['next']:
+                path.append(args[pos])
+                node = node['next'][args[pos]]
+                spec = node['spec']
+                argn = 0
+                pos += 1
+                continue
+
+            if pos >= len(args):
+                break
+
+            token = args[pos]
+
+            if token in options:
+                name, convert, _ = options[token]
+
+                if pos + 1 >= len(args):
+                    return self.Result(cmd, ' '.join(path), vals,
+                                       f"Option {token} needs a value. {self.txt.get(spec.get('help'), '')}")
+
+                ok, value = convert(args[pos + 1])
+
+                if not ok:
+                    return self.Result(cmd, ' '.join(path), vals,
+                                       f"Invalid {convert.__name__.lstrip('_').lower()} '{args[pos + 1]}' for {token}.")
+
+                vals[name] = value
+                pos += 2
+
+            elif token in flags:
+                vals[token] = True
+                pos += 1
+
+            elif argn < len(positional):
+                name, convert, _ = positional[argn]
+                ok, value        = convert(token)
+
+                if not ok:
+                    return self.Result(cmd, ' '.join(path), vals,
+                                       f"Invalid {convert.__name__.lstrip('_').lower()} '{token}' for {name}. {self.txt.get(spec.get('help'), '')}")
+
+                vals[name] = value
+                argn += 1
+                pos  += 1
+
+            else:
+                return self.Result(cmd, ' '.join(path), vals,
+                                   f"Unexpected argument '{token}'. {self.txt.get(spec.get('help'), '')}")
+
+        for name, convert, default in spec.get('args', [])[argn:]:
+
+            if default is required:
+                return self.Result(cmd, ' '.join(path), vals,
+                                   f"Missing argument {name}. {self.txt.get(spec.get('help'), '')}")
+
+            vals.setdefault(name, default)
+
+        for name, convert, default in spec.get('opts', {}).values():
+            vals.setdefault(name, default)
+
+        return self.Result(cmd, ' '.join(path), vals)
+
+
+    def SortCommand(self, cmd : str) -> dict:
         """Parses the first component of a command string to determine the type
-           of command supplied.  Each command has a different structure and
-           thus a different argparser, requiring initial identification.
+           of command supplied, then hands the remaining tokens to that
+           command's parse function.
 
            Input: self - Pointer to the current object instance.
                   cmd - Pointer to the user-supplied string.
            
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result); 'ok' is False and
+                          'error' explains why if the command is invalid.
         """
-        cmd_str = ''
-        ret     = []
-        usr_str = []
-
         self.cmd_log.debug(f"Given user command: {cmd}")
-        
-        try:
-            usr_str = str(cmd).split(sep=' ',maxsplit=1)
-            #The slash has not yet been stripped.
-            function   = self.funcs[(usr_str[0])[1:].lower()]
 
-        except KeyError as err:
+        tokens, error = Tokenize(str(cmd))
+
+        if not tokens:
+            return self.Result('', error=error or "Empty command.")
+
+        #The prefix (slash or the guild's prefix) has not yet been stripped.
+        name     = tokens[0][1:].lower()
+        function = self.funcs.get(name)
+
+        if function is None:
             self.cmd_log.error(f"Invalid command prefix in string: {cmd}")
-            return ret
-
-        #This is necessary to avoid split issues with commands as the original
-        #bot allowed for unrestricted message format when quoted.  This makes
-        #a split on the other, space-separated, command elements hard.
-        #Fortuantely the quotes are required to by the last element, allowing
-        #us to scan for them and manually insert the string as an argument at
-        #the end of an arg list.
-        #print(f"usr_str: {usr_str}")
-        if usr_str[1].endswith('"'):
-            #User formmated commands can be of any length or pattern, but
-            #shouldn't contain quotes, so we just need to parse backwards to
-            #where another quote can be found to complete the pair.
-            cmd_index = usr_str[1].rfind('"', 0,-1)
-
-            #Technically the else is an error but the parser can handle it.
-            if cmd_index > -1:
-                cmd_str    = usr_str[1][cmd_index:]
-                usr_str[1] = \
-                        usr_str[1][:((cmd_index - 1) if cmd_index > 0 else 0)]
-                self.cmd_log.debug(f"User args had string arg: {cmd_str}")
-                #print(f"split: {usr_str}, {cmd_index}, {cmd_str}")
-        usr_args = usr_str[1].split(' ')
-        usr_args.append(cmd_str)
-        #Todo: this is really just a hack.
-        parse_args = list(filter(None, usr_args))
-        #print(f"args: {parse_args}")
-
-        ret = function(parse_args)
+            return self.Result(name, error=f"Unknown command {name}.")
+
+        if error:
+            self.cmd_log.error(f"Unable to tokenize {cmd}: {error}")
+            return self.Result(name, error=error)
+
+        ret = function(tokens[1:])
+
+        if not ret.get('ok', False):
+            self.cmd_log.error(f"Error parsing {cmd}: {ret.get('error')}")
 
         return ret
 
 
-    def ParseAnnouncements(self, args : list) -> list:
+    def ParseMany(self, cmds, workers : int = 0, chunk_size : int = 256):
+        """Parses a stream of raw command strings, such as a guild's stored
+           Saber command history, yielding a result for every line instead of
+           stopping at the first bad one.  Blank lines are skipped.
+
+           With workers > 0 the lines are parsed in chunks across a process
+           pool.  Only a few chunks are in flight at once, so memory stays
+           bounded no matter how long the input is, and results still come
+           back in input order.
+
+           Input: self - Pointer to the current object instance.
+                  cmds - Any iterable of command strings (e.g. an open file).
+                  workers - Processes to parse with; 0 parses in-process.
+                  chunk_size - Lines handed to a worker at a time.
+
+           Output: generator - Result dicts (see Result) with the 1-based
+                               'line' number and 'raw' command added.
+        """
+        numbered = ((x, y.strip()) for x, y in enumerate(cmds, start=1) \
+                    if str(y).strip())
+
+        if workers <= 0:
+            for line, cmd in numbered:
+                yield self.SortCommand(cmd) | {'line' : line, 'raw' : cmd}
+            return
+
+        chunks = iter(lambda: list(itertools.islice(numbered, chunk_size)), [])
+
+        with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = co.deque(pool.submit(_ParseChunk, x) \
+                               for x in itertools.islice(chunks, workers * 2))
+
+            while pending:
+                results = pending.popleft().result()
+                nxt     = next(chunks, None)
+
+                if nxt is not None:
+                    pending.append(pool.submit(_ParseChunk, nxt))
+
+                yield from results
+
+    def ParseAnnouncements(self, args : list) -> dict:
         """Parses the announcements command.  Announcements requires at least
            1 argument with 2 optional; one for the channel to list 
            announcements, and 2 optional to either add a announcement string
            (instead of list) or which announcement to remove.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
+        self.cmd_log.debug(f"Annc args are: {args}")
 
-        try:
-            self.cmd_log.debug(f"Annc args are: {args}")
-            ret = self.annAp.parse_args(args);
-        except Exception as err:
-            self.cmd_log.error(f"Error in AnnParse: {err=}")
-
-        return ret
+        return self.Match('announcements', args)
 
-    def ParseConfig(self, args : list) -> list:
+    def ParseConfig(self, args : list) -> dict:
         """Parses the config command.  Config modifies schedules and requires
            at least 2 arguments; one for the channel and one for the config.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-        try:
-            self.cmd_log.debug(f"cfg args are: {args}")
-            ret = self.cfgAp.parse_args(args);
-        except Exception as err:
-            self.cmd_log.error(f"Error in CfgParse: {err=}")
+        self.cmd_log.debug(f"cfg args are: {args}")
 
+        return self.Match('config', args)
 
-        return ret
-
-    def ParseCreate(self, args : list) -> list:
+    def ParseCreate(self, args : list) -> dict:
         """Parses the create command.  Create requires at least 3 arguments and
            can have many for specifying comments, roles, and more.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
+        return self.Match('create', args)
 
-        return ret
-
-    def ParseDelete(self, args : list) -> list:
+    def ParseDelete(self, args : list) -> dict:
         """Parses the delete command.  Delete may specify an optional command
            for deleteing events, channels, or all schedules in the guild.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('delete', args)
 
-    def ParseDiagnose(self, args : list) -> list:
+    def ParseDiagnose(self, args : list) -> dict:
         """Parses the diagnose command.  This is a argument-less command that
            performs basic setup checks for the bot (such as guild/channel
            access or definition).
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('diagnose', args)
 
-    def ParseEdit(self, args : list) -> list:
+    def ParseEdit(self, args : list) -> dict:
         """Parses the edit command.  Edit may specify a series of arguments,
            up to the total elements in an event.  At least 2 are required.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('edit', args)
 
-    def ParseEvents(self, args : list) -> list:
+    def ParseEvents(self, args : list) -> dict:
         """Parses the events command.  Events has one optional argument, used
            to filter events for a specific channel instead of 'all'.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('events', args)
 
-    def ParseGuild(self, args : list) -> list:
+    def ParseGuild(self, args : list) -> dict:
         """Parses the guild command.  Guild requires at least 2 arguments, one
            for the type of information modified, and one for its config.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
+        return self.Match('guild', args)
 
-        return ret
-
-    def ParseInit(self, args : list) -> list:
+    def ParseInit(self, args : list) -> dict:
         """Parses the init command.  Init may specify an optional command
            channel, provided as a channel ID.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        print(f"init! Args: {args}")
-        ret = []
+        self.cmd_log.debug(f"init args are: {args}")
 
-        return ret
+        return self.Match('init', args)
 
-    def ParseList(self, args : list) -> list:
+    def ParseList(self, args : list) -> dict:
         """Parses the list command.  List requires one argument and up to 3,
            1 is the event ID to lsit and the other 2 are dispaly and filters.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('list', args)
 
-    def ParseManage(self, args : list) -> list:
+    def ParseManage(self, args : list) -> dict:
         """Parses the manage command.  Oauth has 4 required arguments: 1 for
            the event ID, 1 for the command type (add/remove), 1 for the event
            group, and 1 for the user ID.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
+        return self.Match('manage', args)
 
-        return ret
-
-    def ParseOauth(self, args : list) -> list:
+    def ParseOauth(self, args : list) -> dict:
         """Parses the oauth command.  Oauth has 1 required argument, the oauth
            token necessary to access the schedule's associated Google Calendar.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('oauth', args)
 
-    def ParsePurge(self, args : list) -> list:
+    def ParsePurge(self, args : list) -> dict:
         """Parses the purge command.  Purge requries one argument, the channel
            from which to delete (up to 100) bot messages from per invocation.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('purge', args)
 
-    def ParseSchedules(self, args : list) -> list:
+    def ParseSchedules(self, args : list) -> dict:
         """Parses the schedules command.  This is a argument-less command that
            simply lists all schedules assigned to the guild.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('schedules', args)
 
-    def ParseSkip(self, args : list) -> list:
+    def ParseSkip(self, args : list) -> dict:
         """Parses the skip command.  Skip has 1 required argument; which event
            ID to skip (and schedule to the next entry).
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('skip', args)
 
-    def ParseSort(self, args : list) -> list:
+    def ParseSort(self, args : list) -> dict:
         """Parses the sort command.  Sort has 1 required argument and 1
            optional; 1 for which  channel to sorte events in (up to 15), and 
            1 for the order (descending by date is otherwise assumed).
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
+        return self.Match('sort', args)
 
-        return ret
-
-    def ParseSync(self, args : list) -> list:
-        """Parses the sync command.  Sync has 1 required argument and 2
-           optional, 1 for which channel to sync and 2 for how to sync the 
-           channel (import/export form Google, and which calendar).
+    def ParseSync(self, args : list) -> dict:
+        """Parses the sync command.  Sync has 1 required argument, the
+           channel whose schedule is synced with its Google Calendar, and a
+           'full' flag to re-import the whole window.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('sync', args)
 
-    def ParseTest(self, args : list) -> list:
+    def ParseTest(self, args : list) -> dict:
         """Parses the test command.  Test has 1 required argument and 1
            optional, 1 for the test message to send, and 1 for what type of 
            test message (such as start, remind, or end).
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
+        return self.Match('test', args)
 
-        return ret
-
-    def ParseZones(self, args : list) -> list:
+    def ParseZones(self, args : list) -> dict:
         """Parses the zones command.  Zones has 1 required argument, used to
            filter for which calendars fall in the specified zone.
 
            Input: self - Pointer to the current object instance.
-                  cmd - Pointer to the user-supplied string (sans command).
+                  args - The user-supplied tokens (sans command).
 
-           Output: list - A list of the arguments (null if invalid).
+           Output: dict - The parse result (see Result).
         """
-        ret = []
-
-        return ret
+        return self.Match('zones', args)
 
 
 if __name__ == '__main__':
@@ -467,5 +744,5 @@ if __name__ == '__main__':
 
 
 
-#Basic idea: Have a different parser for each command, return list.
-#Need the initial handler to peel off any qutoe strings and add as an argument.
+#Basic idea: Have a grammar entry for each command, return a result dict.
+#The tokenizer keeps quoted strings whole so they arrive as one argument.
@@ -0,0 +1,327 @@
+#This file implements the shared outbound HTTP client used for Google Calendar
+#sync.  One requests.Session keeps pooled keep-alive connections per
+#host, failed calls are retried with jittered exponential backoff (honoring
+#Retry-After), a per-host circuit breaker stops a dead upstream from tying up
+#every worker, and a per-host semaphore caps concurrency.  requests is
+#blocking, so async callers send each attempt through a dedicated executor
+#while waiting on the semaphore and backoff on the Discord event loop.
+
+import asyncio as asy
+import concurrent.futures as cf
+import email.utils
+import functools
+import logging as log
+import random
+import requests as req
+import requests.adapters as ra
+import threading as th
+import time
+import urllib.parse
+
+#####  Package Variables  #####
+
+#Methods that are safe to send twice if the first try may have landed.
+idempotent  = {'DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT'}
+
+#Responses worth retrying: rate limits and transient server errors.
+retry_codes = {429, 500, 502, 503, 504}
+
+#Responses that mean the server refused the request without acting on it,
+#so even non-idempotent methods can be retried.
+refused_codes = {429, 503}
+
+
+#####  Package Functions  #####
+
+def RetryAfter(value) -> float:
+    """Parses a Retry-After header, which is either seconds or an HTTP date.
+
+       Input: value - The header's value, or None.
+
+       Output: float - Seconds to wait, or None if absent or invalid.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitOpen(RuntimeError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+##### HTTP Client Class #####
+class HttpClient:
+
+    def __init__(self, opts: dict = None):
+        """Creates the pooled session.  Thread safe; one instance should be
+           shared by everything making outbound calls.
+
+           Input: self - Pointer to the current object instance.
+                  opts - An optional dictionary of configurable options.
+
+           Output: None.
+        """
+        opts              = opts or {}
+        self.backoff      = float(opts.get('backoff', 0.5))
+        self.breakers     = {}
+        self.cooldown     = float(opts.get('breaker_cooldown', 30))
+        self.host_limit   = int(opts.get('host_limit', 4))
+        self.httpLog      = log.getLogger('queue')
+        self.lock         = th.Lock()
+        self.max_backoff  = float(opts.get('max_backoff', 30))
+        self.retries      = int(opts.get('retries', 3))
+        #Blocking callers share threading semaphores; asyncio callers share
+        #their own, so waiting for a slot never holds an executor thread.
+        self.semaphores   = {}
+        self.asemaphores  = {}
+        self.threshold    = int(opts.get('breaker_threshold', 5))
+        self.timeout      = float(opts.get('timeout', 10))
+        pool              = int(opts.get('pool_size', 10))
+        #Retries are handled here (so Retry-After and the breaker apply), not
+        #by urllib3.
+        adapter           = ra.HTTPAdapter(pool_connections=pool,
+                                           pool_maxsize=pool,
+                                           max_retries=0)
+        self.session      = req.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor     = cf.ThreadPoolExecutor(max_workers=pool,
+                                                  thread_name_prefix='http')
+
+    def _Host(self, url: str) -> str:
+        return urllib.parse.urlsplit(url).netloc
+
+    def _Semaphore(self, host: str) -> th.BoundedSemaphore:
+        with self.lock:
+            return self.semaphores.setdefault(host,
+                                              th.BoundedSemaphore(self.host_limit))
+
+    def _ASemaphore(self, host: str) -> asy.Semaphore:
+        return self.asemaphores.setdefault(host, asy.Semaphore(self.host_limit))
+
+    def _Allow(self, host: str) -> bool:
+        """Checks a host's breaker.  After the cooldown an open breaker lets
+           a single trial call through (half-open); its result decides
+           whether the breaker closes or stays open.
+
+           Input: self - Pointer to the current object instance.
+                  host - The host being called.
+
+           Output: bool - True if the call may proceed.
+        """
+        with self.lock:
+            breaker = self.breakers.get(host)
+
+            if breaker is None or breaker['failures'] < self.threshold:
+                return True
+
+            if breaker['trial'] or time.monotonic() < breaker['opened'] + self.cooldown:
+                return False
+
+            breaker['trial'] = True
+            return True
+
+    def _Record(self, host: str, ok: bool):
+        """Records a call's result against its host's breaker and ends any
+           half-open trial.
+
+           Input: self - Pointer to the current object instance.
+                  host - The host that was called.
+                  ok - Whether the host answered sanely, or None if the call
+                       failed for a reason that says nothing about the host.
+
+           Output: None.
+        """
+        with self.lock:
+            breaker = self.breakers.setdefault(host, {'failures': 0,
+                                                      'opened': 0.0,
+                                                      'trial': False})
+            breaker['trial'] = False
+
+            if ok is None:
+                return
+
+            if ok:
+                breaker['failures'] = 0
+                return
+
+            breaker['failures'] += 1
+
+            if breaker['failures'] >= self.threshold:
+                breaker['opened'] = time.monotonic()
+                self.httpLog.warning(f"Circuit open for {host} after {breaker['failures']} failures.")
+
+    def _Delay(self, attempt: int, resp) -> float:
+        """Picks how long to wait before a retry: the server's Retry-After if
+           it sent one, otherwise full-jitter exponential backoff capped at
+           max_backoff.  Retry-After isn't capped; retrying sooner than the
+           server asked just earns another rejection.
+
+           Input: self - Pointer to the current object instance.
+                  attempt - Zero-based attempt number that just failed.
+                  resp - The failed response, or None on a network error.
+
+           Output: float - Seconds to sleep.
+        """
+        wait = RetryAfter(resp.headers.get('Retry-After')) if resp is not None else None
+
+        if wait is None:
+            wait = min(random.uniform(0, self.backoff * (2 ** attempt)),
+                       self.max_backoff)
+
+        return wait
+
+    def _Retry(self, method: str, url: str, host: str, attempt: int,
+               resp, err) -> bool:
+        """Records an attempt's result and decides whether to try again.
+
+           Input: self - Pointer to the current object instance.
+                  method - The HTTP method.
+                  url - The full URL.
+                  host - The host that was called.
+                  attempt - Zero-based attempt number.
+                  resp - The response, or None if the call raised.
+                  err - The exception the call raised, or None.
+
+           Output: bool - True to retry.  Throws err if it can't be retried.
+        """
+        safe = method.upper() in idempotent
+
+        if err is not None:
+
+            if not isinstance(err, req.RequestException):
+                self._Record(host, None)
+                raise err
+
+            self._Record(host, False)
+
+            #A timed out or dropped POST may still have been processed.
+            if (not isinstance(err, (req.ConnectionError, req.Timeout))
+                    or not safe or attempt >= self.retries):
+                raise err
+
+            self.httpLog.debug(f"Retrying {method} {url}: {err}")
+            return True
+
+        self._Record(host, resp.status_code < 500)
+
+        if (resp.status_code not in retry_codes or attempt >= self.retries
+                or (not safe and resp.status_code not in refused_codes)):
+            return False
+
+        self.httpLog.debug(f"Retrying {method} {url}: HTTP {resp.status_code}")
+        return True
+
+    def Request(self, method: str, url: str, **kwargs) -> req.Response:
+        """Makes a blocking request with retries.
+
+           Input: self - Pointer to the current object instance.
+                  method - The HTTP method.
+                  url - The full URL.
+                  kwargs - Passed to requests (params, headers, json, ...).
+
+           Output: Response - The final response, which may still be an
+                              error status.  Throws CircuitOpen if the host
+                              is being skipped, or the last network error
+                              once retries are exhausted.
+        """
+        host = self._Host(url)
+        resp = None
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.retries + 1):
+
+            if not self._Allow(host):
+                #The breaker opened partway through; hand back what we got.
+                if resp is not None:
+                    return resp
+
+                raise CircuitOpen(f"Circuit open for {host}")
+
+            resp = None
+            err  = None
+
+            try:
+                with self._Semaphore(host):
+                    resp = self.session.request(method, url, **kwargs)
+
+            except Exception as exc:
+                err = exc
+
+            if not self._Retry(method, url, host, attempt, resp, err):
+                return resp
+
+            time.sleep(self._Delay(attempt, resp))
+
+        return resp
+
+    async def ARequest(self, method: str, url: str, **kwargs) -> req.Response:
+        """Request for asyncio callers.  Only the HTTP call itself runs on
+           the client's executor; waiting for a host slot and backing off
+           happen on the event loop, so a slow host can't starve the
+           executor.
+
+           Input: self - Pointer to the current object instance.
+                  method - The HTTP method.
+                  url - The full URL.
+                  kwargs - Passed to requests.
+
+           Output: Response - See Request.
+        """
+        host = self._Host(url)
+        loop = asy.get_running_loop()
+        resp = None
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.retries + 1):
+
+            if not self._Allow(host):
+                if resp is not None:
+                    return resp
+
+                raise CircuitOpen(f"Circuit open for {host}")
+
+            resp = None
+            err  = None
+
+            try:
+                async with self._ASemaphore(host):
+                    resp = await loop.run_in_executor(self.executor,
+                                                      functools.partial(self.session.request,
+                                                                        method, url,
+                                                                        **kwargs))
+
+            except asy.CancelledError:
+                self._Record(host, None)
+                raise
+
+            except Exception as exc:
+                err = exc
+
+            if not self._Retry(method, url, host, attempt, resp, err):
+                return resp
+
+            await asy.sleep(self._Delay(attempt, resp))
+
+        return resp
+
+    def Close(self):
+        """Closes pooled connections and stops the executor.
+
+           Input: self - Pointer to the current object instance.
+
+           Output: None.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
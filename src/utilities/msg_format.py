@@ -0,0 +1,233 @@
+#This file compiles the Saber-style announcement and reminder formats (%t, %a,
+#%n, %{mention Role}, ...) into a flat list of operations once, so rendering a
+#reminder is just a walk over the list instead of re-parsing the format.  It
+#also splits rendered messages to fit Discord's per-message character limit.
+
+import collections as co
+import datetime as dt
+import hashlib
+
+#####  Package Variables  #####
+
+#Discord rejects messages longer than this.
+msg_limit  = 2000
+#How many compiled templates to keep.  Every schedule has a handful at most.
+cache_size = 4096
+templates  = co.OrderedDict()
+#Single letter tokens and the event field (or computed value) they produce.
+fields     = {'a': 'relative',
+              'c': 'cmnts',
+              'd': 'descrption',
+              'e': 'end',
+              'g': 'url',
+              'l': 'location',
+              's': 'start',
+              't': 'title',
+              'u': 'url'}
+
+
+#####  Package Functions  #####
+
+def Compile(fmt: str) -> tuple:
+    """Parses a format string into operations.  Literal runs are merged and
+       unknown tokens are kept as literal text, matching Saber's behavior.
+
+       Input: fmt - The user's format string.
+
+       Output: tuple - ('lit', text), ('field', letter), ('mention', role)
+                       and ('count', role) operations, in order.
+    """
+    ops  = []
+    lit  = []
+    pos  = 0
+    size = len(fmt)
+
+    while pos < size:
+        mark = fmt.find('%', pos)
+
+        if mark < 0 or mark + 1 >= size:
+            lit.append(fmt[pos:])
+            break
+
+        lit.append(fmt[pos:mark])
+        token = fmt[mark + 1]
+
+        if token == '%':
+            lit.append('%')
+            pos = mark + 2
+
+        elif token == 'n':
+            lit.append('\n')
+            pos = mark + 2
+
+        elif token in fields:
+            ops.append(('lit', ''.join(lit)))
+            ops.append(('field', token))
+            lit = []
+            pos = mark + 2
+
+        elif token == '{':
+            close = fmt.find('}', mark)
+            parts = fmt[mark + 2:close].split(maxsplit=1) if close > 0 else []
+
+            if len(parts) == 2 and parts[0] in ('mention', 'count'):
+                ops.append(('lit', ''.join(lit)))
+                ops.append((parts[0], parts[1].strip()))
+                lit = []
+                pos = close + 1
+            else:
+                lit.append('%{')
+                pos = mark + 2
+
+        else:
+            lit.append('%')
+            pos = mark + 1
+
+    ops.append(('lit', ''.join(lit)))
+
+    return tuple(x for x in ops if x != ('lit', ''))
+
+def GetTemplate(sched_id, fmt: str) -> tuple:
+    """Returns the compiled form of a schedule's format, compiling it only the
+       first time it's seen.  Keying on the format's hash means an edited
+       format is recompiled without any explicit invalidation.
+
+       Input: sched_id - The schedule the format belongs to.
+              fmt - The format string.
+
+       Output: tuple - The compiled operations.
+    """
+    key = (str(sched_id), hashlib.sha1(fmt.encode('utf-8')).hexdigest())
+    ops = templates.get(key)
+
+    if ops is not None:
+        templates.move_to_end(key)
+        return ops
+
+    ops = Compile(fmt)
+    templates[key] = ops
+
+    if len(templates) > cache_size:
+        templates.popitem(last=False)
+
+    return ops
+
+def _Relative(start, now: dt.datetime) -> str:
+    """Describes how far away an event's start is, e.g. 'in 10 minutes'."""
+    if not isinstance(start, dt.datetime):
+        return ''
+
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=dt.timezone.utc)
+
+    minutes = round((start - now).total_seconds() / 60)
+
+    if minutes <= 0:
+        return 'is starting now'
+
+    if minutes < 60:
+        return f"begins in {minutes} minute{'s' if minutes != 1 else ''}"
+
+    hours = round(minutes / 60)
+
+    return f"begins in {hours} hour{'s' if hours != 1 else ''}"
+
+def _Stamp(value) -> str:
+    """Formats a datetime as a Discord timestamp so every reader sees it in
+       their own timezone."""
+    if not isinstance(value, dt.datetime):
+        return str(value or '')
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone.utc)
+
+    return f"<t:{int(value.timestamp())}:f>"
+
+def Render(ops: tuple, event: dict, rsvp: dict = None,
+           now: dt.datetime = None) -> str:
+    """Renders compiled operations against an event.
+
+       Input: ops - Operations from GetTemplate or Compile.
+              event - The event document.
+              rsvp - Role name to a list of member IDs; defaults to the
+                     event's 'rsvp_mbrs'.
+              now - The time to compute relative starts from.
+
+       Output: str - The rendered message, possibly longer than msg_limit.
+    """
+    rsvp = event.get('rsvp_mbrs') if rsvp is None else rsvp
+    rsvp = rsvp if isinstance(rsvp, dict) else {}
+    now  = dt.datetime.now(dt.timezone.utc) if now is None else now
+    out  = []
+
+    for kind, arg in ops:
+
+        if kind == 'lit':
+            out.append(arg)
+
+        elif kind == 'field':
+            name = fields[arg]
+
+            if name == 'relative':
+                out.append(_Relative(event.get('start'), now))
+            elif name in ('start', 'end'):
+                out.append(_Stamp(event.get(name)))
+            elif name == 'cmnts' and isinstance(event.get(name), list):
+                out.append('\n'.join(event[name]))
+            else:
+                out.append(str(event.get(name) or ''))
+
+        elif kind == 'mention':
+            out.append(' '.join(f"<@{x}>" for x in rsvp.get(arg, ())))
+
+        elif kind == 'count':
+            out.append(str(len(rsvp.get(arg, ()))))
+
+    return ''.join(out)
+
+def Split(text: str, limit: int = msg_limit) -> list:
+    """Splits a message into chunks Discord will accept.  Prefers to break on
+       newlines, then spaces, and never cuts a mention in half.
+
+       Input: text - The rendered message.
+              limit - The maximum chunk length.
+
+       Output: list - The chunks, in order.
+    """
+    chunks = []
+
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit + 1)
+
+        if cut <= 0:
+            cut = limit
+            #Back up to before a mention that straddles the limit.
+            start = text.rfind('<', 0, cut)
+
+            if start > 0 and text.find('>', start) >= cut:
+                cut = start
+
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip('\n ')
+
+    if text:
+        chunks.append(text)
+
+    return chunks
+
+def Format(sched_id, fmt: str, event: dict, rsvp: dict = None,
+           now: dt.datetime = None) -> list:
+    """Compiles (if needed), renders, and splits a format in one call.
+
+       Input: sched_id - The schedule the format belongs to.
+              fmt - The format string.
+              event - The event document.
+              rsvp - Optional role name to member ID list override.
+              now - The time to compute relative starts from.
+
+       Output: list - Message chunks ready to post.
+    """
+    return Split(Render(GetTemplate(sched_id, fmt), event, rsvp, now))
@@ -0,0 +1,154 @@
+#This file implements the token-bucket rate limiter used by the queue managers
+#to shape load per guild, per user, and per command type.  Each check is O(1)
+#and buckets that sit idle are evicted so memory tracks active users only.
+
+import collections as co
+import logging as log
+import time
+
+##### Token Bucket Limiter Class #####
+class TokenBucketLimiter:
+
+    def __init__(self, opts: dict):
+        """Creates an empty set of buckets.  Rates are tokens per second and
+           bursts are the bucket sizes; both may come straight from
+           config.json as strings.
+
+           Input: self - Pointer to the current object instance.
+                  opts - A dictionary of configurable options.
+
+           Output: None - Throws exceptions on error.
+        """
+        #Each bucket class is (refill rate, capacity).
+        self.classes = {'guild': (float(opts.get('rate_guild', 1.0)),
+                                  float(opts.get('burst_guild', 10))),
+                        'user' : (float(opts.get('rate_user', 0.2)),
+                                  float(opts.get('burst_user', 3))),
+                        'cmd'  : (float(opts.get('rate_cmd', 0.5)),
+                                  float(opts.get('burst_cmd', 5)))}
+
+        #A zero rate would never refill, locking callers out for good.
+        for name, (rate, burst) in self.classes.items():
+            if rate <= 0 or burst <= 0:
+                raise ValueError(f"rate_{name} and burst_{name} must be positive")
+
+        self.idle        = float(opts.get('bucket_idle', 600))
+        self.max_buckets = int(opts.get('max_buckets', 100000))
+        self.rlLog       = log.getLogger('queue')
+        #Buckets are [tokens, last refill]; ordering by last use lets eviction
+        #just pop from the front.
+        self.buckets     = co.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    def _Refill(self, key: tuple, now: float) -> list:
+        """Returns a key's bucket topped up to 'now', creating it full if it
+           doesn't exist yet.
+
+           Input: self - Pointer to the current object instance.
+                  key - The (class, ...) tuple identifying the bucket.
+                  now - The current monotonic time.
+
+           Output: list - The bucket's [tokens, last refill] pair.
+        """
+        rate, burst = self.classes[key[0]]
+        bucket      = self.buckets.get(key)
+
+        if bucket is None:
+            bucket = [burst, now]
+            self.buckets[key] = bucket
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+
+        return bucket
+
+    def Evict(self, now: float = None) -> int:
+        """Drops buckets that haven't been used within the idle window.  An
+           idle bucket has refilled completely, so dropping it loses nothing.
+
+           Input: self - Pointer to the current object instance.
+                  now - The current monotonic time; defaults to now.
+
+           Output: int - The number of buckets evicted.
+        """
+        now     = time.monotonic() if now is None else now
+        evicted = 0
+
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+
+            if now - bucket[1] < self.idle and \
+               len(self.buckets) <= self.max_buckets:
+                break
+
+            del self.buckets[key]
+            evicted += 1
+
+        return evicted
+
+    def Check(self, guild, user, cmd: str = '', cost: float = 1.0) -> float:
+        """Reports whether a request could take its tokens now, without
+           taking them.
+
+           Input: self - Pointer to the current object instance.
+                  guild - The requesting guild's ID.
+                  user - The requesting user's ID.
+                  cmd - The command type being requested.
+                  cost - How many tokens the request costs.
+
+           Output: float - 0 if allowed, otherwise seconds until it would be.
+        """
+        return self._Buckets(guild, user, cmd, cost)[1]
+
+    def _Buckets(self, guild, user, cmd: str, cost: float) -> tuple:
+        """Refills a request's guild, user, and guild command buckets and
+           works out how long it would have to wait for them.
+
+           Input: self - Pointer to the current object instance.
+                  guild - The requesting guild's ID.
+                  user - The requesting user's ID.
+                  cmd - The command type being requested.
+                  cost - How many tokens the request costs.
+
+           Output: tuple - The buckets, and the wait in seconds (0 if every
+                           bucket can afford the cost).
+        """
+        now     = time.monotonic()
+        keys    = (('guild', guild), ('user', user), ('cmd', guild, cmd))
+        buckets = [self._Refill(key, now) for key in keys]
+        wait    = 0.0
+
+        for key, bucket in zip(keys, buckets):
+
+            if bucket[0] < cost:
+                wait = max(wait, (cost - bucket[0]) / self.classes[key[0]][0])
+
+        self.Evict(now)
+
+        return buckets, wait
+
+    def Take(self, guild, user, cmd: str = '', cost: float = 1.0) -> float:
+        """Consumes tokens from the guild, user, and guild command buckets.
+           Tokens are only taken if every bucket can afford the cost, so a
+           rejected request doesn't drain the others.
+
+           Input: self - Pointer to the current object instance.
+                  guild - The requesting guild's ID.
+                  user - The requesting user's ID.
+                  cmd - The command type being requested.
+                  cost - How many tokens the request costs.
+
+           Output: float - 0 if allowed, otherwise seconds until it would be.
+        """
+        buckets, wait = self._Buckets(guild, user, cmd, cost)
+
+        if wait == 0.0:
+            for bucket in buckets:
+                bucket[0] -= cost
+        else:
+            self.rlLog.debug(f"Rate limited guild {guild} user {user} cmd {cmd} for {wait:.2f}s.")
+
+        return wait
@@ -0,0 +1,304 @@
+#This file expands repeating events into concrete occurrences.  Rules use the
+#RRULE subset PSB needs (FREQ, INTERVAL, COUNT, UNTIL, BYDAY, BYMONTHDAY) and
+#are evaluated in the schedule's timezone, so a 19:00 raid stays at 19:00
+#local time across DST changes.  Expansions are bounded to a window and
+#memoized, since 'skip' and the hourly countdowns ask for the next occurrence
+#of the same events over and over.
+
+import bisect
+import collections as co
+import datetime as dt
+import functools
+import zoneinfo
+
+#####  Package Variables  #####
+
+#How many expansions to keep.  Each is a short tuple of datetimes.
+cache_size = 8192
+expansions = co.OrderedDict()
+#Event ID to the cache keys expanded for it, so an edit can drop them, and
+#each key back to its event IDs, so an eviction only touches its own events.
+by_event   = {}
+by_key     = {}
+freqs      = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+weekdays   = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+#Guards against rules (e.g. BYMONTHDAY=31 monthly) that can't terminate.
+max_steps  = 100000
+
+
+#####  Package Functions  #####
+
+@functools.lru_cache(maxsize=1024)
+def ParseRule(text: str) -> dict:
+    """Parses an RRULE string like 'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE'.
+       An optional leading 'RRULE:' is ignored.
+
+       Input: text - The rule.
+
+       Output: dict - freq, interval, count, until (aware UTC datetime or
+                      None), byday (sorted weekday numbers) and bymonthday.
+                      Throws ValueError on unsupported or malformed rules.
+    """
+    parts = {}
+
+    for part in text.strip().removeprefix('RRULE:').split(';'):
+        if part:
+            name, _, value = part.partition('=')
+            parts[name.strip().upper()] = value.strip()
+
+    rule = {'freq'      : parts.get('FREQ', '').upper(),
+            'interval'  : int(parts.get('INTERVAL', 1)),
+            'count'     : int(parts['COUNT']) if 'COUNT' in parts else None,
+            'until'     : None,
+            'byday'     : (),
+            'bymonthday': ()}
+
+    if rule['freq'] not in freqs:
+        raise ValueError(f"Unsupported FREQ '{rule['freq']}'")
+
+    if rule['interval'] < 1 or (rule['count'] is not None and rule['count'] < 1):
+        raise ValueError(f"INTERVAL and COUNT must be positive")
+
+    if 'UNTIL' in parts:
+        until = parts['UNTIL'].rstrip('Z')
+        fmt   = '%Y%m%dT%H%M%S' if 'T' in until else '%Y%m%d'
+        rule['until'] = dt.datetime.strptime(until, fmt).replace(tzinfo=dt.timezone.utc)
+
+    if 'BYDAY' in parts:
+        days = [x.strip().upper() for x in parts['BYDAY'].split(',')]
+
+        if any(x not in weekdays for x in days):
+            raise ValueError(f"Unsupported BYDAY '{parts['BYDAY']}'")
+
+        rule['byday'] = tuple(sorted(weekdays[x] for x in days))
+
+    if 'BYMONTHDAY' in parts:
+        rule['bymonthday'] = tuple(sorted(int(x) for x in parts['BYMONTHDAY'].split(',')))
+
+        if any(x < 1 or x > 31 for x in rule['bymonthday']):
+            raise ValueError(f"BYMONTHDAY must be between 1 and 31")
+
+    return rule
+
+def _AddMonths(day: dt.date, months: int) -> tuple:
+    total = day.year * 12 + day.month - 1 + months
+    return total // 12, total % 12 + 1
+
+def _Period(rule: dict, first: dt.datetime, step: int) -> list:
+    """Returns the local wall times in the 'step'th period of a rule, in
+       order.  Days that don't exist (e.g. the 31st of April) are skipped.
+
+       Input: rule - A parsed rule.
+              first - The first occurrence, as a naive local datetime.
+              step - Which period (0 is the one containing 'first').
+
+       Output: list - Naive local datetimes.
+    """
+    freq  = rule['freq']
+    clock = first.time()
+
+    if freq == 'DAILY':
+        return [first + dt.timedelta(days=step * rule['interval'])]
+
+    if freq == 'WEEKLY':
+        monday = first.date() - dt.timedelta(days=first.weekday()) + \
+                 dt.timedelta(weeks=step * rule['interval'])
+        days   = rule['byday'] or (first.weekday(),)
+
+        return [dt.datetime.combine(monday + dt.timedelta(days=x), clock) for x in days]
+
+    if freq == 'MONTHLY':
+        year, month = _AddMonths(first.date(), step * rule['interval'])
+        days        = rule['bymonthday'] or (first.day,)
+    else:
+        year, month = first.year + step * rule['interval'], first.month
+        days        = (first.day,)
+
+    out = []
+
+    for day in days:
+        try:
+            out.append(dt.datetime.combine(dt.date(year, month, day), clock))
+
+        except ValueError:
+            continue
+
+    return out
+
+def _Skip(rule: dict, first: dt.datetime, start: dt.datetime) -> tuple:
+    """Works out how many whole periods can be skipped before 'start'
+       without walking them, for rules whose periods are all the same size.
+
+       Input: rule - A parsed rule.
+              first - The first occurrence, as a naive local datetime.
+              start - The window start, as a naive local datetime.
+
+       Output: tuple - (periods skipped, occurrences skipped).
+    """
+    if rule['freq'] == 'DAILY':
+        length, per = rule['interval'], 1
+    elif rule['freq'] == 'WEEKLY':
+        length, per = 7 * rule['interval'], len(rule['byday'] or (0,))
+    else:
+        return 0, 0
+
+    #Stop a period short so DST shifts can't skip a real occurrence.
+    steps = max(0, (start - first).days // length - 1)
+
+    if not steps:
+        return 0, 0
+
+    #The first period may start partway through (e.g. DTSTART on a Wednesday
+    #of a Monday/Wednesday/Friday rule).
+    partial = len([x for x in _Period(rule, first, 0) if x >= first])
+
+    return steps, partial + (steps - 1) * per
+
+def Expand(rule: str, first: dt.datetime, zone: str, start: dt.datetime,
+           end: dt.datetime) -> tuple:
+    """Lists a rule's occurrences that fall in [start, end).
+
+       Input: rule - The RRULE string.
+              first - The first occurrence (DTSTART), any aware datetime.
+              zone - The IANA zone the rule repeats in.
+              start - Window start, aware.
+              end - Window end, aware.
+
+       Output: tuple - Aware UTC datetimes, in order.
+    """
+    parsed = ParseRule(rule)
+    tz     = zoneinfo.ZoneInfo(zone)
+    local  = first.astimezone(tz).replace(tzinfo=None)
+    until  = parsed['until']
+    count  = parsed['count']
+    step, seen = _Skip(parsed, local, start.astimezone(tz).replace(tzinfo=None))
+    out    = []
+
+    for _ in range(max_steps):
+        period = _Period(parsed, local, step)
+        step  += 1
+
+        for wall in period:
+            #Occurrences before DTSTART in the first period don't count.
+            if wall < local:
+                continue
+
+            #Wall times in a DST gap come out shifted forward, as RFC 5545
+            #asks.
+            when  = wall.replace(tzinfo=tz).astimezone(dt.timezone.utc)
+            seen += 1
+
+            if (count is not None and seen > count) or \
+               (until is not None and when > until) or when >= end:
+                return tuple(out)
+
+            if when >= start:
+                out.append(when)
+
+    return tuple(out)
+
+def _Window(now: dt.datetime, days: float) -> tuple:
+    #Windows are snapped to UTC midnight so a whole day's worth of lookups
+    #share one expansion.
+    day = now.astimezone(dt.timezone.utc).replace(hour=0, minute=0, second=0,
+                                                  microsecond=0)
+
+    return day, day + dt.timedelta(days=days + 1)
+
+def Occurrences(event, zone: str, now: dt.datetime = None,
+                days: float = 7) -> tuple:
+    """Returns an event's occurrences from today through 'days' ahead,
+       expanding (and caching) its rule only on the first call.
+
+       Input: event - An event model or document with 'recur' and
+                      'orig_st' (or 'start').
+              zone - The schedule's timezone.
+              now - The reference time; defaults to now.
+              days - How far ahead to expand, e.g. the schedule's sync_len.
+
+       Output: tuple - Aware UTC start times, in order.
+    """
+    now   = dt.datetime.now(dt.timezone.utc) if now is None else now
+    first = event.get('orig_st') or event.get('start')
+    rule  = event.get('recur') or ''
+
+    if not isinstance(first, dt.datetime):
+        return ()
+
+    if first.tzinfo is None:
+        first = first.replace(tzinfo=dt.timezone.utc)
+
+    start, end = _Window(now, days)
+
+    if not rule:
+        return (first,) if start <= first < end else ()
+
+    key    = (rule, zone, first, start, end)
+    result = expansions.get(key)
+
+    if result is not None:
+        expansions.move_to_end(key)
+    else:
+        result          = Expand(rule, first, zone, start, end)
+        expansions[key] = result
+
+    #Events sharing an expansion are all recorded, so any of them can drop it.
+    by_event.setdefault(event.get('_id'), set()).add(key)
+    by_key.setdefault(key, set()).add(event.get('_id'))
+
+    while len(expansions) > cache_size:
+        _Drop(next(iter(expansions)))
+
+    return result
+
+def _Drop(key) -> bool:
+    """Removes one expansion and its entries in both event maps.
+
+       Input: key - The expansion's cache key.
+
+       Output: bool - True if the expansion was cached.
+    """
+    for event_id in by_key.pop(key, ()):
+        keys = by_event.get(event_id)
+
+        if keys is not None:
+            keys.discard(key)
+
+            if not keys:
+                del by_event[event_id]
+
+    return expansions.pop(key, None) is not None
+
+def Next(event, zone: str, now: dt.datetime = None, days: float = 7):
+    """Finds an event's next occurrence at or after 'now'.
+
+       Input: event - An event model or document.
+              zone - The schedule's timezone.
+              now - The reference time; defaults to now.
+              days - How far ahead to look.
+
+       Output: datetime - The next start in UTC, or None if there isn't one
+                          within the window.
+    """
+    now   = dt.datetime.now(dt.timezone.utc) if now is None else now
+    found = Occurrences(event, zone, now, days)
+    pos   = bisect.bisect_left(found, now)
+
+    return found[pos] if pos < len(found) else None
+
+def Invalidate(event_id=None) -> int:
+    """Drops cached expansions for an edited or deleted event, or all of
+       them.
+
+       Input: event_id - The event's ID, or None for every event.
+
+       Output: int - The number of expansions dropped.
+    """
+    if event_id is None:
+        dropped = len(expansions)
+        expansions.clear()
+        by_event.clear()
+        by_key.clear()
+        return dropped
+
+    return sum(_Drop(x) for x in list(by_event.get(event_id, ())))
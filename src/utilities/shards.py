@@ -0,0 +1,77 @@
+#This file works out which guilds belong to this process when the bot is
+#sharded.  Discord assigns a guild to shard (guild_id >> 22) % shard_count, so
+#ownership can be checked from the ID alone without asking Discord.
+
+#####  Package Functions  #####
+
+def ShardOf(guild_id, shard_count: int) -> int:
+    """Returns the shard Discord routes a guild to.
+
+       Input: guild_id - The guild's Discord ID (int or str).
+              shard_count - The total number of shards.
+
+       Output: int - The guild's shard ID.
+    """
+    return (int(guild_id) >> 22) % max(1, int(shard_count))
+
+def ParseIds(text: str) -> list:
+    """Parses a shard ID list like '0-3,7' from the config or command line.
+
+       Input: text - Comma separated IDs and inclusive ranges.  Empty means
+                     every shard.
+
+       Output: list - The sorted shard IDs, or None for every shard.  Throws
+                      ValueError on malformed input.
+    """
+    if not text or not str(text).strip():
+        return None
+
+    ids = set()
+
+    for part in str(text).split(','):
+        low, _, high = part.strip().partition('-')
+        ids.update(range(int(low), int(high or low) + 1))
+
+    return sorted(ids)
+
+
+##### Shard Set Class #####
+class ShardSet:
+
+    def __init__(self, shard_ids=None, shard_count: int = 1):
+        """Describes the shards this process runs.
+
+           Input: self - Pointer to the current object instance.
+                  shard_ids - The shard IDs owned, or None for all of them.
+                  shard_count - The total number of shards across every
+                                process.
+
+           Output: None - Throws ValueError if an ID is out of range.
+        """
+        self.count = max(1, int(shard_count or 1))
+        self.ids   = frozenset(range(self.count) if shard_ids is None else shard_ids)
+
+        if any(x < 0 or x >= self.count for x in self.ids):
+            raise ValueError(f"Shard IDs {sorted(self.ids)} don't fit in {self.count} shards")
+
+    def __repr__(self) -> str:
+        return f"ShardSet({sorted(self.ids)}, {self.count})"
+
+    def Owns(self, guild_id) -> bool:
+        """Checks whether a guild belongs to one of this process's shards.
+           Guilds without a usable ID are treated as owned so nothing is
+           silently dropped.
+
+           Input: self - Pointer to the current object instance.
+                  guild_id - The guild's Discord ID.
+
+           Output: bool - True if this process should handle the guild.
+        """
+        if self.count == 1:
+            return True
+
+        try:
+            return ShardOf(guild_id, self.count) in self.ids
+
+        except (TypeError, ValueError):
+            return True
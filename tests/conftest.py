@@ -0,0 +1,8 @@
+#Shared pytest setup.  The bot imports its own modules as 'src.', so the
+#repository root has to be importable no matter where pytest is run from.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
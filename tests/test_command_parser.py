@@ -0,0 +1,91 @@
+#Tests for the command tokenizer and grammar parser.
+
+import logging as log
+import pytest
+import src.utilities.command_parser as cp
+
+
+@pytest.fixture(scope='module')
+def parser():
+    #A handler already on the shared logger stops the parser from opening
+    #logs/command.log.
+    log.getLogger('command_log').addHandler(log.NullHandler())
+
+    return cp.CommandParser()
+
+@pytest.mark.parametrize('cmd, tokens', [
+    ('/config 1 msg "hello there"', ['/config', '1', 'msg', 'hello there']),
+    ('  a   b ', ['a', 'b']),
+    ('x "say "hi" now"', ['x', 'say "hi" now']),
+    ('x "a" "b"', ['x', 'a', 'b']),
+])
+def test_tokenize(cmd, tokens):
+    assert cp.Tokenize(cmd) == (tokens, '')
+
+def test_tokenize_unbalanced():
+    tokens, error = cp.Tokenize('x "oops')
+
+    assert tokens == ['x']
+    assert 'Unbalanced' in error
+
+def test_subcommand_and_args(parser):
+    ret = parser.SortCommand('/config 474738 msg "@here The event %t"')
+
+    assert ret['ok']
+    assert ret['sub'] == 'msg'
+    assert ret['args'] == {'chan': 474738, 'msg_txt': '@here The event %t'}
+
+def test_options_flags_and_defaults(parser):
+    ret = parser.SortCommand('/config 474738 rsvp add -role DPS -id 42')
+
+    assert ret['ok']
+    assert ret['args'] == {'chan': 474738, 'action': 'add', 'role': 'DPS',
+                           'id': 42}
+
+    ret = parser.SortCommand('/config 474738 remind remove "20 min"')
+
+    assert ret['args'] == {'chan': 474738, 'remove': True, 'msg': '20 min'}
+
+def test_sync_full_flag(parser):
+    assert parser.SortCommand('/sync 42')['args'] == {'chan': 42, 'full': False}
+    assert parser.SortCommand('/sync 42 full')['args'] == {'chan': 42, 'full': True}
+
+@pytest.mark.parametrize('cmd, args', [
+    ('/init', {'chan': 0}),
+    ('/diagnose', {}),
+    ('/events', {'chan': 'all'}),
+    ('/manage e1 add Tanks 42', {'ID': 'e1', 'action': 'add', 'group': 'Tanks',
+                                 'user': 42}),
+    ('/sort 7', {'chan': 7, 'order': 'desc'}),
+    ('/test "hello there" remind', {'msg': 'hello there', 'type': 'remind'}),
+])
+def test_ported_commands(parser, cmd, args):
+    ret = parser.SortCommand(cmd)
+
+    assert ret['ok'], ret['error']
+    assert ret['args'] == args
+
+@pytest.mark.parametrize('cmd, error', [
+    ('/config abc', 'Invalid int'),
+    ('/config 1 rsvp maybe', 'Invalid'),
+    ('/config 1 rsvp on -id', 'needs a value'),
+    ('/announcements', 'Missing argument ID'),
+    ('/config 1 msg a b', 'Unexpected argument'),
+    ('/nope', 'Unknown command'),
+    ('/create 1 today Raid', "isn't supported"),
+    ('/manage e1 promote tanks 5', 'Invalid'),
+    ('/purge', 'Missing argument chan'),
+    ('', 'Empty command'),
+])
+def test_errors_are_results(parser, cmd, error):
+    ret = parser.SortCommand(cmd)
+
+    assert not ret['ok']
+    assert error in ret['error']
+
+def test_parse_many_numbers_lines(parser):
+    lines   = ['/config 1 msg hi', '', '/config x']
+    results = list(parser.ParseMany(lines))
+
+    assert [x['line'] for x in results] == [1, 3]
+    assert [x['ok'] for x in results] == [True, False]
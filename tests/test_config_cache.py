@@ -0,0 +1,96 @@
+#Tests for the guild/schedule config cache.
+
+import asyncio as asy
+import src.database.config_cache as cc
+
+
+def _Cache(store: dict, **opts):
+    loads = []
+
+    async def _Load(key):
+        loads.append(key)
+        doc = store.get(key)
+        await asy.sleep(0)
+        return doc
+
+    return cc.ConfigCache({'guild': _Load, 'schedule': _Load}, opts), loads
+
+def test_hits_return_copies():
+
+    async def _Main():
+        cache, loads = _Cache({1: {'name': 'a'}})
+        doc = await cache.Get('guild', 1)
+        doc['name'] = 'changed'
+
+        assert await cache.Get('guild', 1) == {'name': 'a'}
+        assert loads == [1]
+        assert cache.Stats()['hits'] == 1
+
+    asy.run(_Main())
+
+def test_invalidate_reloads_the_document():
+    store = {1: {'name': 'a'}, 2: {'name': 'b'}}
+
+    async def _Main():
+        cache, loads = _Cache(store)
+        await cache.Get('guild', 1)
+        await cache.Get('schedule', 2)
+        store[1] = {'name': 'new'}
+
+        assert cache.Invalidate('guild', 1) == 1
+        assert cache.Invalidate('guild', 1) == 0
+        assert await cache.Get('guild', 1) == {'name': 'new'}
+        assert await cache.Get('schedule', 2) == {'name': 'b'}
+        assert loads == [1, 2, 1]
+
+    asy.run(_Main())
+
+def test_invalidate_kind_drops_every_entry():
+
+    async def _Main():
+        cache, _ = _Cache({1: {}, 2: {}})
+        await cache.Get('schedule', 1)
+        await cache.Get('schedule', 2)
+        await cache.Get('guild', 1)
+
+        assert cache.Invalidate('schedule') == 2
+        assert len(cache) == 1
+        assert cache.Stats()['invalidations'] == 2
+
+    asy.run(_Main())
+
+def test_invalidate_during_load_skips_caching():
+    store = {1: {'name': 'old'}}
+
+    async def _Main():
+        cache, loads = _Cache(store)
+        task = asy.create_task(cache.Get('guild', 1))
+
+        while not loads:
+            await asy.sleep(0)
+
+        store[1] = {'name': 'new'}
+        cache.Invalidate('guild', 1)
+
+        #The running load still answers its caller but isn't kept.
+        assert await task == {'name': 'old'}
+        assert len(cache) == 0
+        assert await cache.Get('guild', 1) == {'name': 'new'}
+        assert loads == [1, 1]
+
+    asy.run(_Main())
+
+def test_expired_and_evicted_entries_reload():
+
+    async def _Main():
+        cache, loads = _Cache({1: {}, 2: {}}, cache_size=1, cache_ttl=0)
+        await cache.Get('guild', 1)
+        await cache.Get('guild', 1)
+        await cache.Get('guild', 2)
+        stats = cache.Stats()
+
+        assert loads == [1, 1, 2]
+        assert stats['expirations'] == 1
+        assert stats['evictions'] == 1
+
+    asy.run(_Main())
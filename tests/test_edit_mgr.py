@@ -0,0 +1,122 @@
+#Tests for the message edit coalescer.
+
+import asyncio as asy
+import src.managers.EditMgr as em
+
+
+class HttpError(Exception):
+
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def _Editor(sent: list, fail: dict = None, **opts):
+    fail = fail if fail is not None else {}
+
+    async def _Send(ch_id, msg_id, content):
+        if fail.get(msg_id):
+            raise fail[msg_id].pop(0)
+
+        sent.append((ch_id, msg_id, content))
+
+    return em.EditCoalescer(None, _Send, opts)
+
+def test_queue_merges_and_skips():
+    sent   = []
+    editor = _Editor(sent)
+
+    async def _Main():
+        assert editor.Queue(1, 10, 'a')
+        assert editor.Queue(1, 10, 'b')
+        assert len(editor) == 1
+        assert await editor.Drain(0) == 1
+
+        #Matching what was last sent drops the edit, and any pending one.
+        assert not editor.Queue(1, 10, 'b')
+        editor.Queue(1, 10, 'c')
+        assert not editor.Queue(1, 10, 'b')
+        assert len(editor) == 0
+
+    asy.run(_Main())
+
+    assert sent == [(10, 1, 'b')]
+    assert editor.stats == {'queued': 2, 'merged': 1, 'skipped': 2,
+                            'sent': 1, 'errors': 0}
+
+def test_drain_paces_each_channel():
+    sent   = []
+    editor = _Editor(sent, channel_gap=5)
+
+    async def _Main():
+        editor.Queue(1, 10, 'a')
+        editor.Queue(2, 10, 'b')
+        editor.Queue(3, 20, 'c')
+
+        assert await editor.Drain(100) == 2
+        assert await editor.Drain(104) == 0
+        assert await editor.Drain(105) == 1
+
+    asy.run(_Main())
+
+    assert sent == [(10, 1, 'a'), (20, 3, 'c'), (10, 2, 'b')]
+
+def test_failed_edits_retry_unless_fatal():
+    sent   = []
+    fail   = {1: [RuntimeError('timeout')], 2: [HttpError(404)],
+              3: [HttpError(403)]}
+    editor = _Editor(sent, fail, channel_gap=1)
+
+    async def _Main():
+        for msg_id in (1, 2, 3):
+            editor.Queue(msg_id, msg_id, 'x')
+
+        assert await editor.Drain(0) == 0
+        #Only the transient failure is still pending, behind its channel gap.
+        assert list(editor.pending) == [1]
+        assert await editor.Drain(0.5) == 0
+        assert await editor.Drain(1) == 1
+
+    asy.run(_Main())
+
+    assert sent == [(1, 1, 'x')]
+    assert editor.stats['errors'] == 3
+
+def test_retry_keeps_newer_edit():
+    sent   = []
+    editor = _Editor(sent)
+
+    async def _Send(ch_id, msg_id, content):
+        editor.Queue(msg_id, ch_id, 'newer')
+        raise RuntimeError('timeout')
+
+    async def _Main():
+        editor.send = _Send
+        editor.Queue(1, 10, 'older')
+        await editor.Drain(0)
+
+    asy.run(_Main())
+
+    assert editor.pending[1] == (10, 'newer')
+
+def test_refresh_queues_changed_buckets():
+    sent   = []
+    editor = _Editor(sent, buckets=1)
+    text   = {'value': 'a'}
+
+    async def _Render():
+        return text['value']
+
+    async def _Main():
+        editor.Track(1, 10, _Render)
+        assert await editor.Refresh(0) == 1
+        await editor.Drain(0)
+        assert await editor.Refresh(0) == 0
+        text['value'] = 'b'
+        assert await editor.Refresh(0) == 1
+        editor.Untrack(1)
+        assert len(editor) == 0
+
+    asy.run(_Main())
+
+    assert sent == [(10, 1, 'a')]
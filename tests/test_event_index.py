@@ -0,0 +1,92 @@
+#Tests for the per-channel event interval index.
+
+import datetime as dt
+import src.database.event_index as ei
+
+utc  = dt.timezone.utc
+base = dt.datetime(2024, 1, 1, tzinfo=utc)
+
+
+def _Event(event_id, start_h: float, end_h: float = None, ch_id: int = 5,
+           **fields) -> dict:
+    return {'_id'      : event_id,
+            'ch_id'    : ch_id,
+            'guild_id' : 1,
+            'title'    : f"Event {event_id}",
+            'start'    : base + dt.timedelta(hours=start_h),
+            'end'      : base + dt.timedelta(hours=end_h) if end_h is not None else None} | fields
+
+def _Index(*events) -> ei.EventIndex:
+    index = ei.EventIndex()
+    index.Load(1, 5, list(events))
+
+    return index
+
+def _Ids(events) -> list:
+    return [x._id for x in events]
+
+def test_window_includes_spanning_events():
+    index = _Index(_Event(1, 0, 10), _Event(2, 5, 6), _Event(3, 12, 13))
+
+    assert _Ids(index.Window(5, base + dt.timedelta(hours=4),
+                             base + dt.timedelta(hours=7))) == [1, 2]
+    assert _Ids(index.Window(5, base + dt.timedelta(hours=11),
+                             base + dt.timedelta(hours=20))) == [3]
+
+def test_next_and_overlapping():
+    index = _Index(_Event(1, 0, 10), _Event(2, 5, 6), _Event(3, 12, 13))
+
+    assert _Ids(index.Next(5, base + dt.timedelta(hours=1), 2)) == [2, 3]
+    assert _Ids(index.Overlapping(2)) == [1]
+    assert index.Overlapping(3) == []
+
+def test_put_update_and_remove():
+    index = _Index(_Event(1, 0, 1))
+    index.Put(_Event(2, 2, 3))
+    index.Update(1, {'start': base + dt.timedelta(hours=4),
+                     'end': base + dt.timedelta(hours=5)})
+
+    assert _Ids(index.Next(5, base, 5)) == [2, 1]
+    assert index.Remove(2)
+    assert _Ids(index.Next(5, base, 5)) == [1]
+
+def test_unloaded_channels_ignored():
+    index = _Index()
+    index.Put(_Event(1, 0, 1, ch_id=6))
+
+    assert not index.Loaded(6)
+    assert index.Window(6, base, base + dt.timedelta(days=1)) == []
+
+def test_writes_during_load_win():
+    index = ei.EventIndex()
+    state = index.Begin(1, 5)
+    index.Remove(1)
+    index.Update(2, {'title': 'Renamed'})
+
+    assert not index.Loaded(5)
+    assert index.Load(1, 5, [_Event(1, 0, 1), _Event(2, 2, 3)], state)
+    assert _Ids(index.Next(5, base, 5)) == [2]
+    assert index.Next(5, base)[0].title == 'Renamed'
+
+def test_dropped_channel_load_ignored():
+    index = ei.EventIndex()
+    state = index.Begin(1, 5)
+    index.DropChannel(5)
+
+    assert not index.Load(1, 5, [_Event(1, 0, 1)], state)
+    assert not index.Loaded(5)
+
+def test_repeating_events_expand():
+    index = _Index(_Event(1, 18, 19, recur='FREQ=DAILY'), _Event(2, 30, 31))
+    found = index.Window(5, base, base + dt.timedelta(days=3))
+
+    assert _Ids(found) == [1, 2, 1, 1]
+    assert found[2].start == base + dt.timedelta(hours=42)
+    assert found[2].end == base + dt.timedelta(hours=43)
+    assert _Ids(index.Next(5, base + dt.timedelta(hours=20), 2)) == [2, 1]
+
+def test_drop_guild():
+    index = _Index(_Event(1, 0, 1))
+
+    assert index.DropGuild(1) == 1
+    assert len(index) == 0
@@ -0,0 +1,29 @@
+#Tests for the guild/schedule/event models and their BSON codecs.
+
+import datetime as dt
+import src.database.models as md
+
+
+def test_event_round_trip():
+    start = dt.datetime(2024, 5, 1, 18, tzinfo=dt.timezone.utc)
+    doc   = {'_id'      : 'abc',
+             'annc_msg' : {'0': '1234', '1': '5678'},
+             'annc_tim' : {'0': 60},
+             'ch_id'    : '42',
+             'guild_id' : '7',
+             'rsvp_mbrs': {'yes': ['1']},
+             'start'    : start,
+             'title'    : 'Raid'}
+    event = md.Event.FromBson(doc)
+    bson  = event.ToBson()
+
+    assert event.annc_msg == {'0': '1234', '1': '5678'}
+    assert event.ch_id == 42
+    assert bson['ch_id'] == '42'
+    assert md.Event.FromBson(bson) == event
+    assert {x: bson[x] for x in doc} == doc
+
+def test_announcement_messages_stay_maps():
+    assert md.Event.FromBson({'annc_msg': {}}).annc_msg == {}
+    assert md.Event.FromBson({'annc_msg': '{}'}).annc_msg == {}
+    assert md.Event().annc_msg == {}
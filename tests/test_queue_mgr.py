@@ -0,0 +1,200 @@
+#Tests for the queue manager's lane queue and asyncio worker pool.
+
+import asyncio as asy
+import pytest
+import src.managers.QueueMgr as qm
+
+opts = {'depth': '10', 'job_count': '3', 'max_guilds': '10',
+        'max_guild_reqs': '10', 'mode': 'async', 'starve_limit': '2'}
+
+
+@pytest.fixture(autouse=True)
+def _Jobs():
+    #Job bookkeeping is package level, so each test starts from empty.
+    qm.jobs.clear()
+    yield
+    qm.jobs.clear()
+
+def _Request(guild, user, replies: list, cmd: str = 'list') -> dict:
+    async def _Post(msg):
+        replies.append(msg)
+
+    return {'data': {'guild': guild, 'id': user, 'cmd': cmd},
+            'metadata': {'poster': _Post}}
+
+def test_lanes_served_by_priority():
+    lane_q = qm.LaneQueue({'starve_limit': 100}, 10)
+    lane_q.put_nowait('b1', 'background')
+    lane_q.put_nowait('r1', 'reminder')
+    lane_q.put_nowait('i1', 'interactive')
+    lane_q.put_nowait('i2')
+
+    assert [lane_q.get_nowait() for _ in range(4)] == ['i1', 'i2', 'r1', 'b1']
+
+    with pytest.raises(asy.QueueEmpty):
+        lane_q.get_nowait()
+
+def test_starved_lane_gets_a_turn():
+    lane_q = qm.LaneQueue({'starve_limit': 2}, 10)
+
+    for x in range(5):
+        lane_q.put_nowait(f"i{x}")
+
+    lane_q.put_nowait('b0', 'background')
+
+    assert [lane_q.get_nowait() for _ in range(4)] == ['i0', 'i1', 'b0', 'i2']
+
+def test_lane_depth_limits():
+    lane_q = qm.LaneQueue({'depth_background': 1}, 5)
+    lane_q.put_nowait('b0', 'background')
+
+    with pytest.raises(asy.QueueFull):
+        lane_q.put_nowait('b1', 'background')
+
+    lane_q.put_nowait('i0')
+
+    assert lane_q.Stats()['background'] == {'depth': 1, 'limit': 1,
+                                            'served': 0, 'avg_wait': 0.0,
+                                            'max_wait': 0.0,
+                                            'oldest': pytest.approx(0, abs=1)}
+
+def test_background_commands_use_background_lane():
+    async def _Main():
+        manager = qm.Manager(asy.get_running_loop(), 1, opts)
+
+        assert manager.GetLane({'cmd': 'sync'}) == 'background'
+        assert manager.GetLane({'cmd': 'list'}) == 'interactive'
+        assert manager.GetLane({'cmd': 'sync', 'lane': 'reminder'}) == 'reminder'
+
+    asy.run(_Main())
+
+def test_worker_count_from_job_count():
+    async def _Main():
+        manager = qm.Manager(asy.get_running_loop(), 1, opts)
+        manager.Run()
+        count = len(manager.workers)
+        await manager.Shutdown(0)
+
+        return count
+
+    assert asy.run(_Main()) == 3
+
+def test_workers_run_jobs_and_reply():
+    replies = []
+
+    async def _Main():
+        manager = qm.Manager(asy.get_running_loop(), 1, opts)
+        manager.Run()
+
+        for user in range(4):
+            assert 'added' in manager.Add(_Request(1, user, replies))
+
+        assert await manager.Shutdown(1) == 0
+
+    asy.run(_Main())
+
+    assert sorted(x['id'] for x in replies) == [0, 1, 2, 3]
+    assert qm.jobs == {}
+
+def test_shutdown_flushes_unstarted_jobs():
+    replies = []
+
+    async def _Main():
+        manager = qm.Manager(asy.get_running_loop(), 1, opts)
+        manager.Add(_Request(1, 1, replies))
+        manager.Add(_Request(2, 2, replies))
+        dropped = await manager.Shutdown(0)
+        await asy.sleep(0)
+
+        assert "restarting" in manager.Add(_Request(3, 3, replies))
+
+        return dropped
+
+    assert asy.run(_Main()) == 2
+    assert all('cancelled' in x['content'] for x in replies)
+    assert qm.jobs == {}
+
+def test_duplicate_and_guild_limits():
+    replies = []
+    limited = dict(opts, max_guild_reqs='2')
+
+    async def _Main():
+        manager = qm.Manager(asy.get_running_loop(), 1, limited)
+
+        assert 'added' in manager.Add(_Request(1, 1, replies))
+        assert 'already have a job' in manager.Add(_Request(1, 1, replies))
+        assert 'added' in manager.Add(_Request(1, 2, replies))
+        assert 'too many requests' in manager.Add(_Request(1, 3, replies))
+        assert manager.Flush(notify=False) == 2
+
+    asy.run(_Main())
+
+class FakeResponse:
+
+    def __init__(self, fail: bool = False):
+        self.fail    = fail
+        self.initial = []
+
+    def is_done(self) -> bool:
+        return bool(self.initial)
+
+    async def defer(self, thinking: bool = False):
+        if self.fail:
+            raise RuntimeError('Unknown interaction')
+
+        self.initial.append('defer')
+
+    async def send_message(self, content, ephemeral: bool = False):
+        self.initial.append(content)
+
+
+class FakeInteraction:
+
+    def __init__(self, fail: bool = False):
+        self.channel  = self
+        self.followup = self
+        self.id       = 1
+        self.response = FakeResponse(fail)
+        self.sent     = []
+
+    async def send(self, content, ephemeral: bool = False):
+        self.sent.append(content)
+
+def test_failed_defer_replies_in_channel():
+    interaction = FakeInteraction(fail=True)
+
+    async def _Main():
+        defer = asy.ensure_future(interaction.response.defer())
+        await qm.PostReply({'interaction': interaction, 'defer': defer,
+                            'content': 'result'})
+
+    asy.run(_Main())
+
+    assert interaction.sent == ['result']
+    assert interaction.response.initial == []
+
+def test_thread_mode_sends_one_initial_response():
+    threaded     = dict(opts, mode='thread', reply_budget='0', depth='50',
+                        max_guilds='50')
+    interactions = [FakeInteraction() for _ in range(20)]
+
+    async def _Main():
+        manager = qm.Manager(asy.get_running_loop(), 1, threaded)
+        manager.Run()
+
+        for user, interaction in enumerate(interactions):
+            manager.Add({'data': {'guild': user, 'id': user, 'cmd': 'list'},
+                         'metadata': {'interaction': interaction}})
+
+        await asy.sleep(0.2)
+        await manager.Shutdown(1)
+
+    asy.run(_Main())
+
+    #Whether the deadline defer or the reply won, each interaction got one
+    #initial response and its result exactly once.
+    for interaction in interactions:
+        replies = interaction.response.initial + interaction.sent
+
+        assert len(interaction.response.initial) == 1
+        assert [x for x in replies if x != 'defer'] == ['Done!']
@@ -0,0 +1,56 @@
+#Tests for the token-bucket rate limiter.
+
+import pytest
+import src.utilities.rate_limiter as rl
+import time
+
+
+def test_burst_then_limited():
+    limiter = rl.TokenBucketLimiter({'burst_user': 2, 'rate_user': 1})
+
+    assert limiter.Take(1, 10) == 0
+    assert limiter.Take(1, 10) == 0
+    assert 0 < limiter.Take(1, 10) <= 1.0
+
+def test_users_have_separate_buckets():
+    limiter = rl.TokenBucketLimiter({'burst_user': 1})
+
+    assert limiter.Take(1, 10) == 0
+    assert limiter.Take(1, 10) > 0
+    assert limiter.Take(1, 11) == 0
+
+def test_rejected_take_leaves_other_buckets_alone():
+    limiter = rl.TokenBucketLimiter({'burst_user': 1, 'burst_guild': 5})
+    limiter.Take(1, 10)
+    limiter.Take(1, 10)
+
+    #Only the first request took a guild token.
+    assert limiter.buckets[('guild', 1)][0] == pytest.approx(4, abs=0.01)
+
+def test_check_does_not_consume():
+    limiter = rl.TokenBucketLimiter({'burst_user': 1})
+
+    assert limiter.Check(1, 10) == 0
+    assert limiter.Check(1, 10) == 0
+    assert limiter.Take(1, 10) == 0
+    assert limiter.Check(1, 10) > 0
+
+def test_tokens_refill():
+    limiter = rl.TokenBucketLimiter({'burst_user': 1, 'rate_user': 1000})
+    limiter.Take(1, 10)
+    time.sleep(0.01)
+
+    assert limiter.Take(1, 10) == 0
+
+@pytest.mark.parametrize('opt', ['rate_guild', 'rate_user', 'rate_cmd',
+                                 'burst_user'])
+def test_non_positive_settings_rejected(opt):
+    with pytest.raises(ValueError):
+        rl.TokenBucketLimiter({opt: '0'})
+
+def test_idle_buckets_evicted():
+    limiter = rl.TokenBucketLimiter({'bucket_idle': 10})
+    limiter.Take(1, 10)
+
+    assert limiter.Evict(time.monotonic() + 11) == 3
+    assert len(limiter) == 0
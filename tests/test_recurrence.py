@@ -0,0 +1,97 @@
+#Tests for the RRULE subset used by repeating events.
+
+import datetime as dt
+import pytest
+import src.utilities.recurrence as rc
+
+utc = dt.timezone.utc
+
+
+def _Utc(*args) -> dt.datetime:
+    return dt.datetime(*args, tzinfo=utc)
+
+def test_parse_rule():
+    rule = rc.ParseRule('RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY=WE,MO;COUNT=4')
+
+    assert rule['freq'] == 'WEEKLY'
+    assert rule['interval'] == 2
+    assert rule['count'] == 4
+    assert rule['byday'] == (0, 2)
+
+@pytest.mark.parametrize('text', ['FREQ=HOURLY', 'FREQ=DAILY;INTERVAL=0',
+                                  'FREQ=WEEKLY;BYDAY=XX',
+                                  'FREQ=MONTHLY;BYMONTHDAY=32'])
+def test_parse_rule_rejects(text):
+    with pytest.raises(ValueError):
+        rc.ParseRule(text)
+
+def test_weekly_by_day():
+    #2024-01-01 is a Monday.
+    found = rc.Expand('FREQ=WEEKLY;BYDAY=MO,FR', _Utc(2024, 1, 1, 18),
+                      'UTC', _Utc(2024, 1, 1), _Utc(2024, 1, 15))
+
+    assert [x.day for x in found] == [1, 5, 8, 12]
+
+def test_count_and_until():
+    first = _Utc(2024, 1, 1, 12)
+
+    assert len(rc.Expand('FREQ=DAILY;COUNT=3', first, 'UTC', first,
+                         _Utc(2024, 2, 1))) == 3
+    assert len(rc.Expand('FREQ=DAILY;UNTIL=20240105T120000Z', first, 'UTC',
+                         first, _Utc(2024, 2, 1))) == 5
+
+def test_count_applies_from_first_occurrence():
+    #A window starting later still counts the occurrences before it.
+    found = rc.Expand('FREQ=DAILY;COUNT=5', _Utc(2024, 1, 1, 12), 'UTC',
+                      _Utc(2024, 1, 4), _Utc(2024, 2, 1))
+
+    assert [x.day for x in found] == [4, 5]
+
+def test_local_time_kept_across_dst():
+    #19:00 in New York is 00:00 UTC in winter and 23:00 UTC once DST starts
+    #on 2024-03-10.
+    found = rc.Expand('FREQ=WEEKLY', _Utc(2024, 3, 3, 0), 'America/New_York',
+                      _Utc(2024, 3, 1), _Utc(2024, 3, 20))
+
+    assert [x.hour for x in found] == [0, 0, 23]
+
+def test_monthly_by_month_day_skips_short_months():
+    found = rc.Expand('FREQ=MONTHLY;BYMONTHDAY=31', _Utc(2024, 1, 31, 12),
+                      'UTC', _Utc(2024, 1, 1), _Utc(2024, 6, 1))
+
+    assert [x.month for x in found] == [1, 3, 5]
+
+def test_next_and_invalidate():
+    rc.Invalidate()
+    event = {'_id': 'e1', 'start': _Utc(2024, 1, 1, 18), 'recur': 'FREQ=DAILY'}
+
+    assert rc.Next(event, 'UTC', _Utc(2024, 1, 10, 19)) == _Utc(2024, 1, 11, 18)
+    assert rc.Invalidate('e1') == 1
+    assert rc.Invalidate('e1') == 0
+
+def test_eviction_keeps_event_maps_bounded(monkeypatch):
+    rc.Invalidate()
+    monkeypatch.setattr(rc, 'cache_size', 2)
+    events = [{'_id': f"e{x}", 'start': _Utc(2024, 1, 1 + x, 18),
+               'recur': 'FREQ=DAILY'} for x in range(5)]
+    #Same rule and start as e4, so they share one expansion.
+    twin   = dict(events[4], _id='twin')
+
+    for event in events + [twin]:
+        rc.Occurrences(event, 'UTC', _Utc(2024, 2, 1))
+
+    assert len(rc.expansions) == 2
+    assert set(rc.by_event) == {'e3', 'e4', 'twin'}
+    assert sum(len(x) for x in rc.by_key.values()) == 3
+
+    #Dropping a shared expansion clears it for every event using it.
+    assert rc.Invalidate('twin') == 1
+    assert set(rc.by_event) == {'e3'}
+    assert rc.Invalidate('e4') == 0
+    rc.Invalidate()
+
+def test_non_repeating_event():
+    event = {'_id': 'e2', 'start': _Utc(2024, 1, 2, 18)}
+
+    assert rc.Occurrences(event, 'UTC', _Utc(2024, 1, 1)) == (event['start'],)
+    assert rc.Next(event, 'UTC', _Utc(2024, 1, 3)) is None
@@ -0,0 +1,88 @@
+#Tests for the debounced RSVP reaction pipeline.
+
+import asyncio as asy
+import src.database.models as md
+import src.managers.EditMgr as em
+import src.managers.RsvpMgr as rm
+
+sched = md.Schedule(_id=10, rsvp_on=True, rsvp_clr='x',
+                    rsvp_opts={'t': 'Tank', 'h': 'Healer'})
+event = {'_id': 'e1', 'ch_id': '10', 'msg_id': '99', 'title': 'Raid',
+         'rsvp_lmts': {'Tank': 1}}
+
+
+def _Render(event) -> str:
+    return ' '.join(f"{x}={','.join(y)}" for x, y in sorted(event.rsvp_mbrs.items()))
+
+def _Pipeline(loop, writes: list, debounce: float = 0.01):
+    editor = em.EditCoalescer(loop, None)
+    rsvp   = rm.RsvpPipeline(loop,
+                             render=_Render,
+                             persist=lambda x, y: writes.append((x, y)),
+                             editor=editor,
+                             opts={'debounce': debounce})
+
+    return rsvp, editor
+
+def test_reactions_are_capped():
+    many = md.Schedule(rsvp_clr='x', rsvp_opts={str(x): 'r' for x in range(30)})
+
+    assert len(rm.Reactions(many)) == rm.max_reactions
+    assert rm.Reactions(many)[-1] == 'x'
+    assert rm.Reactions(sched) == ['t', 'h', 'x']
+
+def test_burst_is_applied_once():
+    writes = []
+
+    async def _Main():
+        rsvp, editor = _Pipeline(asy.get_running_loop(), writes)
+        rsvp.Track(event, sched)
+
+        assert rsvp.OnReaction(99, 1, 't', True)
+        assert rsvp.OnReaction(99, 2, 'h', True)
+        assert rsvp.OnReaction(99, 3, 'h', True)
+        assert not rsvp.OnReaction(55, 1, 't', True)
+        assert writes == []
+
+        await asy.sleep(0.05)
+
+        return editor
+
+    editor = asy.run(_Main())
+
+    assert writes == [('e1', {'rsvp_mbrs': {'Tank': ['1'], 'Healer': ['2', '3']}})]
+    assert editor.pending[99] == (10, 'Healer=2,3 Tank=1')
+
+def test_limits_clear_and_removes():
+    writes = []
+
+    async def _Main():
+        rsvp, _ = _Pipeline(asy.get_running_loop(), writes)
+        rsvp.Track(event, sched)
+        state = rsvp.msgs[99]
+
+        #Tank is full after one signup; unknown emotes are ignored.
+        for user, emote in ((1, 't'), (2, 't'), (2, 'h'), (3, 'zz')):
+            rsvp.OnReaction(99, user, emote, True)
+
+        assert rsvp.Flush() == 1
+        assert state['event'].rsvp_mbrs == {'Tank': ['1'], 'Healer': ['2']}
+        assert rsvp.stats['rejected'] == 1
+
+        rsvp.OnReaction(99, 1, 'x', True)
+        rsvp.OnReaction(99, 2, 'h', False)
+
+        assert rsvp.Flush() == 1
+        assert state['event'].rsvp_mbrs == {'Tank': [], 'Healer': []}
+
+        #Nothing changed, so nothing is written.
+        rsvp.OnReaction(99, 2, 'h', False)
+
+        assert rsvp.Flush() == 0
+        assert len(writes) == 2
+
+        rsvp.Untrack(99)
+
+        assert len(rsvp) == 0
+
+    asy.run(_Main())
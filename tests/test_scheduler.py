@@ -0,0 +1,90 @@
+#Tests for the heap-based timer scheduler.
+
+import asyncio as asy
+import datetime as dt
+import src.managers.SchedulerMgr as sm
+import time
+
+
+def _Scheduler(fire=None, opts=None):
+    return sm.Scheduler(loop=None, fire=fire or (lambda key, payload: None),
+                        opts=opts)
+
+def test_to_epoch_formats():
+    when = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+
+    assert sm.ToEpoch(when) == when.timestamp()
+    assert sm.ToEpoch(when.replace(tzinfo=None)) == when.timestamp()
+    assert sm.ToEpoch("ISODate('2024-01-01T00:00:00Z')") == when.timestamp()
+    assert sm.ToEpoch(1704067200) == when.timestamp()
+    assert sm.ToEpoch('nonsense') is None
+
+def test_flatten_stamps():
+    assert sm.FlattenStamps(None) == []
+    assert sm.FlattenStamps({'a': [1, 2], 'b': 3}) == [1, 2, 3]
+
+def test_pop_due_in_order():
+    sched = _Scheduler()
+    sched.Add(('a', 'start', 0), 30)
+    sched.Add(('b', 'start', 0), 10)
+    sched.Add(('c', 'start', 0), 20)
+
+    assert sched.NextDue() == 10
+    assert [x[0][0] for x in sched.PopDue(25)] == ['b', 'c']
+    assert len(sched) == 1
+
+def test_reschedule_and_cancel():
+    sched = _Scheduler()
+    sched.Add(('a', 'start', 0), 30)
+    sched.Add(('b', 'start', 0), 10)
+    sched.Add(('a', 'start', 0), 5)
+
+    assert len(sched) == 2
+    assert sched.NextDue() == 5
+    assert sched.Cancel(('a', 'start', 0))
+    assert not sched.Cancel(('a', 'start', 0))
+    assert sched.NextDue() == 10
+
+def test_load_event_skips_disabled_and_stale():
+    sched = _Scheduler()
+    now   = time.time()
+    event = {'_id'     : 1,
+             'start'   : now + 3600,
+             'remimds' : [now + 600, now - 3600],
+             'end_rems': [now + 7200],
+             'dsbl_ed' : True}
+
+    assert sched.LoadEvent(event) == 2
+    assert sched.CancelEvent(1) == 2
+    assert len(sched) == 0
+
+def test_load_repeating_event_picks_next_occurrence():
+    sched = _Scheduler()
+    first = dt.datetime.now(dt.timezone.utc).replace(microsecond=0) - \
+            dt.timedelta(days=3, hours=-2)
+    event = {'_id'     : 1,
+             'start'   : first,
+             'remimds' : [first - dt.timedelta(minutes=10)],
+             'recur'   : 'FREQ=DAILY'}
+
+    assert sched.LoadEvent(event) == 2
+
+    #Today's occurrence, two hours out, with its reminder moved along.
+    assert sched.NextDue() == first.timestamp() + 3 * 86400 - 600
+
+def test_run_fires_due_timers():
+    fired = []
+
+    async def _Main():
+        sched = sm.Scheduler(loop=asy.get_running_loop(),
+                             fire=lambda key, payload: fired.append(key))
+        task  = asy.get_running_loop().create_task(sched.Run())
+        sched.Add(('a', 'start', 0), time.time() + 0.05)
+        sched.Add(('b', 'start', 0), time.time() + 0.01)
+        await asy.sleep(0.2)
+        sched.Stop()
+        await task
+
+    asy.run(_Main())
+
+    assert [x[0] for x in fired] == ['b', 'a']
@@ -0,0 +1,173 @@
+#Tests for the Google Calendar sync engine, run against a local fake of the
+#Calendar events.list endpoint.
+
+import asyncio as asy
+import datetime as dt
+import http.server
+import json
+import pytest
+import src.database.models as md
+import src.managers.SyncMgr as syn
+import src.utilities.http_client as hc
+import threading as th
+import urllib.parse
+
+now = dt.datetime(2024, 5, 1, tzinfo=dt.timezone.utc)
+
+
+class Calendar(http.server.BaseHTTPRequestHandler):
+    """Answers events.list with whatever the test's 'answer' callable
+       returns for the query and If-None-Match header.
+    """
+
+    def do_GET(self):
+        query  = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        match  = self.headers.get('If-None-Match')
+        self.server.seen.append((urllib.parse.urlsplit(self.path).path, query, match))
+        status, body, etag = self.server.answer(query, match)
+        data   = json.dumps(body).encode() if body is not None else b''
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+
+        if etag:
+            self.send_header('ETag', etag)
+
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeDb:
+
+    def __init__(self, sched: md.Schedule):
+        self.events = {}
+        self.scheds = {str(sched._id): sched.ToBson()}
+
+    async def GetSchedule(self, sched_id):
+        return self.scheds.get(str(sched_id))
+
+    async def PutSchedule(self, sched_id, doc):
+        self.scheds[str(sched_id)] = md.Schedule.Coerce(doc).Validate().ToBson()
+
+    async def GetEvents(self, guild_id, ch_id):
+        return [x for x in self.events.values() if x['ch_id'] == str(ch_id)]
+
+    async def PutEvent(self, event_id, doc):
+        self.events[event_id] = md.Event.Coerce(doc).Validate().ToBson()
+
+    async def DeleteEvent(self, event_id):
+        del self.events[event_id]
+
+
+def _Item(google_id: str, days: int, title: str = None) -> dict:
+    start = now + dt.timedelta(days=days)
+
+    return {'id'      : google_id,
+            'summary' : title or google_id,
+            'start'   : {'dateTime': start.isoformat()},
+            'end'     : {'dateTime': (start + dt.timedelta(hours=1)).isoformat()}}
+
+@pytest.fixture
+def server():
+    server        = http.server.HTTPServer(('127.0.0.1', 0), Calendar)
+    server.seen   = []
+    server.answer = None
+    thread        = th.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def engine(server):
+    sched  = md.Schedule(_id=10, guild_id=1, sync_addr='team@example.com',
+                         sync_len=7, timezone='UTC')
+    client = hc.HttpClient({'retries': 0})
+    db     = FakeDb(sched)
+    sync   = syn.CalendarSync(db, {'base_url': f"http://127.0.0.1:{server.server_port}"},
+                              client)
+
+    yield sync, db
+
+    client.Close()
+
+def _Names(events) -> list:
+    return sorted(x.google_id for x in events)
+
+def test_full_then_incremental_sync(server, engine):
+    sync, db = engine
+
+    def _Full(query, match):
+        if 'timeMin' not in query:
+            return 500, None, ''
+
+        if query.get('pageToken') == 'p2':
+            return 200, {'items': [_Item('c', 3)], 'nextSyncToken': 'tok1'}, '"e1"'
+
+        return 200, {'items': [_Item('a', 1), _Item('b', 2)], 'nextPageToken': 'p2'}, '"e0"'
+
+    server.answer = _Full
+    result        = asy.run(sync.Sync(10, now))
+
+    assert result['full']
+    assert _Names(result['added']) == ['a', 'b', 'c']
+    assert server.seen[0][0] == '/calendars/team%40example.com/events'
+    assert server.seen[0][1]['timeMax'] == (now + dt.timedelta(days=7)).isoformat()
+    assert db.scheds['10']['sync_tok'] == 'tok1'
+    assert db.scheds['10']['sync_etag'] == '"e1"'
+
+    #An unchanged calendar answers the conditional request with a 304.
+    server.answer = lambda query, match: (304, None, '') if match == '"e1"' \
+                                         else (500, None, '')
+    result        = asy.run(sync.Sync(10, now))
+
+    assert not result['added'] and not result['changed'] and not result['removed']
+    assert server.seen[-1][1]['syncToken'] == 'tok1'
+    assert 'timeMin' not in server.seen[-1][1]
+
+    #Changes outside the window are dropped rather than stored.
+    def _Changes(query, match):
+        items = [_Item('a', 1, 'renamed'),
+                 {'id': 'b', 'status': 'cancelled'},
+                 _Item('c', 30),
+                 _Item('d', 40)]
+
+        return 200, {'items': items, 'nextSyncToken': 'tok2'}, '"e2"'
+
+    server.answer = _Changes
+    result        = asy.run(sync.Sync(10, now))
+
+    assert not result['full']
+    assert _Names(result['changed']) == ['a']
+    assert _Names(result['removed']) == ['b', 'c']
+    assert sorted(x['google_id'] for x in db.events.values()) == ['a']
+    assert db.events[syn.EventId(10, 'a')]['title'] == 'renamed'
+    assert db.scheds['10']['sync_tok'] == 'tok2'
+
+def test_expired_token_reimports(server, engine):
+    sync, db = engine
+
+    def _Answer(query, match):
+        if 'timeMin' in query:
+            items = [_Item('a', 1)] if server.reimport else [_Item('a', 1), _Item('b', 2)]
+            return 200, {'items': items, 'nextSyncToken': 'tok'}, '"e"'
+
+        return 410, None, ''
+
+    server.reimport = False
+    server.answer   = _Answer
+    asy.run(sync.Sync(10, now))
+    server.reimport = True
+    result          = asy.run(sync.Sync(10, now))
+
+    #The 410 falls back to a full import, which removes what it didn't list.
+    assert result['full']
+    assert [x[1].get('syncToken') for x in server.seen] == [None, 'tok', None]
+    assert result['unchanged'] == 1
+    assert _Names(result['removed']) == ['b']
+    assert list(db.events) == [syn.EventId(10, 'a')]
@@ -0,0 +1,99 @@
+#Tests for the write-coalescing buffer.
+
+import asyncio as asy
+import src.database.write_buffer as wb
+
+
+def test_updates_merge_per_document():
+    batches = []
+
+    async def _Main():
+        buf = wb.WriteBuffer(lambda batch: batches.append(batch), window=10)
+        buf.Put(1, {'a': 1, 'b': 1})
+        buf.Put(1, {'b': 2})
+        buf.Put(2, {'a': 3})
+
+        assert len(buf) == 2
+        assert await buf.Flush() == 2
+        assert await buf.Flush() == 0
+
+    asy.run(_Main())
+
+    assert batches == [{1: {'a': 1, 'b': 2}, 2: {'a': 3}}]
+
+def test_window_flushes_automatically():
+    batches = []
+
+    async def _Flush(batch):
+        batches.append(batch)
+
+    async def _Main():
+        buf = wb.WriteBuffer(_Flush, window=0.01)
+        buf.Put(1, {'a': 1})
+        await asy.sleep(0.1)
+
+    asy.run(_Main())
+
+    assert batches == [{1: {'a': 1}}]
+
+def test_max_batch_flushes_early():
+    batches = []
+
+    async def _Main():
+        buf = wb.WriteBuffer(lambda batch: batches.append(batch), window=10,
+                             max_batch=2)
+        buf.Put(1, {'a': 1})
+        buf.Put(2, {'a': 1})
+        await asy.sleep(0.05)
+        await buf.Close()
+
+    asy.run(_Main())
+
+    assert batches == [{1: {'a': 1}, 2: {'a': 1}}]
+
+def test_failed_batch_kept_under_newer_writes():
+    batches = []
+    fail    = [True]
+
+    async def _Flush(batch):
+        if fail.pop():
+            raise RuntimeError("down")
+        batches.append(batch)
+
+    async def _Main():
+        buf = wb.WriteBuffer(_Flush, window=10)
+        buf.Put(1, {'a': 1, 'b': 1})
+
+        assert await buf.Flush() == 0
+
+        fail.append(False)
+        buf.Put(1, {'b': 2})
+
+        assert await buf.Flush() == 1
+        assert buf.stats['errors'] == 1
+
+    asy.run(_Main())
+
+    assert batches == [{1: {'a': 1, 'b': 2}}]
+
+def test_flushes_never_overlap():
+    active  = []
+    overlap = []
+
+    async def _Flush(batch):
+        active.append(batch)
+        overlap.append(len(active) > 1)
+        await asy.sleep(0.02)
+        active.remove(batch)
+
+    async def _Main():
+        buf = wb.WriteBuffer(_Flush, window=10)
+        buf.Put(1, {'a': 1})
+        first = asy.get_running_loop().create_task(buf.Flush())
+        await asy.sleep(0)
+        buf.Put(1, {'a': 2})
+        await asy.gather(first, buf.Flush())
+
+    asy.run(_Main())
+
+    assert overlap == [False, False]